@@ -0,0 +1,44 @@
+"""Unique natural keys for curriculum content
+
+Revision ID: 002_curriculum_natural_keys
+Revises: 001_initial_tables
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '002_curriculum_natural_keys'
+down_revision = '001_initial_tables'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # The content importer upserts on these keys
+    with op.batch_alter_table('chapter') as batch_op:
+        batch_op.create_unique_constraint('uq_chapter_subject_order', ['subject_id', 'order'])
+
+    with op.batch_alter_table('section') as batch_op:
+        batch_op.create_unique_constraint('uq_section_chapter_order', ['chapter_id', 'order'])
+
+    with op.batch_alter_table('assessment') as batch_op:
+        batch_op.create_unique_constraint('uq_assessment_subject_title', ['subject_id', 'title'])
+
+    with op.batch_alter_table('question') as batch_op:
+        batch_op.create_unique_constraint('uq_question_assessment_order', ['assessment_id', 'order'])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('question') as batch_op:
+        batch_op.drop_constraint('uq_question_assessment_order', type_='unique')
+
+    with op.batch_alter_table('assessment') as batch_op:
+        batch_op.drop_constraint('uq_assessment_subject_title', type_='unique')
+
+    with op.batch_alter_table('section') as batch_op:
+        batch_op.drop_constraint('uq_section_chapter_order', type_='unique')
+
+    with op.batch_alter_table('chapter') as batch_op:
+        batch_op.drop_constraint('uq_chapter_subject_order', type_='unique')
@@ -0,0 +1,32 @@
+"""Rubric fields and auto-scoring marker for subjective answers
+
+Revision ID: 003_subjective_scoring
+Revises: 002_curriculum_natural_keys
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '003_subjective_scoring'
+down_revision = '002_curriculum_natural_keys'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('question', sa.Column('rubric_keywords', sa.Text(), nullable=True))
+    op.add_column('question', sa.Column('min_words', sa.Integer(), nullable=True))
+    op.add_column('question', sa.Column('max_words', sa.Integer(), nullable=True))
+    op.add_column('answer', sa.Column('auto_scored_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('answer') as batch_op:
+        batch_op.drop_column('auto_scored_at')
+
+    with op.batch_alter_table('question') as batch_op:
+        batch_op.drop_column('max_words')
+        batch_op.drop_column('min_words')
+        batch_op.drop_column('rubric_keywords')
@@ -0,0 +1,43 @@
+"""Daily and weekly study time rollups
+
+Revision ID: 004_study_rollups
+Revises: 003_subjective_scoring
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '004_study_rollups'
+down_revision = '003_subjective_scoring'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    for table in ('study_rollup_daily', 'study_rollup_weekly'):
+        op.create_table(table,
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('subject', sa.String(length=100), nullable=False),
+            sa.Column('bucket', sa.Date(), nullable=False),
+            sa.Column('minutes', sa.Integer(), server_default='0', nullable=False),
+            sa.Column('sessions', sa.Integer(), server_default='0', nullable=False),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('user_id', 'subject', 'bucket', name=f'uq_{table}')
+        )
+
+    op.create_table('rollup_watermark',
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('last_id', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('rollup_watermark')
+    op.drop_table('study_rollup_weekly')
+    op.drop_table('study_rollup_daily')
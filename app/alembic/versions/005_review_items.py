@@ -0,0 +1,38 @@
+"""Spaced repetition review items
+
+Revision ID: 005_review_items
+Revises: 004_study_rollups
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '005_review_items'
+down_revision = '004_study_rollups'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('review_item',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('question_id', sa.Integer(), nullable=False),
+        sa.Column('due_at', sa.DateTime(), nullable=False),
+        sa.Column('ease', sa.Float(), server_default='2.5', nullable=False),
+        sa.Column('interval', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('repetitions', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('last_reviewed_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['question_id'], ['question.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'question_id', name='uq_review_item_user_question')
+    )
+    op.create_index('ix_review_item_user_due', 'review_item', ['user_id', 'due_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_review_item_user_due', table_name='review_item')
+    op.drop_table('review_item')
@@ -0,0 +1,32 @@
+"""IRT item parameters for adaptive assessments
+
+Revision ID: 006_irt_parameters
+Revises: 005_review_items
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '006_irt_parameters'
+down_revision = '005_review_items'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('question', sa.Column('irt_difficulty', sa.Float(), nullable=True))
+    op.add_column('question', sa.Column('irt_discrimination', sa.Float(), nullable=True))
+    op.add_column('question', sa.Column('irt_responses', sa.Integer(), nullable=True))
+    op.add_column('assessment_attempt', sa.Column('ability', sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('assessment_attempt') as batch_op:
+        batch_op.drop_column('ability')
+
+    with op.batch_alter_table('question') as batch_op:
+        batch_op.drop_column('irt_responses')
+        batch_op.drop_column('irt_discrimination')
+        batch_op.drop_column('irt_difficulty')
@@ -0,0 +1,60 @@
+"""Offline sync receipts, subjective drafts and a natural key for progress
+
+Revision ID: 007_offline_sync
+Revises: 006_irt_parameters
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '007_offline_sync'
+down_revision = '006_irt_parameters'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Keep the newest row of any duplicated topic so the unique key can be added
+    op.execute(
+        'DELETE FROM progress WHERE id NOT IN ('
+        'SELECT id FROM (SELECT MAX(id) AS id FROM progress GROUP BY user_id, subject, topic) AS newest)'
+    )
+    with op.batch_alter_table('progress') as batch_op:
+        batch_op.create_unique_constraint('uq_progress_user_subject_topic', ['user_id', 'subject', 'topic'])
+
+    op.create_table('subjective_draft',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('subject', sa.String(length=100), nullable=False),
+        sa.Column('chapter', sa.Integer(), nullable=False),
+        sa.Column('answers', sa.Text(), nullable=True),
+        sa.Column('time_spent', sa.Integer(), nullable=True),
+        sa.Column('saved_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'subject', 'chapter', name='uq_subjective_draft_user_chapter')
+    )
+
+    op.create_table('sync_receipt',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('idempotency_key', sa.String(length=64), nullable=False),
+        sa.Column('event_type', sa.String(length=50), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'idempotency_key', name='uq_sync_receipt_user_key')
+    )
+    op.create_index('ix_sync_receipt_created_at', 'sync_receipt', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_sync_receipt_created_at', table_name='sync_receipt')
+    op.drop_table('sync_receipt')
+    op.drop_table('subjective_draft')
+
+    with op.batch_alter_table('progress') as batch_op:
+        batch_op.drop_constraint('uq_progress_user_subject_topic', type_='unique')
@@ -0,0 +1,32 @@
+"""Checkpoints for resumable online backfills
+
+Revision ID: 008_backfill_checkpoints
+Revises: 007_offline_sync
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '008_backfill_checkpoints'
+down_revision = '007_offline_sync'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('backfill_checkpoint',
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('last_id', sa.BigInteger(), nullable=False),
+        sa.Column('max_id', sa.BigInteger(), nullable=False),
+        sa.Column('rows', sa.BigInteger(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('backfill_checkpoint')
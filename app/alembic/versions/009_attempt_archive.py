@@ -0,0 +1,60 @@
+"""Cold archive tables for old attempts and answers
+
+Revision ID: 009_attempt_archive
+Revises: 008_backfill_checkpoints
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '009_attempt_archive'
+down_revision = '008_backfill_checkpoints'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('assessment_attempt_archive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('assessment_id', sa.Integer(), nullable=False),
+        sa.Column('score', sa.Float(), nullable=True),
+        sa.Column('total_marks', sa.Integer(), nullable=True),
+        sa.Column('percentage', sa.Float(), nullable=True),
+        sa.Column('time_taken', sa.Integer(), nullable=True),
+        sa.Column('ability', sa.Float(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('completed_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        mysql_row_format='COMPRESSED'
+    )
+    op.create_index('ix_attempt_archive_user', 'assessment_attempt_archive', ['user_id', 'id'], unique=False)
+
+    op.create_table('answer_archive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('attempt_id', sa.Integer(), nullable=False),
+        sa.Column('question_id', sa.Integer(), nullable=False),
+        sa.Column('answer_text', sa.Text(), nullable=True),
+        sa.Column('is_correct', sa.Boolean(), nullable=True),
+        sa.Column('marks_obtained', sa.Float(), nullable=True),
+        sa.Column('feedback', sa.Text(), nullable=True),
+        sa.Column('auto_scored_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        mysql_row_format='COMPRESSED'
+    )
+    op.create_index('ix_answer_archive_attempt', 'answer_archive', ['attempt_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_answer_archive_attempt', table_name='answer_archive')
+    op.drop_table('answer_archive')
+    op.drop_index('ix_attempt_archive_user', table_name='assessment_attempt_archive')
+    op.drop_table('assessment_attempt_archive')
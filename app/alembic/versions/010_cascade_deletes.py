@@ -0,0 +1,74 @@
+"""ON DELETE CASCADE on every foreign key
+
+Revision ID: 010_cascade_deletes
+Revises: 009_attempt_archive
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from collections import defaultdict
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '010_cascade_deletes'
+down_revision = '009_attempt_archive'
+branch_labels = None
+depends_on = None
+
+# (table, column, referred table)
+FOREIGN_KEYS = [
+    ('chapter', 'subject_id', 'subject'),
+    ('section', 'chapter_id', 'chapter'),
+    ('assessment', 'subject_id', 'subject'),
+    ('assessment', 'chapter_id', 'chapter'),
+    ('question', 'assessment_id', 'assessment'),
+    ('progress', 'user_id', 'user'),
+    ('subjective_draft', 'user_id', 'user'),
+    ('sync_receipt', 'user_id', 'user'),
+    ('upload', 'user_id', 'user'),
+    ('study_session', 'user_id', 'user'),
+    ('study_rollup_daily', 'user_id', 'user'),
+    ('study_rollup_weekly', 'user_id', 'user'),
+    ('review_item', 'user_id', 'user'),
+    ('review_item', 'question_id', 'question'),
+    ('push_subscription', 'user_id', 'user'),
+    ('assessment_attempt', 'user_id', 'user'),
+    ('assessment_attempt', 'assessment_id', 'assessment'),
+    ('answer', 'attempt_id', 'assessment_attempt'),
+    ('answer', 'question_id', 'question'),
+]
+
+# The constraints were created unnamed; SQLite batch mode names the reflected
+# ones with this so they can be dropped, and the new ones get the same names
+NAMING_CONVENTION = {'fk': 'fk_%(table_name)s_%(column_0_name)s'}
+
+
+def _replace_foreign_keys(ondelete):
+    bind = op.get_bind()
+    by_table = defaultdict(list)
+    for table, column, referred in FOREIGN_KEYS:
+        by_table[table].append((column, referred))
+
+    for table, keys in by_table.items():
+        if bind.dialect.name == 'sqlite':
+            with op.batch_alter_table(table, naming_convention=NAMING_CONVENTION) as batch_op:
+                for column, referred in keys:
+                    batch_op.drop_constraint(f'fk_{table}_{column}', type_='foreignkey')
+                    batch_op.create_foreign_key(f'fk_{table}_{column}', referred, [column], ['id'], ondelete=ondelete)
+            continue
+
+        # MariaDB named them <table>_ibfk_<n>; look the names up
+        existing = {tuple(fk['constrained_columns']): fk['name'] for fk in sa.inspect(bind).get_foreign_keys(table)}
+        for column, referred in keys:
+            if (column,) in existing:
+                op.drop_constraint(existing[(column,)], table, type_='foreignkey')
+            op.create_foreign_key(f'fk_{table}_{column}', table, referred, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade() -> None:
+    _replace_foreign_keys('CASCADE')
+
+
+def downgrade() -> None:
+    _replace_foreign_keys(None)
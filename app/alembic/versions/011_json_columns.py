@@ -0,0 +1,45 @@
+"""Native JSON columns for section and question content
+
+Revision ID: 011_json_columns
+Revises: 010_cascade_deletes
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.backfill import Backfill, run_in_migration
+
+# revision identifiers, used by Alembic.
+revision = '011_json_columns'
+down_revision = '010_cascade_deletes'
+branch_labels = None
+depends_on = None
+
+COLUMNS = {
+    'section': ['key_points', 'examples'],
+    'question': ['options', 'rubric_keywords'],
+}
+
+
+def upgrade() -> None:
+    # The JSON type rejects text that is not JSON. Blank values become NULL
+    # and anything else, such as hand-entered plain text, a one-item list
+    for table, columns in COLUMNS.items():
+        for column in columns:
+            run_in_migration(Backfill(
+                f'{table}-{column}-json', table,
+                values={column: sa.text(f"CASE WHEN TRIM({column}) = '' THEN NULL ELSE JSON_ARRAY({column}) END")},
+                where=sa.text(f'{column} IS NOT NULL AND NOT JSON_VALID({column})')))
+
+    for table, columns in COLUMNS.items():
+        with op.batch_alter_table(table) as batch_op:
+            for column in columns:
+                batch_op.alter_column(column, existing_type=sa.Text(), type_=sa.JSON(), existing_nullable=True)
+
+
+def downgrade() -> None:
+    for table, columns in COLUMNS.items():
+        with op.batch_alter_table(table) as batch_op:
+            for column in columns:
+                batch_op.alter_column(column, existing_type=sa.JSON(), type_=sa.Text(), existing_nullable=True)
@@ -0,0 +1,25 @@
+"""Insert time of study sessions, for the rollup settle window
+
+Revision ID: 012_study_session_created_at
+Revises: 011_json_columns
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '012_study_session_created_at'
+down_revision = '011_json_columns'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing rows stay NULL and count as settled
+    op.add_column('study_session', sa.Column('created_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('study_session') as batch_op:
+        batch_op.drop_column('created_at')
@@ -0,0 +1,237 @@
+"""Online, resumable data backfills for migrations on large tables.
+
+A migration that rewrites a column of a table with millions of rows must not
+do it in one ``UPDATE``: MariaDB would hold the row locks for minutes and the
+replicas would fall behind. ``Backfill`` walks the primary key instead and
+commits one small batch at a time:
+
+* Each batch is the next ``batch_size`` ids after the checkpoint. The upper
+  id comes from an index-only ``ORDER BY id LIMIT 1 OFFSET n`` probe, and the
+  batch is written with ``WHERE id > lo AND id <= hi``. The batch size
+  adapts so that one batch takes about ``target_seconds``.
+* A batch commits together with its ``BackfillCheckpoint`` row. Starting an
+  interrupted run again (re-running ``alembic upgrade``) resumes after the
+  last committed batch.
+* After each batch the run sleeps in proportion to the time the batch took
+  (``duty_cycle``), and waits while any replica is more than ``max_lag``
+  seconds behind. A replica that cannot be reached, or has stopped
+  replicating, counts as behind. After ``max_wait`` seconds of waiting the
+  run stops with ``ReplicaWaitTimeout``, and running it again resumes.
+* Progress is logged at most every ``report_seconds``. ``flask backfill
+  status`` shows every checkpoint from another shell.
+
+Rows written while the backfill runs are handled by a dual-write phase.
+``add_dual_write`` installs triggers that compute the new columns on every
+INSERT and UPDATE, so the backfill only has to reach the ids that existed
+when it started. A change usually spans two migrations::
+
+    # add the column, dual-write, backfill
+    op.add_column('answer', sa.Column('score_band', sa.Integer(), nullable=True))
+    add_dual_write(op, 'answer', 'score_band', {'score_band': 'FLOOR(NEW.marks_obtained / 10)'})
+    run_in_migration(Backfill('answer-score-band', 'answer',
+                              values={'score_band': sa.text('FLOOR(marks_obtained / 10)')},
+                              where=sa.text('score_band IS NULL')))
+
+    # a release later, once the application writes score_band itself
+    drop_dual_write(op, 'answer', 'score_band')
+
+On MariaDB with binary logging, creating triggers needs the SUPER privilege
+or ``log_bin_trust_function_creators``.
+"""
+import logging
+import os
+import time
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from app.db_routing import replication_lag
+from app.models import BackfillCheckpoint
+
+log = logging.getLogger('alembic.backfill')
+
+checkpoints = BackfillCheckpoint.__table__
+
+
+class ReplicaWaitTimeout(RuntimeError):
+    """The replicas stayed behind, or out of reach, for longer than ``max_wait``"""
+
+
+class Backfill:
+    """A batched rewrite of one table, identified by ``name`` for checkpointing
+
+    Either ``values`` (column name -> SQL expression, applied with one
+    ``UPDATE`` per batch) or ``process(connection, lo, hi)`` (returns the
+    number of rows it changed, for transformations that need Python) does the
+    work. ``where`` restricts the rows touched within each range; making it
+    false for rows already done (``new_column IS NULL``) keeps a batch cheap
+    to repeat.
+    """
+
+    def __init__(self, name, table, values=None, process=None, where=None, pk='id',
+                 batch_size=2000, min_batch_size=100, max_batch_size=50000, target_seconds=0.5,
+                 duty_cycle=0.5, max_lag=5, max_wait=1800, replicas=None, report_seconds=10):
+        if (values is None) == (process is None):
+            raise ValueError('Give exactly one of values or process')
+        if not 0 < duty_cycle <= 1:
+            raise ValueError('duty_cycle must be above 0 and at most 1')
+        self.name = name
+        self.table = sa.table(table, sa.column(pk), *[sa.column(c) for c in values or ()])
+        self.pk = self.table.c[pk]
+        self.values = values
+        self.process = process
+        self.where = where
+        self.batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.target_seconds = target_seconds
+        self.duty_cycle = duty_cycle
+        self.max_lag = max_lag
+        self.max_wait = max_wait
+        self.replicas = replicas
+        self.report_seconds = report_seconds
+
+    def _checkpoint(self, engine):
+        with engine.begin() as conn:
+            row = conn.execute(sa.select(checkpoints).where(checkpoints.c.name == self.name)).first()
+            if row is None:
+                max_id = conn.execute(sa.select(sa.func.max(self.pk))).scalar() or 0
+                now = datetime.utcnow()
+                conn.execute(sa.insert(checkpoints).values(name=self.name, last_id=0, max_id=max_id, rows=0,
+                                                           started_at=now, updated_at=now))
+                return 0, max_id, 0, None
+            return row.last_id, row.max_id, row.rows, row.finished_at
+
+    def _upper_bound(self, conn, lo, max_id):
+        hi = conn.execute(
+            sa.select(self.pk).where(self.pk > lo, self.pk <= max_id)
+            .order_by(self.pk).offset(self.batch_size - 1).limit(1)
+        ).scalar()
+        return max_id if hi is None else hi
+
+    def _apply(self, conn, lo, hi):
+        if self.process is not None:
+            return self.process(conn, lo, hi)
+        statement = sa.update(self.table).where(self.pk > lo, self.pk <= hi).values(self.values)
+        if self.where is not None:
+            statement = statement.where(self.where)
+        return conn.execute(statement).rowcount
+
+    def _wait_for_replicas(self):
+        if not self.replicas or not self.max_lag:
+            return
+        started = time.monotonic()
+        while True:
+            lags = [replication_lag(engine) for engine in self.replicas]
+            worst = max((lag if lag is not None else float('inf') for lag in lags), default=0)
+            if worst <= self.max_lag:
+                return
+            waited = time.monotonic() - started
+            if self.max_wait is not None and waited >= self.max_wait:
+                raise ReplicaWaitTimeout(
+                    f'{self.name}: replicas still behind after {waited:.0f}s (lags {lags}, None = unreachable '
+                    f'or not replicating); run the migration again to resume')
+            if worst == float('inf'):
+                log.warning('%s: a replica is unreachable or not replicating, pausing', self.name)
+            else:
+                log.info('%s: replicas %ss behind, pausing', self.name, worst)
+            time.sleep(min(worst, 30))
+
+    def run(self, engine):
+        """Process every remaining batch. Returns the number of rows changed in total."""
+        last_id, max_id, rows, finished_at = self._checkpoint(engine)
+        if finished_at is not None:
+            log.info('%s: already finished at %s', self.name, finished_at)
+            return rows
+        log.info('%s: ids %s to %s left', self.name, last_id, max_id)
+
+        started = time.monotonic()
+        start_id = last_id
+        reported = started
+        while last_id < max_id:
+            batch_started = time.monotonic()
+            with engine.begin() as conn:
+                hi = self._upper_bound(conn, last_id, max_id)
+                changed = self._apply(conn, last_id, hi)
+                conn.execute(sa.update(checkpoints).where(checkpoints.c.name == self.name)
+                             .values(last_id=hi, rows=checkpoints.c.rows + changed,
+                                     updated_at=datetime.utcnow()))
+            elapsed = time.monotonic() - batch_started
+            last_id, rows = hi, rows + changed
+
+            # Aim the next batch at target_seconds, changing size at most 2x per step
+            factor = min(2.0, max(0.5, self.target_seconds / max(elapsed, 1e-3)))
+            self.batch_size = int(min(self.max_batch_size, max(self.min_batch_size, self.batch_size * factor)))
+
+            now = time.monotonic()
+            if now - reported >= self.report_seconds or last_id >= max_id:
+                reported = now
+                self._report(start_id, last_id, max_id, rows, now - started)
+
+            if self.duty_cycle < 1:
+                time.sleep(elapsed * (1 - self.duty_cycle) / self.duty_cycle)
+            self._wait_for_replicas()
+
+        with engine.begin() as conn:
+            conn.execute(sa.update(checkpoints).where(checkpoints.c.name == self.name)
+                         .values(finished_at=datetime.utcnow(), updated_at=datetime.utcnow()))
+        log.info('%s: finished, %s rows changed', self.name, rows)
+        return rows
+
+    def _report(self, start_id, last_id, max_id, rows, elapsed):
+        done = (last_id / max_id * 100) if max_id else 100
+        speed = (last_id - start_id) / elapsed if elapsed else 0
+        eta = (max_id - last_id) / speed if speed else 0
+        log.info('%s: id %s of %s (%.1f%%), %s rows changed, %.0f ids/s, %.0f min left',
+                 self.name, last_id, max_id, done, rows, speed, eta / 60)
+
+
+def replica_engines():
+    """Engines for ``DATABASE_REPLICA_URLS``, for throttling outside the Flask app"""
+    from app import normalize_database_url
+    urls = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    return [sa.create_engine(normalize_database_url(url), pool_pre_ping=True) for url in urls]
+
+
+def run_in_migration(backfill):
+    """Run a backfill from a migration's ``upgrade()``
+
+    Whatever the migration did so far is committed first, so the batches
+    see the new columns and each batch commits on its own.
+    """
+    from alembic import op
+    context = op.get_context()
+    if context.as_sql:
+        log.warning('%s: not run in offline mode; run the migration online to backfill', backfill.name)
+        return 0
+    if backfill.replicas is None:
+        backfill.replicas = replica_engines()
+    with context.autocommit_block():
+        return backfill.run(op.get_bind().engine)
+
+
+def _trigger_names(table, name):
+    return f'{table}_{name}_dw_ins'[:64], f'{table}_{name}_dw_upd'[:64]
+
+
+def add_dual_write(op, table, name, assignments, pk='id'):
+    """Triggers that set ``assignments`` (column -> SQL over ``NEW``) on every write"""
+    insert_name, update_name = _trigger_names(table, name)
+    dialect = op.get_bind().dialect.name
+    if dialect in ('mysql', 'mariadb'):
+        sets = ', '.join(f'NEW.{column} = {expression}' for column, expression in assignments.items())
+        op.execute(f'CREATE TRIGGER {insert_name} BEFORE INSERT ON {table} FOR EACH ROW SET {sets}')
+        op.execute(f'CREATE TRIGGER {update_name} BEFORE UPDATE ON {table} FOR EACH ROW SET {sets}')
+    elif dialect == 'sqlite':
+        # SQLite cannot assign NEW; rewrite the row after the fact instead
+        sets = ', '.join(f'{column} = {expression}' for column, expression in assignments.items())
+        for trigger, event in ((insert_name, 'INSERT'), (update_name, 'UPDATE')):
+            op.execute(f'CREATE TRIGGER {trigger} AFTER {event} ON {table} FOR EACH ROW BEGIN '
+                       f'UPDATE {table} SET {sets} WHERE {pk} = NEW.{pk}; END')
+    else:
+        raise NotImplementedError(f'Dual-write triggers are not implemented for {dialect}')
+
+
+def drop_dual_write(op, table, name):
+    for trigger in _trigger_names(table, name):
+        op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
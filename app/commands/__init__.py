@@ -0,0 +1,15 @@
+from .activity import activity_cli
+from .adaptive import adaptive_cli
+from .archive import archive_cli
+from .attempts import attempts_cli
+from .backfill import backfill_cli
+from .content import content_cli
+from .purge import purge_cli
+from .reviews import reviews_cli
+from .rollups import rollups_cli
+from .sync import sync_cli
+from .templates import templates_cli
+from .worker import worker_cli
+
+__all__ = ['activity_cli', 'adaptive_cli', 'archive_cli', 'attempts_cli', 'backfill_cli', 'content_cli', 'purge_cli',
+           'reviews_cli', 'rollups_cli', 'sync_cli', 'templates_cli', 'worker_cli']
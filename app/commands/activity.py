@@ -0,0 +1,27 @@
+import click
+from flask.cli import AppGroup
+
+from app.services.activity import measure_footprint, rebuild_activity
+
+activity_cli = AppGroup('activity', help='Maintain the daily activity bitmaps.')
+
+
+@activity_cli.command('rebuild')
+@click.option('--batch-size', default=10000, show_default=True)
+def rebuild(batch_size):
+    """Rebuild every activity bitmap from study session and progress history"""
+    users = rebuild_activity(batch_size)
+    click.echo(f'Activity bitmaps rebuilt for {users} user(s).')
+
+
+@activity_cli.command('footprint')
+@click.option('--sample', default=1000, show_default=True, help='Number of keys to measure.')
+@click.option('--users', default=100000, show_default=True, help='User count to extrapolate to.')
+def footprint(sample, users):
+    """Measure Redis memory per activity bitmap and extrapolate"""
+    average, measured = measure_footprint(sample)
+    if average is None:
+        click.echo('No activity bitmaps found.')
+        return
+    click.echo(f'{measured} key(s) sampled, {average:.0f} bytes per user on average.')
+    click.echo(f'Estimated for {users} users: {average * users / 1024 / 1024:.1f} MB.')
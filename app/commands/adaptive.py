@@ -0,0 +1,27 @@
+import click
+from flask.cli import AppGroup
+
+from app.services.adaptive import fit_all, fit_subject
+from app.tasks.adaptive import schedule_item_fits
+
+adaptive_cli = AppGroup('adaptive', help='Maintain adaptive assessment item parameters.')
+
+
+@adaptive_cli.command('fit')
+@click.option('--subject-id', type=int, help='Refit a single subject.')
+@click.option('--batch-size', default=10000, show_default=True)
+def fit(subject_id, batch_size):
+    """Fit IRT difficulty and discrimination from past MCQ answers"""
+    if subject_id is not None:
+        results = {subject_id: fit_subject(subject_id, batch_size)}
+    else:
+        results = fit_all(batch_size)
+    for subject, items in results.items():
+        click.echo(f'Subject {subject}: {items} question(s) fitted.')
+
+
+@adaptive_cli.command('schedule')
+def schedule():
+    """Book the nightly fit job; each run books the next one"""
+    job = schedule_item_fits()
+    click.echo(f'Fit job {job.id} scheduled.')
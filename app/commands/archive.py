@@ -0,0 +1,16 @@
+import click
+from flask.cli import AppGroup
+
+from app.services.archive import archive_attempts, archive_cutoff
+
+archive_cli = AppGroup('archive', help='Move old records to the cold archive tables.')
+
+
+@archive_cli.command('attempts')
+@click.option('--days', type=int, default=None, help='Archive attempts older than this. Defaults to ARCHIVE_AFTER_DAYS.')
+@click.option('--batch-size', default=500, show_default=True)
+def attempts(days, batch_size):
+    """Move old assessment attempts and their answers to the archive"""
+    cutoff = archive_cutoff(days=days)
+    moved = archive_attempts(cutoff, batch_size)
+    click.echo(f'{moved} attempt(s) started before {cutoff:%Y-%m-%d} archived.')
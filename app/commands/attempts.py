@@ -0,0 +1,22 @@
+import click
+from flask.cli import AppGroup
+
+from app.services.attempts import expire_attempts
+from app.tasks.attempts import schedule_attempt_expiry
+
+attempts_cli = AppGroup('attempts', help='Maintain timed assessment attempts.')
+
+
+@attempts_cli.command('expire')
+@click.option('--batch-size', default=200, show_default=True)
+def expire(batch_size):
+    """Submit every timed attempt whose time is up now"""
+    expired = expire_attempts(batch_size)
+    click.echo(f'{expired} expired attempt(s) submitted.')
+
+
+@attempts_cli.command('schedule')
+def schedule():
+    """Book the expiry check; each run books the next one"""
+    job = schedule_attempt_expiry()
+    click.echo(f'Expiry job {job.id} scheduled.')
@@ -0,0 +1,29 @@
+import click
+from flask.cli import AppGroup
+
+from app.extensions import db
+from app.models import BackfillCheckpoint
+
+backfill_cli = AppGroup('backfill', help='Inspect migration backfills.')
+
+
+@backfill_cli.command('status')
+def status():
+    """Show the checkpoint of every backfill"""
+    rows = BackfillCheckpoint.query.order_by(BackfillCheckpoint.started_at).all()
+    if not rows:
+        click.echo('No backfills recorded.')
+        return
+    for row in rows:
+        done = row.last_id / row.max_id * 100 if row.max_id else 100
+        state = f'finished {row.finished_at:%Y-%m-%d %H:%M}' if row.finished_at else f'updated {row.updated_at:%Y-%m-%d %H:%M}'
+        click.echo(f'{row.name}: id {row.last_id} of {row.max_id} ({done:.1f}%), {row.rows} rows changed, {state}')
+
+
+@backfill_cli.command('reset')
+@click.argument('name')
+def reset(name):
+    """Forget a backfill's checkpoint so its next run starts over"""
+    deleted = BackfillCheckpoint.query.filter_by(name=name).delete()
+    db.session.commit()
+    click.echo(f'Checkpoint {name} removed.' if deleted else f'No checkpoint named {name}.')
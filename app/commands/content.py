@@ -0,0 +1,56 @@
+import sys
+
+import click
+from flask.cli import AppGroup
+
+from app.services.content_import import ContentImporter, KIND_ORDER
+from app.services.curriculum import questions_with_option
+
+content_cli = AppGroup('content', help='Manage curriculum content.')
+
+
+@content_cli.command('import')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--batch-size', default=500, show_default=True, help='Rows per upsert statement and commit.')
+@click.option('--dry-run', is_flag=True, help='Validate and report the diff without writing anything.')
+@click.option('--verbose', '-v', is_flag=True, help='List every row that is inserted or updated.')
+def import_content(paths, batch_size, dry_run, verbose):
+    """Import curriculum bundles (JSON, JSON Lines or CSV files, or directories)"""
+    importer = ContentImporter(batch_size=batch_size, dry_run=dry_run)
+    report = importer.run(paths)
+
+    if report.errors:
+        for error in report.errors:
+            click.echo(error, err=True)
+        click.echo(f'Import aborted: {len(report.errors)} invalid record(s), nothing was written.', err=True)
+        sys.exit(1)
+
+    if verbose:
+        for action, kind, key in report.changes:
+            click.echo(f'{action:<7} {kind:<10} {"/".join(map(str, key))}')
+
+    click.echo(f'{"":<12}{"inserted":>10}{"updated":>10}{"unchanged":>10}')
+    for kind in KIND_ORDER:
+        click.echo(f'{kind:<12}{report.inserted[kind]:>10}{report.updated[kind]:>10}{report.unchanged[kind]:>10}')
+
+    if dry_run:
+        click.echo(f'Dry run: {report.total_changed} row(s) would be written.')
+    else:
+        click.echo(f'{report.total_changed} row(s) written.')
+
+
+@content_cli.command('questions')
+@click.option('--option-key', default='image', show_default=True,
+              help='List questions with an option object that has this key.')
+@click.option('--assessment', 'assessment_id', type=int, help='Only this assessment.')
+def list_questions(option_key, assessment_id):
+    """List questions by what their options contain"""
+    try:
+        questions = questions_with_option(option_key, assessment_id)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--option-key')
+    count = 0
+    for question in questions:
+        count += 1
+        click.echo(f'{question.assessment_id:>6} {question.id:>8}  {question.question_text[:60]}')
+    click.echo(f'{count} question(s) with an option {option_key!r}.')
@@ -0,0 +1,54 @@
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import func, or_
+
+from app.models import Subject, User
+from app.services.purge import PURGE_BATCH_SIZE, benchmark, purge_subject, purge_user
+
+purge_cli = AppGroup('purge', help='Delete students and subjects with everything under them.')
+
+
+@purge_cli.command('user')
+@click.argument('user')
+@click.option('--batch-size', default=PURGE_BATCH_SIZE, show_default=True)
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def user(user, batch_size, yes):
+    """Delete a student by id or email, for a PDPA deletion request"""
+    found = User.query.filter(or_(User.email == user, User.id == (int(user) if user.isdigit() else None))).first()
+    if found is None:
+        raise click.ClickException(f'No user {user!r}')
+    if not yes:
+        click.confirm(f'Delete {found.email} and all of their data?', abort=True)
+    counts = purge_user(found.id, batch_size)
+    click.echo(', '.join(f'{table}: {rows}' for table, rows in counts.items()))
+
+
+@purge_cli.command('subject')
+@click.argument('code')
+@click.option('--batch-size', default=PURGE_BATCH_SIZE, show_default=True)
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def subject(code, batch_size, yes):
+    """Delete a subject by code, with its chapters, assessments and attempts"""
+    found = Subject.query.filter(func.lower(Subject.code) == code.lower()).first()
+    if found is None:
+        raise click.ClickException(f'No subject {code!r}')
+    if not yes:
+        click.confirm(f'Delete {found.name} with every chapter, assessment and attempt?', abort=True)
+    counts = purge_subject(found.id, batch_size)
+    click.echo(', '.join(f'{table}: {rows}' for table, rows in counts.items()))
+
+
+@purge_cli.command('benchmark')
+@click.option('--answers', default=100_000, show_default=True)
+@click.option('--batch-size', default=PURGE_BATCH_SIZE, show_default=True)
+@click.option('--database-url', help='Scratch database to run on. Defaults to a temporary SQLite file.')
+def run_benchmark(answers, batch_size, database_url):
+    """Time deleting a student with many answers, per deletion method"""
+    if database_url and database_url == current_app.config['SQLALCHEMY_DATABASE_URI']:
+        raise click.ClickException('Refusing to benchmark on the application database')
+    results = benchmark(answers, batch_size, database_url)
+    click.echo(f'Deleting a student with {answers} answers:')
+    for method, timing in results.items():
+        click.echo(f'  {method:8} {timing["seconds"]:8.2f} s total, '
+                   f'longest transaction {timing["longest_transaction"]:.3f} s')
@@ -0,0 +1,22 @@
+import click
+from flask.cli import AppGroup
+
+from app.services.reviews import precompute_queue_sizes
+from app.tasks.reviews import schedule_review_queues
+
+reviews_cli = AppGroup('reviews', help='Maintain the spaced-repetition review queues.')
+
+
+@reviews_cli.command('queue-sizes')
+@click.option('--batch-size', default=1000, show_default=True)
+def queue_sizes(batch_size):
+    """Recount every active user's due reviews now"""
+    users = precompute_queue_sizes(batch_size)
+    click.echo(f'Review queue sizes stored for {users} user(s).')
+
+
+@reviews_cli.command('schedule')
+def schedule():
+    """Book the nightly queue size job; each run books the next one"""
+    job = schedule_review_queues()
+    click.echo(f'Queue size job {job.id} scheduled.')
@@ -0,0 +1,23 @@
+import click
+from flask.cli import AppGroup
+
+from app.services.study_rollups import rebuild_rollups, refresh_rollups
+
+rollups_cli = AppGroup('rollups', help='Maintain study time rollups.')
+
+
+@rollups_cli.command('refresh')
+@click.option('--batch-size', default=5000, show_default=True)
+def refresh(batch_size):
+    """Roll up study sessions added since the last run"""
+    processed = refresh_rollups(batch_size)
+    click.echo(f'{processed} new study session(s) rolled up.')
+
+
+@rollups_cli.command('backfill')
+@click.option('--batch-size', default=5000, show_default=True)
+@click.confirmation_option(prompt='This rebuilds every rollup from the full session history. Continue?')
+def backfill(batch_size):
+    """Rebuild the rollups from the full study session history"""
+    processed = rebuild_rollups(batch_size)
+    click.echo(f'Rollups rebuilt from {processed} study session(s).')
@@ -0,0 +1,14 @@
+import click
+from flask.cli import AppGroup
+
+from app.services.sync import RECEIPT_RETENTION_DAYS, purge_receipts
+
+sync_cli = AppGroup('sync', help='Maintain offline sync receipts.')
+
+
+@sync_cli.command('purge')
+@click.option('--days', default=RECEIPT_RETENTION_DAYS, show_default=True, help='Keep receipts this many days.')
+def purge(days):
+    """Delete idempotency receipts older than --days"""
+    deleted = purge_receipts(days)
+    click.echo(f'{deleted} sync receipt(s) deleted.')
@@ -0,0 +1,24 @@
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app.templating import benchmark
+
+templates_cli = AppGroup('templates', help='Inspect template caching.')
+
+
+@templates_cli.command('benchmark')
+@click.argument('names', nargs=-1)
+@click.option('--iterations', default=200, show_default=True, help='Warm renders per measurement.')
+@click.option('--cold-iterations', default=20, show_default=True, help='Fresh-environment renders per measurement.')
+def benchmark_command(names, iterations, cold_iterations):
+    """Compare render times without and with the bytecode and fragment caches"""
+    app = current_app._get_current_object()
+    if not app.jinja_options.get('bytecode_cache'):
+        click.echo('TEMPLATE_BYTECODE_DIR is not set; cold renders compare compiling with itself.')
+    names = names or ('subjects.html', 'about.html', 'index.html')
+    for name, result in benchmark(app, names, iterations, cold_iterations).items():
+        cold_without, cold_with = result['cold']
+        warm_without, warm_with = result['warm']
+        click.echo(f'{name}: cold {cold_without:.2f} -> {cold_with:.2f} ms, '
+                   f'warm {warm_without:.2f} -> {warm_with:.2f} ms')
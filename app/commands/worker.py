@@ -0,0 +1,53 @@
+import logging
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app.tasks.queues import queue_stats
+from app.tasks.worker import run
+
+worker_cli = AppGroup('worker', help='Run and inspect background workers.')
+
+
+@worker_cli.command('run')
+@click.option('--processes', help='Override WORKER_PROCESSES, e.g. "grading=4,exports=1".')
+def run_workers(processes):
+    """Start the worker supervisor"""
+    logging.basicConfig(level=logging.INFO)
+    app = current_app._get_current_object()
+    if processes:
+        app.config['WORKER_PROCESSES'] = processes
+    run(app)
+
+
+@worker_cli.command('stats')
+@click.option('--prometheus', is_flag=True, help='Print in Prometheus text exposition format.')
+def show_stats(prometheus):
+    """Show queue depth and latency"""
+    stats = queue_stats()
+
+    if prometheus:
+        metrics = [
+            ('cikgu_queue_depth', 'gauge', 'depth'),
+            ('cikgu_queue_oldest_wait_seconds', 'gauge', 'oldest_wait_seconds'),
+            ('cikgu_queue_started_total', 'counter', 'started_total'),
+            ('cikgu_queue_wait_seconds_total', 'counter', 'wait_seconds_total'),
+            ('cikgu_queue_wait_p50_seconds', 'gauge', 'wait_p50_seconds'),
+            ('cikgu_queue_wait_p95_seconds', 'gauge', 'wait_p95_seconds'),
+        ]
+        for metric, kind, field in metrics:
+            click.echo(f'# TYPE {metric} {kind}')
+            for name, values in stats.items():
+                if values[field] is not None:
+                    click.echo(f'{metric}{{queue="{name}"}} {values[field]}')
+        return
+
+    def seconds(value):
+        return '-' if value is None else f'{value:.2f}s'
+
+    click.echo(f'{"queue":<15}{"depth":>8}{"oldest":>10}{"started":>10}{"p50 wait":>10}{"p95 wait":>10}')
+    for name, values in stats.items():
+        click.echo(f'{name:<15}{values["depth"]:>8}{seconds(values["oldest_wait_seconds"]):>10}'
+                   f'{values["started_total"]:>10}{seconds(values["wait_p50_seconds"]):>10}'
+                   f'{seconds(values["wait_p95_seconds"]):>10}')
@@ -0,0 +1,166 @@
+"""Read-replica routing for ``db.session``.
+
+Replicas are configured as ``replica_<n>`` binds (see ``DATABASE_REPLICA_URLS``).
+Only views decorated with :func:`read_only` -- or code running inside
+:func:`use_replicas` -- send anything to them, and even then a query stays on
+the primary when:
+
+* it is not a plain ``SELECT`` (DML, ``SELECT ... FOR UPDATE``, raw SQL),
+* the current transaction has already written something,
+* the user wrote within the last ``SQLALCHEMY_PRIMARY_PIN_SECONDS``
+  (read-your-writes; the deadline rides in the Flask session cookie), or
+* every replica is further behind than ``SQLALCHEMY_REPLICA_MAX_LAG`` seconds.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+import sqlalchemy as sa
+from flask import current_app, has_request_context, session as http_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+
+PIN_SESSION_KEY = '_db_primary_until'
+
+
+def replication_lag(engine):
+    """Seconds the replica behind ``engine`` trails its primary, or None if unknown
+
+    Only MySQL/MariaDB report replication status. Any other backend (and a
+    MariaDB server that is not replicating, such as a local container) counts
+    as fully caught up, which keeps two SQLite files usable for local testing.
+    """
+    if engine.dialect.name not in ('mysql', 'mariadb'):
+        return 0
+
+    try:
+        with engine.connect() as conn:
+            for statement in ('SHOW REPLICA STATUS', 'SHOW SLAVE STATUS'):
+                try:
+                    status = conn.exec_driver_sql(statement).mappings().first()
+                except DBAPIError:
+                    continue
+                if status is None:
+                    return 0
+                # NULL here means the replication threads are stopped
+                return status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+    except DBAPIError:
+        pass
+    return None
+
+
+class ReplicaMonitor:
+    """Per-process cache of replica lag so it is probed at most every few seconds"""
+
+    def __init__(self, probe=replication_lag, interval=5):
+        self.probe = probe
+        self.interval = interval
+        self._lag = {}
+        self._lock = threading.Lock()
+
+    def lag(self, key, engine):
+        now = time.monotonic()
+        checked_at, lag = self._lag.get(key, (None, None))
+        if checked_at is None or now - checked_at >= self.interval:
+            lag = self.probe(engine)
+            with self._lock:
+                self._lag[key] = (now, lag)
+        return lag
+
+    def healthy(self, engines, max_lag):
+        healthy = []
+        for key, engine in engines.items():
+            lag = self.lag(key, engine)
+            if lag is not None and lag <= max_lag:
+                healthy.append(key)
+        return healthy
+
+
+replica_monitor = ReplicaMonitor()
+
+
+class RoutingSession(Session):
+    """Session that sends eligible reads to a replica and everything else to the primary"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        primary = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or primary is not self._db.engines.get(None):
+            return primary
+
+        if self._flushing or isinstance(clause, sa.UpdateBase):
+            self.info['wrote'] = True
+            return primary
+        if clause is not None and not isinstance(clause, sa.Select):
+            return primary
+
+        if not self._can_use_replica(clause):
+            return primary
+
+        return self._replica_engine() or primary
+
+    def _can_use_replica(self, clause):
+        if not self.info.get('replica_reads') or self.info.get('wrote'):
+            return False
+        if self.new or self.dirty or self.deleted:
+            return False
+        if clause is not None and clause._for_update_arg is not None:
+            return False
+        if has_request_context() and http_session.get(PIN_SESSION_KEY, 0) > time.time():
+            return False
+        return True
+
+    def _replica_engine(self):
+        # Stick to one replica for the whole session so a request reads a
+        # single consistent snapshot
+        key = self.info.get('replica_bind')
+        if key is None:
+            keys = current_app.config.get('SQLALCHEMY_REPLICA_BINDS', [])
+            if not keys:
+                return None
+            engines = {k: self._db.engines[k] for k in keys}
+            healthy = replica_monitor.healthy(engines, current_app.config.get('SQLALCHEMY_REPLICA_MAX_LAG', 5))
+            if not healthy:
+                return None
+            key = self.info['replica_bind'] = random.choice(healthy)
+        return self._db.engines[key]
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _pin_writer_to_primary(session):
+    if session.info.pop('wrote', False) and has_request_context():
+        window = current_app.config.get('SQLALCHEMY_PRIMARY_PIN_SECONDS', 10)
+        if window:
+            http_session[PIN_SESSION_KEY] = time.time() + window
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_writes(session):
+    session.info.pop('wrote', None)
+
+
+@contextmanager
+def use_replicas(session=None):
+    """Let eligible reads inside the block go to a replica"""
+    if session is None:
+        from app.extensions import db
+        session = db.session
+
+    previous = session.info.get('replica_reads', False)
+    session.info['replica_reads'] = True
+    try:
+        yield session
+    finally:
+        session.info['replica_reads'] = previous
+        session.info.pop('replica_bind', None)
+
+
+def read_only(view):
+    """Mark a view as read-mostly so its reads may be served by a replica"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with use_replicas():
+            return view(*args, **kwargs)
+    return wrapper
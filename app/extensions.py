@@ -1,6 +1,29 @@
+import redis
+from flask import current_app
+from sqlalchemy import event
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from app.db_routing import RoutingSession
 
 # Initialize extensions
-db = SQLAlchemy()
-login_manager = LoginManager()
\ No newline at end of file
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+login_manager = LoginManager()
+
+
+def get_redis():
+    """Redis client shared by everything running in the current app"""
+    app = current_app._get_current_object()
+    client = app.extensions.get('redis')
+    if client is None:
+        client = app.extensions['redis'] = redis.from_url(app.config['REDIS_URL'])
+    return client
+
+
+def enable_sqlite_foreign_keys(engine):
+    """SQLite only enforces foreign keys, and so ON DELETE CASCADE, when each connection asks"""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def foreign_keys_on(dbapi_connection, connection_record):
+        dbapi_connection.execute('PRAGMA foreign_keys=ON')
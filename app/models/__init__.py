@@ -2,7 +2,8 @@ from .models import *
 
 __all__ = [
     'db',
-    'User', 'Progress', 'Upload', 'StudySession', 'PushSubscription',
+    'User', 'Progress', 'SubjectiveDraft', 'SyncReceipt', 'Upload', 'StudySession', 'PushSubscription',
+    'StudyRollupDaily', 'StudyRollupWeekly', 'RollupWatermark', 'BackfillCheckpoint', 'ReviewItem',
     'Subject', 'Chapter', 'Section', 'QuestionType', 'Assessment', 'Question',
-    'AssessmentAttempt', 'Answer'
+    'AssessmentAttempt', 'Answer', 'AssessmentAttemptArchive', 'AnswerArchive'
 ]
\ No newline at end of file
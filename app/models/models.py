@@ -2,6 +2,7 @@ from flask_login import UserMixin
 from datetime import datetime
 import enum
 from app.extensions import db
+from app.models.types import JSONList
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -16,18 +17,20 @@ class User(UserMixin, db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationships
-    progress = db.relationship('Progress', backref='user', lazy=True, cascade='all, delete-orphan')
-    uploads = db.relationship('Upload', backref='user', lazy=True, cascade='all, delete-orphan')
-    study_sessions = db.relationship('StudySession', backref='user', lazy=True, cascade='all, delete-orphan')
-    push_subscriptions = db.relationship('PushSubscription', backref='user', lazy=True, cascade='all, delete-orphan')
-    assessment_attempts = db.relationship('AssessmentAttempt', backref='user', lazy=True, cascade='all, delete-orphan')
+    progress = db.relationship('Progress', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    uploads = db.relationship('Upload', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    study_sessions = db.relationship('StudySession', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    push_subscriptions = db.relationship('PushSubscription', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    assessment_attempts = db.relationship('AssessmentAttempt', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
 
     def __repr__(self):
         return f'<User {self.name}>'
 
 class Progress(db.Model):
+    __table_args__ = (db.UniqueConstraint('user_id', 'subject', 'topic', name='uq_progress_user_subject_topic'),)
+
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     subject = db.Column(db.String(100), nullable=False)
     topic = db.Column(db.String(200), nullable=False)
     completed = db.Column(db.Boolean, default=False)
@@ -38,9 +41,36 @@ class Progress(db.Model):
     def __repr__(self):
         return f'<Progress {self.user_id} - {self.subject}>'
 
+class SubjectiveDraft(db.Model):
+    __table_args__ = (db.UniqueConstraint('user_id', 'subject', 'chapter', name='uq_subjective_draft_user_chapter'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    subject = db.Column(db.String(100), nullable=False)
+    chapter = db.Column(db.Integer, nullable=False)
+    answers = db.Column(db.Text)  # JSON object of answer field -> text
+    time_spent = db.Column(db.Integer, default=0)  # in seconds
+    saved_at = db.Column(db.DateTime, default=datetime.utcnow)  # when the client saved it
+
+    def __repr__(self):
+        return f'<SubjectiveDraft {self.user_id} - {self.subject} {self.chapter}>'
+
+class SyncReceipt(db.Model):
+    __table_args__ = (db.UniqueConstraint('user_id', 'idempotency_key', name='uq_sync_receipt_user_key'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    idempotency_key = db.Column(db.String(64), nullable=False)
+    event_type = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False)  # applied, invalid
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<SyncReceipt {self.user_id} {self.idempotency_key}>'
+
 class Upload(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     filename = db.Column(db.String(200), nullable=False)
     original_filename = db.Column(db.String(200), nullable=False)
     file_type = db.Column(db.String(50), nullable=False)
@@ -53,19 +83,84 @@ class Upload(db.Model):
 
 class StudySession(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     subject = db.Column(db.String(100), nullable=False)
     duration = db.Column(db.Integer, nullable=False)  # in minutes
     topics_covered = db.Column(db.Text)
     notes = db.Column(db.Text)
     session_date = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)  # insert time; session_date can be backdated
 
     def __repr__(self):
         return f'<StudySession {self.user_id} - {self.subject}>'
 
+class StudyRollupDaily(db.Model):
+    __table_args__ = (db.UniqueConstraint('user_id', 'subject', 'bucket', name='uq_study_rollup_daily'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    subject = db.Column(db.String(100), nullable=False)
+    bucket = db.Column(db.Date, nullable=False)  # local calendar day
+    minutes = db.Column(db.Integer, default=0, nullable=False)
+    sessions = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f'<StudyRollupDaily {self.user_id} - {self.subject} {self.bucket}>'
+
+class StudyRollupWeekly(db.Model):
+    __table_args__ = (db.UniqueConstraint('user_id', 'subject', 'bucket', name='uq_study_rollup_weekly'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    subject = db.Column(db.String(100), nullable=False)
+    bucket = db.Column(db.Date, nullable=False)  # Monday of the local week
+    minutes = db.Column(db.Integer, default=0, nullable=False)
+    sessions = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f'<StudyRollupWeekly {self.user_id} - {self.subject} {self.bucket}>'
+
+class RollupWatermark(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.Integer, default=0, nullable=False)  # highest source row id already rolled up
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<RollupWatermark {self.name} {self.last_id}>'
+
+class BackfillCheckpoint(db.Model):
+    name = db.Column(db.String(100), primary_key=True)
+    last_id = db.Column(db.BigInteger, default=0, nullable=False)  # highest primary key already processed
+    max_id = db.Column(db.BigInteger, nullable=False)  # highest primary key when the backfill started
+    rows = db.Column(db.BigInteger, default=0, nullable=False)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<BackfillCheckpoint {self.name} {self.last_id}/{self.max_id}>'
+
+class ReviewItem(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'question_id', name='uq_review_item_user_question'),
+        db.Index('ix_review_item_user_due', 'user_id', 'due_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    question_id = db.Column(db.Integer, db.ForeignKey('question.id', ondelete='CASCADE'), nullable=False)
+    due_at = db.Column(db.DateTime, nullable=False)
+    ease = db.Column(db.Float, default=2.5, nullable=False)  # SM-2 easiness factor
+    interval = db.Column(db.Integer, default=0, nullable=False)  # in days
+    repetitions = db.Column(db.Integer, default=0, nullable=False)  # correct reviews in a row
+    last_reviewed_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<ReviewItem {self.user_id} - {self.question_id} {self.due_at}>'
+
 class PushSubscription(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     endpoint = db.Column(db.Text, nullable=False)
     p256dh_key = db.Column(db.Text, nullable=False)
     auth_key = db.Column(db.Text, nullable=False)
@@ -85,15 +180,17 @@ class Subject(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationships
-    chapters = db.relationship('Chapter', backref='subject', lazy=True, cascade='all, delete-orphan')
-    assessments = db.relationship('Assessment', backref='subject', lazy=True, cascade='all, delete-orphan')
+    chapters = db.relationship('Chapter', backref='subject', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    assessments = db.relationship('Assessment', backref='subject', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
 
     def __repr__(self):
         return f'<Subject {self.name}>'
 
 class Chapter(db.Model):
+    __table_args__ = (db.UniqueConstraint('subject_id', 'order', name='uq_chapter_subject_order'),)
+
     id = db.Column(db.Integer, primary_key=True)
-    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), nullable=False)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id', ondelete='CASCADE'), nullable=False)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
     content = db.Column(db.Text)
@@ -104,19 +201,21 @@ class Chapter(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationships
-    sections = db.relationship('Section', backref='chapter', lazy=True, cascade='all, delete-orphan')
-    assessments = db.relationship('Assessment', backref='chapter', lazy=True, cascade='all, delete-orphan')
+    sections = db.relationship('Section', backref='chapter', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    assessments = db.relationship('Assessment', backref='chapter', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
 
     def __repr__(self):
         return f'<Chapter {self.title}>'
 
 class Section(db.Model):
+    __table_args__ = (db.UniqueConstraint('chapter_id', 'order', name='uq_section_chapter_order'),)
+
     id = db.Column(db.Integer, primary_key=True)
-    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'), nullable=False)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id', ondelete='CASCADE'), nullable=False)
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text)
-    key_points = db.Column(db.Text)  # JSON format
-    examples = db.Column(db.Text)    # JSON format
+    key_points = db.Column(JSONList())
+    examples = db.Column(JSONList())
     order = db.Column(db.Integer, default=1)
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -132,9 +231,11 @@ class QuestionType(enum.Enum):
     TRUE_FALSE = 'true_false'
 
 class Assessment(db.Model):
+    __table_args__ = (db.UniqueConstraint('subject_id', 'title', name='uq_assessment_subject_title'),)
+
     id = db.Column(db.Integer, primary_key=True)
-    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), nullable=False)
-    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'), nullable=True)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id', ondelete='CASCADE'), nullable=False)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id', ondelete='CASCADE'), nullable=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
     question_type = db.Column(db.Enum(QuestionType), nullable=False)
@@ -145,59 +246,117 @@ class Assessment(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationships
-    questions = db.relationship('Question', backref='assessment', lazy=True, cascade='all, delete-orphan')
-    attempts = db.relationship('AssessmentAttempt', backref='assessment', lazy=True, cascade='all, delete-orphan')
+    questions = db.relationship('Question', backref='assessment', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    attempts = db.relationship('AssessmentAttempt', backref='assessment', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
 
     def __repr__(self):
         return f'<Assessment {self.title}>'
 
 class Question(db.Model):
+    __table_args__ = (db.UniqueConstraint('assessment_id', 'order', name='uq_question_assessment_order'),)
+
     id = db.Column(db.Integer, primary_key=True)
-    assessment_id = db.Column(db.Integer, db.ForeignKey('assessment.id'), nullable=False)
+    assessment_id = db.Column(db.Integer, db.ForeignKey('assessment.id', ondelete='CASCADE'), nullable=False)
     question_text = db.Column(db.Text, nullable=False)
-    options = db.Column(db.Text)  # JSON format for multiple choice
-    correct_answer = db.Column(db.Text)
+    options = db.Column(JSONList())  # strings, or {'key', 'text', 'image'} objects
+    correct_answer = db.Column(db.Text)  # model answer for subjective questions
     explanation = db.Column(db.Text)
+    rubric_keywords = db.Column(JSONList())  # keywords expected in subjective answers
+    min_words = db.Column(db.Integer)
+    max_words = db.Column(db.Integer)
     marks = db.Column(db.Integer, default=1)
     order = db.Column(db.Integer, default=1)
+    irt_difficulty = db.Column(db.Float)  # 2PL item parameters fitted from past answers
+    irt_discrimination = db.Column(db.Float)
+    irt_responses = db.Column(db.Integer, default=0)  # answers the parameters were fitted on
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationships
-    answers = db.relationship('Answer', backref='question', lazy=True, cascade='all, delete-orphan')
+    answers = db.relationship('Answer', backref='question', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
 
     def __repr__(self):
         return f'<Question {self.id}>'
 
 class AssessmentAttempt(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    assessment_id = db.Column(db.Integer, db.ForeignKey('assessment.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    assessment_id = db.Column(db.Integer, db.ForeignKey('assessment.id', ondelete='CASCADE'), nullable=False)
     score = db.Column(db.Float, default=0)
     total_marks = db.Column(db.Integer, default=0)
     percentage = db.Column(db.Float, default=0)
     time_taken = db.Column(db.Integer, default=0)  # in seconds
+    ability = db.Column(db.Float)  # IRT ability estimate, adaptive attempts only
     status = db.Column(db.String(20), default='in_progress')  # in_progress, completed, submitted
     started_at = db.Column(db.DateTime, default=datetime.utcnow)
     completed_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     # Relationships
-    answers = db.relationship('Answer', backref='attempt', lazy=True, cascade='all, delete-orphan')
+    answers = db.relationship('Answer', backref='attempt', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
 
     def __repr__(self):
         return f'<AssessmentAttempt {self.id}>'
 
 class Answer(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    attempt_id = db.Column(db.Integer, db.ForeignKey('assessment_attempt.id'), nullable=False)
-    question_id = db.Column(db.Integer, db.ForeignKey('question.id'), nullable=False)
+    attempt_id = db.Column(db.Integer, db.ForeignKey('assessment_attempt.id', ondelete='CASCADE'), nullable=False)
+    question_id = db.Column(db.Integer, db.ForeignKey('question.id', ondelete='CASCADE'), nullable=False)
     answer_text = db.Column(db.Text)
     is_correct = db.Column(db.Boolean, default=False)
     marks_obtained = db.Column(db.Float, default=0)
     feedback = db.Column(db.Text)
+    auto_scored_at = db.Column(db.DateTime)  # set when marks/feedback are suggestions awaiting review
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
-        return f'<Answer {self.id}>'
\ No newline at end of file
+        return f'<Answer {self.id}>'
+
+# Cold copies of attempts and answers older than ARCHIVE_AFTER_DAYS (see
+# app.services.archive). Ids are kept, so an attempt has the same id in
+# either table. Compressed on MariaDB since they are written once and
+# rarely read.
+class AssessmentAttemptArchive(db.Model):
+    __table_args__ = (
+        db.Index('ix_attempt_archive_user', 'user_id', 'id'),
+        {'mysql_row_format': 'COMPRESSED'},
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    assessment_id = db.Column(db.Integer, nullable=False)
+    score = db.Column(db.Float)
+    total_marks = db.Column(db.Integer)
+    percentage = db.Column(db.Float)
+    time_taken = db.Column(db.Integer)
+    ability = db.Column(db.Float)
+    status = db.Column(db.String(20))
+    started_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<AssessmentAttemptArchive {self.id}>'
+
+class AnswerArchive(db.Model):
+    __table_args__ = (
+        db.Index('ix_answer_archive_attempt', 'attempt_id'),
+        {'mysql_row_format': 'COMPRESSED'},
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    attempt_id = db.Column(db.Integer, nullable=False)
+    question_id = db.Column(db.Integer, nullable=False)
+    answer_text = db.Column(db.Text)
+    is_correct = db.Column(db.Boolean)
+    marks_obtained = db.Column(db.Float)
+    feedback = db.Column(db.Text)
+    auto_scored_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<AnswerArchive {self.id}>'
\ No newline at end of file
@@ -0,0 +1,99 @@
+"""Native JSON columns for structured content.
+
+``JSONList`` stores a list in a JSON column (``JSON`` on MariaDB, checked
+with ``JSON_VALID``; JSON1 text on SQLite) and reads it back as a list.
+Queries can reach inside it in SQL. For example, ``json_array_has_key``
+finds the questions with an image on any option without loading a single
+row.
+
+The engines encode and decode JSON with orjson (``dumps`` and ``loads``,
+see ``SQLALCHEMY_ENGINE_OPTIONS``), which parses several times faster than
+the standard library. A value is parsed once when its row is loaded and
+then kept by the session's identity map until the row is refreshed, so
+reading ``section.key_points`` again costs nothing. Every row gets its own
+list. Appending to or replacing items in it marks the row dirty, like
+assigning a new list does.
+"""
+import re
+
+import orjson
+import sqlalchemy as sa
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.ext.mutable import MutableList
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.sql.visitors import InternalTraversal
+from sqlalchemy.types import TypeDecorator
+
+
+def dumps(value):
+    return orjson.dumps(value).decode()
+
+
+def loads(text):
+    return orjson.loads(text)
+
+
+class JSONList(TypeDecorator):
+    """A list in a native JSON column
+
+    Accepts a list or tuple, or JSON text of a list from older callers. An
+    empty column is SQL NULL rather than JSON ``null``.
+    """
+
+    impl = sa.JSON
+    cache_ok = True
+
+    def __init__(self):
+        super().__init__(none_as_null=True)
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, str):
+            value = loads(value)
+        if value is None:
+            return None
+        if not isinstance(value, (list, tuple)):
+            raise ValueError(f'expected a list, got {type(value).__name__}')
+        return list(value)
+
+
+class _TrackedList(MutableList):
+    """Flushes in-place changes to a ``JSONList`` column"""
+
+    @classmethod
+    def coerce(cls, key, value):
+        if isinstance(value, str):
+            value = loads(value)
+        if isinstance(value, tuple):
+            value = list(value)
+        return super().coerce(key, value)
+
+
+_TrackedList.associate_with(JSONList)
+
+
+class json_array_has_key(FunctionElement):
+    """True where any object in the JSON array ``column`` has ``key``
+
+    ``Question.query.filter(json_array_has_key(Question.options, 'image'))``
+    """
+
+    inherit_cache = True
+    type = sa.Boolean()
+    _traverse_internals = FunctionElement._traverse_internals + [('key', InternalTraversal.dp_string)]
+
+    def __init__(self, column, key):
+        if not re.fullmatch(r'\w+', key):
+            raise ValueError(f'Invalid JSON key {key!r}')
+        self.key = key
+        super().__init__(column)
+
+
+@compiles(json_array_has_key)
+def _compile_has_key(element, compiler, **kw):
+    return f"JSON_CONTAINS_PATH({compiler.process(element.clauses, **kw)}, 'one', '$[*].{element.key}')"
+
+
+@compiles(json_array_has_key, 'sqlite')
+def _compile_has_key_sqlite(element, compiler, **kw):
+    return (f"EXISTS (SELECT 1 FROM json_each({compiler.process(element.clauses, **kw)}) "
+            f"WHERE json_each.type = 'object' AND json_type(json_each.value, '$.{element.key}') IS NOT NULL)")
@@ -0,0 +1,194 @@
+"""Per-user and per-route rate limits, and load shedding under pool pressure.
+
+Views declare their limits next to the route::
+
+    @main_bp.route('/api/progress', methods=['POST'])
+    @login_required
+    @rate_limit(per_user='30/minute', per_route='100/second', priority='low')
+    def update_progress(): ...
+
+Each limit is a token bucket in Redis holding ``N`` tokens and refilling at
+``N`` per period, so a burst of ``N`` is allowed after a quiet spell. The
+user's and the route's buckets are checked and charged together by one Lua
+script using the Redis clock, so concurrent workers cannot overspend and
+their clocks don't matter. A refused request gets 429 with ``Retry-After``.
+If Redis is unreachable the request is let through.
+
+Before any bucket is touched, the view's priority is checked against the
+time requests currently wait to check a connection out of the database
+pool (``TimedQueuePool`` keeps a moving average per process). Above
+``RATE_LIMIT_SHED_WAIT_MS`` low-priority views answer 503 straight away,
+above ``SHED_NORMAL_FACTOR`` times that normal ones do too, and high-priority
+views are never shed. Pages hand a refused progress or draft write to the
+offline queue, which the service worker replays through ``/api/sync``.
+"""
+import math
+import re
+import threading
+import time
+from functools import wraps
+
+import redis
+from flask import current_app, jsonify, request
+from flask_login import current_user
+from sqlalchemy.pool import QueuePool
+
+from app.extensions import get_redis
+
+BUCKET_PREFIX = 'cikgu:ratelimit:'
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+PRIORITIES = ('low', 'normal', 'high')
+SHED_NORMAL_FACTOR = 4
+SHED_RETRY_SECONDS = 5
+WAIT_SMOOTHING = 0.2  # weight of the newest checkout in the moving average
+WAIT_STALE_SECONDS = 10
+
+# KEYS: bucket keys. ARGV: capacity and refill rate (tokens/second) per key.
+# Charges one token from every bucket, or from none if any is empty.
+# Returns {allowed, seconds until the emptiest bucket has a token}.
+_TOKEN_BUCKET = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i - 1])
+    local rate = tonumber(ARGV[2 * i])
+    local state = redis.call('HMGET', key, 'tokens', 'at')
+    local tokens = tonumber(state[1]) or capacity
+    local at = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - at) * rate)
+    levels[i] = tokens
+    if tokens < 1 then
+        wait = math.max(wait, (1 - tokens) / rate)
+    end
+end
+local allowed = wait == 0 and 1 or 0
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i - 1])
+    local rate = tonumber(ARGV[2 * i])
+    local tokens = levels[i] - allowed
+    redis.call('HSET', key, 'tokens', tostring(tokens), 'at', tostring(now))
+    redis.call('PEXPIRE', key, math.ceil((capacity - tokens) / rate * 1000) + 1000)
+end
+return {allowed, tostring(wait)}
+"""
+
+
+def parse_rate(rate):
+    """``'30/minute'`` -> ``(30, 0.5)``: bucket capacity and tokens per second"""
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d*)\s*(second|minute|hour|day)s?\s*', rate or '')
+    if not match or int(match.group(1)) < 1:
+        raise ValueError(f'Invalid rate {rate!r}, expected e.g. "30/minute"')
+    count, multiple, period = int(match.group(1)), int(match.group(2) or 1), match.group(3)
+    return count, count / (multiple * PERIODS[period])
+
+
+class PoolWaitMonitor:
+    """Moving average of pool checkout waits in this process"""
+
+    def __init__(self):
+        self._average = 0.0
+        self._updated = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._average += WAIT_SMOOTHING * (seconds - self._average)
+            self._updated = time.monotonic()
+
+    def average_ms(self):
+        # No checkouts lately means nobody is waiting for one
+        if time.monotonic() - self._updated > WAIT_STALE_SECONDS:
+            return 0.0
+        return self._average * 1000
+
+
+pool_waits = PoolWaitMonitor()
+
+
+class TimedQueuePool(QueuePool):
+    """``QueuePool`` that reports how long each checkout waited for a connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_waits.record(time.perf_counter() - start)
+
+
+def shedding(priority):
+    """Whether views of ``priority`` should be turned away right now"""
+    if priority == 'high':
+        return False
+    threshold = current_app.config.get('RATE_LIMIT_SHED_WAIT_MS', 100)
+    if not threshold:
+        return False
+    if priority == 'normal':
+        threshold *= SHED_NORMAL_FACTOR
+    return pool_waits.average_ms() > threshold
+
+
+def take_tokens(buckets, connection=None):
+    """Charge one request to every ``(key, rate)`` bucket
+
+    Returns ``(allowed, retry_after_seconds)``. Fails open on Redis errors.
+    """
+    if not buckets:
+        return True, 0
+    keys, args = [], []
+    for key, rate in buckets:
+        capacity, refill = parse_rate(rate)
+        keys.append(BUCKET_PREFIX + key)
+        args.extend((capacity, refill))
+    try:
+        connection = connection or get_redis()
+        allowed, wait = connection.register_script(_TOKEN_BUCKET)(keys=keys, args=args)
+    except redis.RedisError as e:
+        current_app.logger.warning('Rate limiter could not reach Redis, letting request through: %s', e)
+        return True, 0
+    return bool(allowed), float(wait)
+
+
+def _refused(status, message, retry_after):
+    response = jsonify({'success': False, 'message': message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def rate_limit(per_user=None, per_route=None, priority='normal'):
+    """Limit a view per user and across all users, and shed it by ``priority``
+
+    Rates read like ``'30/minute'`` or ``'5/10seconds'``. Anonymous visitors
+    are limited per IP address, the client's own behind ``PROXY_HOPS``
+    proxies. Goes below ``@login_required``.
+    """
+    if priority not in PRIORITIES:
+        raise ValueError(f'Unknown priority {priority!r}')
+    for rate in (per_user, per_route):
+        if rate is not None:
+            parse_rate(rate)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not current_app.config.get('RATE_LIMIT_ENABLED', True):
+                return view(*args, **kwargs)
+            if shedding(priority):
+                return _refused(503, 'Server is busy, please retry shortly', SHED_RETRY_SECONDS)
+
+            endpoint = request.endpoint
+            buckets = []
+            if per_user is not None:
+                who = f'user:{current_user.id}' if current_user.is_authenticated else f'ip:{request.remote_addr}'
+                buckets.append((f'{endpoint}:{who}', per_user))
+            if per_route is not None:
+                buckets.append((f'{endpoint}:all', per_route))
+            allowed, retry_after = take_tokens(buckets)
+            if not allowed:
+                return _refused(429, 'Too many requests, please slow down', retry_after)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
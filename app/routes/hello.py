@@ -1,13 +1,29 @@
-from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, current_app
+from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, current_app, Response, abort
 from flask_login import login_required, current_user, login_user, logout_user
+import mimetypes
 import os
+import time
 from app.auth.auth import google_auth, create_or_update_user
-from app.models import User, Progress, Upload, StudySession, PushSubscription
-from app.extensions import db
+from app.models import User, Progress, Upload, StudySession, PushSubscription, QuestionType
+from app.extensions import db, get_redis
+from app.db_routing import read_only
+from app.ratelimit import rate_limit
+from app.services.curriculum import find_assessment
+from app.services.study_rollups import total_minutes, daily_minutes, weekly_minutes
+from app.services.activity import activity_summary
+from app.services.archive import attempt_history, HISTORY_PAGE_SIZE
+from app.services.adaptive import (item_bank, parse_options, should_stop, save_attempt, start_test, take_step,
+                                   continue_test, end_test, MAX_ITEMS)
+from app.services.attempts import start_attempt, save_answers, submit_attempt
+from app.services.sync import apply_event, apply_events, InvalidEvent, SyncConflict, MAX_EVENTS as MAX_SYNC_EVENTS
+from app.services import events
+from app.services.storage import get_storage, send_stored, SignedLocalStorage
+from app.services.reviews import due_reviews, record_attempts, PAGE_SIZE, MAX_PAGE_SIZE
 # from app.services import notification_service  # Not implemented yet
 from werkzeug.utils import secure_filename
 from datetime import datetime
 import uuid
+import redis
 
 main_bp = Blueprint('main', __name__)
 
@@ -58,9 +74,15 @@ def logout():
 
 @main_bp.route('/dashboard')
 @login_required
+@read_only
 def dashboard():
     # Get user statistics
-    total_study_time = db.session.query(db.func.sum(StudySession.duration)).filter_by(user_id=current_user.id).scalar() or 0
+    total_study_time = total_minutes(current_user.id)
+    study_last_7_days = daily_minutes(current_user.id, days=7)
+    try:
+        activity = activity_summary(current_user.id)
+    except redis.RedisError:
+        activity = None
     completed_topics = Progress.query.filter_by(user_id=current_user.id, completed=True).count()
     total_uploads = Upload.query.filter_by(user_id=current_user.id).count()
 
@@ -77,6 +99,8 @@ def dashboard():
 
     return render_template('dashboard.html',
                          total_study_time=total_study_time,
+                         study_last_7_days=study_last_7_days,
+                         activity=activity,
                          completed_topics=completed_topics,
                          total_uploads=total_uploads,
                          recent_sessions=recent_sessions,
@@ -101,13 +125,7 @@ def upload_file():
             unique_filename = f"{uuid.uuid4()}_{filename}"
 
             # Save file
-            uploads_dir = os.path.join(current_app.root_path, '..', 'uploads')
-            os.makedirs(uploads_dir, exist_ok=True)
-            file_path = os.path.join(uploads_dir, unique_filename)
-            file.save(file_path)
-
-            # Get file size
-            file_size = os.path.getsize(file_path)
+            file_size = get_storage().save(unique_filename, file.stream)
 
             # Create upload record
             upload = Upload(
@@ -127,17 +145,42 @@ def upload_file():
 
     return render_template('upload.html')
 
+@main_bp.route('/uploads/<int:upload_id>/download')
+@login_required
+def download_upload(upload_id):
+    upload = db.session.get(Upload, upload_id)
+    if upload is None or (upload.user_id != current_user.id and current_user.role != 'admin'):
+        abort(404)
+    return send_stored(upload.filename, upload.original_filename,
+                       mimetypes.guess_type(upload.original_filename)[0])
+
+@main_bp.route('/uploads/signed/<token>')
+def signed_download(token):
+    # Where SignedLocalStorage.url() points; the signature stands in for a login
+    storage = get_storage()
+    signed = storage.verify(token) if isinstance(storage, SignedLocalStorage) else None
+    if signed is None:
+        abort(404)
+    key, filename = signed
+    return send_stored(key, filename, mimetypes.guess_type(filename)[0], storage=storage, use_url=False)
+
 @main_bp.route('/progress')
 @login_required
+@read_only
 def progress():
     user_progress = Progress.query.filter_by(user_id=current_user.id).all()
-    return render_template('progress.html', progress=user_progress)
+    weekly_study = weekly_minutes(current_user.id, weeks=12)
+    history = attempt_history(current_user.id, before=request.args.get('before', type=int))
+    return render_template('progress.html', progress=user_progress, weekly_study=weekly_study,
+                           history=history, history_page_size=HISTORY_PAGE_SIZE)
 
 @main_bp.route('/subjects')
+@read_only
 def subjects():
     return render_template('subjects.html')
 
 @main_bp.route('/subjects/<subject>')
+@read_only
 def subject_detail(subject):
     return render_template('subject_detail.html', subject=subject)
 
@@ -148,6 +191,7 @@ def about():
 # Chapter and assessment routes
 @main_bp.route('/subjects/<subject>/chapter/<int:chapter>')
 @login_required
+@read_only
 def chapter(subject, chapter):
     # Sample chapter data - in a real app, this would come from a database
     chapter_data = {
@@ -201,8 +245,21 @@ def chapter(subject, chapter):
 
 @main_bp.route('/subjects/<subject>/chapter/<int:chapter>/mcq')
 @login_required
+@read_only
 def mcq_assessment(subject, chapter):
-    # Sample MCQ questions - in a real app, this would come from a database
+    assessment = find_assessment(subject, chapter, MCQ_TYPES)
+    if assessment is not None:
+        questions = [_mcq_question(q) for q in sorted(assessment.questions, key=lambda q: q.order)]
+        return render_template('mcq_assessment.html',
+                             subject=subject,
+                             chapter=chapter,
+                             questions=questions,
+                             total_questions=len(questions),
+                             time_limit=assessment.time_limit,
+                             assessment_id=assessment.id,
+                             remaining=start_attempt(current_user.id, assessment, 'mcq'))
+
+    # Sample MCQ questions, shown until the chapter has an assessment
     questions = [
         {
             'id': 1,
@@ -246,10 +303,47 @@ def mcq_assessment(subject, chapter):
                          total_questions=len(questions),
                          time_limit=30)
 
+@main_bp.route('/subjects/<subject>/chapter/<int:chapter>/adaptive')
+@login_required
+@read_only
+def adaptive_assessment(subject, chapter):
+    assessment = find_assessment(subject, chapter, MCQ_TYPES)
+    bank = item_bank(assessment.id) if assessment is not None else None
+    if not bank:
+        flash('Ujian adaptif belum tersedia untuk bab ini.', 'warning')
+        return redirect(url_for('main.mcq_assessment', subject=subject, chapter=chapter))
+
+    # Test state lives in Redis; the item bank is shared by every test-taker
+    theta, _ = bank.estimate([], [])
+    first = bank.next_item(theta, [])
+    if not start_test(current_user.id, assessment.id, bank.items[first]['id']):
+        flash('Ujian adaptif tidak dapat dimulakan sekarang. Sila cuba lagi.', 'error')
+        return redirect(url_for('main.chapter', subject=subject, chapter=chapter))
+    return render_template('adaptive_assessment.html',
+                         subject=subject,
+                         chapter=chapter,
+                         assessment_id=assessment.id,
+                         question=bank.question(first),
+                         max_questions=min(MAX_ITEMS, len(bank)))
+
 @main_bp.route('/subjects/<subject>/chapter/<int:chapter>/subjective')
 @login_required
+@read_only
 def subjective_assessment(subject, chapter):
-    # Sample subjective questions - in a real app, this would come from a database
+    assessment = find_assessment(subject, chapter, SUBJECTIVE_TYPES)
+    if assessment is not None:
+        subjective_questions = [_subjective_question(q) for q in sorted(assessment.questions, key=lambda q: q.order)]
+        return render_template('subjective_assessment.html',
+                             subject=subject,
+                             chapter=chapter,
+                             essay_question=None,
+                             subjective_questions=subjective_questions,
+                             total_questions=len(subjective_questions),
+                             time_limit=assessment.time_limit,
+                             assessment_id=assessment.id,
+                             remaining=start_attempt(current_user.id, assessment, 'subjective'))
+
+    # Sample subjective questions, shown until the chapter has an assessment
     essay_question = {
         'title': 'Kepentingan Biologi dalam Kehidupan Harian',
         'prompt': 'Huraikan bagaimana pengetahuan biologi dapat membantu kita dalam kehidupan harian. Berikan contoh-contoh yang relevan.',
@@ -307,39 +401,249 @@ def subjective_assessment(subject, chapter):
                          total_questions=len(subjective_questions) + (1 if essay_question else 0),
                          time_limit=60)
 
+SUBJECTIVE_TYPES = (QuestionType.SHORT_ANSWER, QuestionType.ESSAY)
+MCQ_TYPES = (QuestionType.MULTIPLE_CHOICE, QuestionType.TRUE_FALSE)
+
+def _mcq_question(question):
+    return {
+        'id': question.id,
+        'question': question.question_text,
+        'options': parse_options(question.options),
+        'explanation': question.explanation,
+    }
+
+def _json_object():
+    # A body that is a JSON list or scalar is rejected like a missing one
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else None
+
+def _answer_ids(answers):
+    # Pages send {question_id: answer}, or {'answer_<question_id>': answer} from form fields
+    parsed = {}
+    if not isinstance(answers, dict):
+        return parsed
+    for key, value in answers.items():
+        question_id = str(key).removeprefix('answer_')
+        if question_id.isdigit():
+            parsed[int(question_id)] = value
+    return parsed
+
+def _subjective_question(question):
+    # Short answers have no word limits; longer limits get the bigger box
+    if not question.min_words and not question.max_words:
+        answer_type = 'short'
+    elif (question.max_words or 0) <= 100:
+        answer_type = 'paragraph'
+    else:
+        answer_type = 'essay'
+    return {
+        'id': question.id,
+        'question': question.question_text,
+        'type': answer_type,
+        'marks': question.marks,
+        'min_words': question.min_words,
+        'max_words': question.max_words,
+    }
+
 # API routes for handling assessments
 @main_bp.route('/api/progress', methods=['POST'])
 @login_required
+@rate_limit(per_user='30/minute', per_route='100/second', priority='low')
 def update_progress():
-    data = request.json
-    # In a real app, save progress to database
+    data = _json_object()
+    if data is None:
+        return jsonify({'success': False, 'message': 'Expected a JSON object'}), 400
+    try:
+        apply_event(current_user.id, 'progress', data)
+    except InvalidEvent as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    db.session.commit()
+    events.publish(current_user.id, 'progress', f'Kemajuan disimpan: {data.get("section")}')
     return jsonify({'success': True, 'message': 'Progress saved'})
 
 @main_bp.route('/api/submit-mcq', methods=['POST'])
 @login_required
+@rate_limit(per_user='10/minute', per_route='50/second', priority='high')
 def submit_mcq():
-    data = request.json
-    # In a real app, save MCQ results to database
-    attempt_id = str(uuid.uuid4())
-    return jsonify({'success': True, 'attempt_id': attempt_id})
+    data = _json_object()
+    if data is None:
+        return jsonify({'success': False, 'message': 'Expected a JSON object'}), 400
+    assessment = find_assessment(data.get('subject', ''), data.get('chapter'), MCQ_TYPES)
+    if assessment is None:
+        # Sample questions only, nothing to record
+        attempt_id = str(uuid.uuid4())
+        return jsonify({'success': True, 'attempt_id': attempt_id})
+
+    attempt_id, auto_submitted = submit_attempt(current_user.id, assessment, 'mcq',
+                                                _answer_ids(data.get('answers')), data.get('time_spent'))
+    return jsonify({'success': True, 'attempt_id': attempt_id, 'auto_submitted': auto_submitted})
 
 @main_bp.route('/api/submit-subjective', methods=['POST'])
 @login_required
+@rate_limit(per_user='10/minute', per_route='50/second', priority='high')
 def submit_subjective():
-    data = request.json
-    # In a real app, save subjective answers to database
-    attempt_id = str(uuid.uuid4())
-    return jsonify({'success': True, 'attempt_id': attempt_id})
+    data = _json_object()
+    if data is None:
+        return jsonify({'success': False, 'message': 'Expected a JSON object'}), 400
+    assessment = find_assessment(data.get('subject', ''), data.get('chapter'), SUBJECTIVE_TYPES)
+    if assessment is None:
+        # Sample questions only, nothing to record
+        attempt_id = str(uuid.uuid4())
+        return jsonify({'success': True, 'attempt_id': attempt_id})
+
+    attempt_id, auto_submitted = submit_attempt(current_user.id, assessment, 'subjective',
+                                                _answer_ids(data.get('answers')), data.get('time_spent'))
+    return jsonify({'success': True, 'attempt_id': attempt_id, 'auto_submitted': auto_submitted})
+
+@main_bp.route('/api/attempts/<int:assessment_id>/answers', methods=['POST'])
+@login_required
+@rate_limit(per_user='60/minute', per_route='500/second', priority='high')
+def save_attempt_answers(assessment_id):
+    answers = (_json_object() or {}).get('answers')
+    if not isinstance(answers, dict):
+        return jsonify({'success': False, 'message': 'answers must be an object'}), 400
+    if not save_answers(current_user.id, assessment_id, _answer_ids(answers)):
+        return jsonify({'success': False, 'message': 'No attempt in progress or time is up'}), 409
+    return jsonify({'success': True})
+
+@main_bp.route('/api/adaptive/answer', methods=['POST'])
+@login_required
+@rate_limit(per_user='60/minute', per_route='500/second', priority='high')
+def adaptive_answer():
+    data = _json_object()
+    if data is None:
+        return jsonify({'success': False, 'message': 'Expected a JSON object'}), 400
+    assessment_id = data.get('assessment_id')
+    state = take_step(current_user.id, assessment_id) if isinstance(assessment_id, int) else None
+    if state is None:
+        return jsonify({'success': False, 'message': 'No adaptive assessment in progress'}), 400
+
+    bank = item_bank(assessment_id)
+    asked_ids = state['asked'] + [state['pending']]
+    choices = state['choices'] + [data.get('answer')]
+    asked = [bank.index[qid] for qid in asked_ids if qid in bank.index]
+    if len(asked) != len(asked_ids):
+        end_test(current_user.id, assessment_id)
+        return jsonify({'success': False, 'message': 'Assessment changed, please restart'}), 409
+    responses = [bank.is_correct(i, c) for i, c in zip(asked, choices)]
+    theta, standard_error = bank.estimate(asked, responses)
+    current = asked[-1]
+    feedback = {
+        'is_correct': responses[-1],
+        'correct_answer': bank.answers[current],
+        'explanation': bank.items[current]['explanation'],
+    }
+
+    next_index = None if should_stop(bank, asked, standard_error) else bank.next_item(theta, asked)
+    if next_index is None:
+        end_test(current_user.id, assessment_id)
+        time_taken = int(time.time() - state['started_at'])
+        attempt = save_attempt(bank, current_user.id, asked, choices, responses, theta, time_taken)
+        record_attempts([attempt.id])
+        db.session.commit()
+        return jsonify({'success': True, 'done': True, **feedback,
+                        'attempt_id': attempt.id,
+                        'ability': round(theta, 2),
+                        'correct': sum(responses),
+                        'answered': len(responses)})
+
+    if not continue_test(current_user.id, assessment_id, asked_ids, choices, bank.items[next_index]['id']):
+        return jsonify({'success': False, 'message': 'Could not save progress, please restart'}), 503
+    return jsonify({'success': True, 'done': False, **feedback,
+                    'question': bank.question(next_index),
+                    'number': len(asked_ids) + 1})
+
+@main_bp.route('/api/reviews/due', methods=['GET'])
+@login_required
+@read_only
+def reviews_due():
+    """Questions due for revision, one page at a time"""
+    after = None
+    cursor = request.args.get('after')
+    if cursor:
+        try:
+            due_at, item_id = cursor.rsplit('_', 1)
+            after = (datetime.fromisoformat(due_at), int(item_id))
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+    limit = min(max(request.args.get('limit', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    page = due_reviews(current_user.id, limit=limit, after=after)
+    items = [{
+        'question_id': question.id,
+        'assessment_id': question.assessment_id,
+        'question': question.question_text,
+        'due_at': item.due_at.isoformat(),
+        'interval': item.interval,
+    } for item, question in page]
+    next_cursor = f'{page[-1][0].due_at.isoformat()}_{page[-1][0].id}' if len(page) == limit else None
+    return jsonify({'items': items, 'next': next_cursor})
 
 @main_bp.route('/api/save-subjective-draft', methods=['POST'])
 @login_required
+@rate_limit(per_user='6/minute', per_route='100/second', priority='low')
 def save_subjective_draft():
-    data = request.json
-    # In a real app, save draft to database
+    data = _json_object()
+    if data is None:
+        return jsonify({'success': False, 'message': 'Expected a JSON object'}), 400
+    # A timed attempt keeps its answers in Redis until it is submitted
+    assessment_id = data.get('assessment_id')
+    if isinstance(assessment_id, int) and save_answers(current_user.id, assessment_id, _answer_ids(data.get('answers'))):
+        return jsonify({'success': True})
+    try:
+        apply_event(current_user.id, 'subjective_draft', data)
+    except InvalidEvent as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    db.session.commit()
     return jsonify({'success': True})
 
+@main_bp.route('/api/sync', methods=['POST'])
+@login_required
+@rate_limit(per_user='10/minute', per_route='50/second', priority='low')
+def sync_events():
+    """Apply a client's offline queue in one request"""
+    events_batch = (_json_object() or {}).get('events')
+    if not isinstance(events_batch, list):
+        return jsonify({'success': False, 'message': 'events must be a list'}), 400
+    if len(events_batch) > MAX_SYNC_EVENTS:
+        return jsonify({'success': False, 'message': f'At most {MAX_SYNC_EVENTS} events per request'}), 413
+
+    try:
+        results = apply_events(current_user.id, events_batch)
+    except SyncConflict:
+        return jsonify({'success': False, 'message': 'Events are already being synced, retry later'}), 409
+
+    synced = sum(1 for event, result in zip(events_batch, results)
+                 if result['status'] == 'applied' and event['type'] == 'progress')
+    if synced:
+        events.publish(current_user.id, 'progress', f'{synced} kemajuan luar talian telah disegerakkan.')
+    return jsonify({'success': True, 'results': results})
+
+@main_bp.route('/api/events')
+@login_required
+def event_stream():
+    """Server-sent events for the signed-in user"""
+    user_id = current_user.id
+    connection = get_redis()
+    # The stream can stay open for hours; do not hold a database connection for it
+    db.session.remove()
+    return Response(events.stream(user_id, connection),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@main_bp.route('/api/notifications')
+@login_required
+def recent_notifications():
+    """Latest events as HTML, for filling the list before the stream takes over"""
+    try:
+        items = events.recent(current_user.id)
+    except redis.RedisError:
+        items = []
+    return ''.join(items)
+
 # Push notification endpoints
 @main_bp.route('/api/push/vapid-public-key', methods=['GET'])
+@rate_limit(per_user='30/minute')
 def get_vapid_public_key():
     """Get VAPID public key for push notifications"""
     public_key = os.environ.get('VAPID_PUBLIC_KEY')
@@ -349,6 +653,7 @@ def get_vapid_public_key():
 
 @main_bp.route('/api/push/subscribe', methods=['POST'])
 @login_required
+@rate_limit(per_user='10/minute')
 def push_subscribe():
     """Subscribe to push notifications"""
     try:
@@ -364,6 +669,7 @@ def push_subscribe():
 
 @main_bp.route('/api/push/unsubscribe', methods=['POST'])
 @login_required
+@rate_limit(per_user='10/minute')
 def push_unsubscribe():
     """Unsubscribe from push notifications"""
     try:
@@ -382,6 +688,7 @@ def push_unsubscribe():
 
 @main_bp.route('/api/push/test', methods=['POST'])
 @login_required
+@rate_limit(per_user='3/minute', priority='low')
 def test_push_notification():
     """Send test push notification"""
     try:
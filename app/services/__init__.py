@@ -1,3 +1,13 @@
-# No services currently implemented
+from .activity import activity_summary, mark_active, rebuild_activity
+from .bulk import upsert
+from .content_import import ContentImporter, ContentImportError
+from .reviews import due_reviews, record_attempts, record_reviews
+from .study_rollups import refresh_rollups, rebuild_rollups
 
-__all__ = []
\ No newline at end of file
+__all__ = [
+    'activity_summary', 'mark_active', 'rebuild_activity',
+    'upsert',
+    'ContentImporter', 'ContentImportError',
+    'due_reviews', 'record_attempts', 'record_reviews',
+    'refresh_rollups', 'rebuild_rollups',
+]
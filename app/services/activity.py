@@ -0,0 +1,201 @@
+"""Per-user daily activity bitmaps in Redis.
+
+Bit ``n`` of ``cikgu:activity:<user_id>`` is set when the user studied on
+day ``n`` after ``EPOCH`` (local time). Writing a ``StudySession`` or a
+``Progress`` row sets the bit after the transaction commits; the dashboard
+reads the whole bitmap with a single GET and derives streaks and the
+heatmap with integer bit operations, so a year of history costs 46 bytes
+per user to store and one round trip to read.
+
+Footprint: a bitmap is as long as the days from ``EPOCH`` to the user's
+latest activity, 137 bytes at the end of 2026 and 46 more every year. With
+the key and Redis' per-key overhead that comes to roughly 250 bytes per
+user, about 25 MB for 100k users, growing by 4.6 MB a year.
+``flask activity footprint`` measures the real figure from a sample of keys
+with ``MEMORY USAGE``.
+"""
+from datetime import date, datetime, timedelta
+
+import redis
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.orm import object_session
+
+from app.db_routing import RoutingSession
+from app.extensions import db, get_redis
+from app.models import StudySession, Progress
+from app.services.study_rollups import local_day
+
+EPOCH = date(2024, 1, 1)
+KEY_PREFIX = 'cikgu:activity:'
+
+
+def activity_key(user_id):
+    return f'{KEY_PREFIX}{user_id}'
+
+
+def day_offset(day):
+    return (day - EPOCH).days
+
+
+def _today():
+    return local_day(datetime.utcnow(), current_app.config.get('STUDY_TIMEZONE_OFFSET', 8))
+
+
+def mark_active(user_days, connection=None):
+    """Set the activity bit for each ``(user_id, day)`` pair"""
+    connection = connection or get_redis()
+    with connection.pipeline(transaction=False) as pipe:
+        for user_id, day in set(user_days):
+            if day >= EPOCH:
+                pipe.setbit(activity_key(user_id), day_offset(day), 1)
+        pipe.execute()
+
+
+def _window(bitmap, last_offset, days):
+    """The ``days`` bits ending at ``last_offset`` as an int, most recent day in bit 0"""
+    total_bits = len(bitmap) * 8
+    bits = int.from_bytes(bitmap, 'big')
+    # Redis numbers bits from the most significant bit of the first byte
+    shift = total_bits - 1 - last_offset
+    bits = bits >> shift if shift >= 0 else bits << -shift
+    return bits & ((1 << days) - 1)
+
+
+def _trailing_ones(bits):
+    return (~bits & (bits + 1)).bit_length() - 1
+
+
+def _longest_run(bits):
+    # Each round erodes every run of ones by one bit
+    longest = 0
+    while bits:
+        bits &= bits << 1
+        longest += 1
+    return longest
+
+
+def activity_summary(user_id, days=365, today=None, connection=None):
+    """Current streak, longest streak, active days and heatmap for the last ``days`` days"""
+    connection = connection or get_redis()
+    today = today or _today()
+    bitmap = connection.get(activity_key(user_id)) or b''
+    window = _window(bitmap, day_offset(today), days) if bitmap else 0
+
+    # A streak survives until the end of today even if today has no activity yet
+    current = _trailing_ones(window) or _trailing_ones(window >> 1)
+
+    # Heatmap columns are Monday-first weeks, oldest on the left
+    first = today - timedelta(days=days - 1)
+    first -= timedelta(days=first.weekday())
+    weeks = []
+    day = first
+    while day <= today:
+        week = []
+        for _ in range(7):
+            age = (today - day).days
+            # None marks padding outside the window
+            week.append((day, bool(window >> age & 1) if 0 <= age < days else None))
+            day += timedelta(days=1)
+        weeks.append(week)
+
+    return {
+        'current_streak': current,
+        'longest_streak': _longest_run(int.from_bytes(bitmap, 'big')),
+        'active_days': bin(window).count('1'),
+        'heatmap': weeks,
+    }
+
+
+def rebuild_activity(batch_size=10000, connection=None):
+    """Rebuild every user's bitmap from study session and progress history"""
+    connection = connection or get_redis()
+    offset_hours = current_app.config.get('STUDY_TIMEZONE_OFFSET', 8)
+    bitmaps = {}
+
+    for model, column in ((StudySession, StudySession.session_date), (Progress, Progress.last_accessed)):
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                select(model.id, model.user_id, column)
+                .where(model.id > last_id, column.isnot(None))
+                .order_by(model.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            for _, user_id, moment in rows:
+                offset = day_offset(local_day(moment, offset_hours))
+                if offset < 0:
+                    continue
+                bitmap = bitmaps.setdefault(user_id, bytearray())
+                if len(bitmap) <= offset >> 3:
+                    bitmap.extend(bytes((offset >> 3) + 1 - len(bitmap)))
+                bitmap[offset >> 3] |= 0x80 >> (offset & 7)
+
+    users = list(bitmaps.items())
+    for start in range(0, len(users), 1000):
+        with connection.pipeline(transaction=False) as pipe:
+            for user_id, bitmap in users[start:start + 1000]:
+                pipe.set(activity_key(user_id), bytes(bitmap))
+            pipe.execute()
+    return len(users)
+
+
+def measure_footprint(sample_size=1000, connection=None):
+    """Average ``MEMORY USAGE`` of a sample of activity keys, in bytes"""
+    connection = connection or get_redis()
+    sizes = []
+    for key in connection.scan_iter(match=f'{KEY_PREFIX}*', count=1000):
+        sizes.append(connection.memory_usage(key, samples=0) or 0)
+        if len(sizes) >= sample_size:
+            break
+    return (sum(sizes) / len(sizes)) if sizes else None, len(sizes)
+
+
+# Collect (user, day) pairs while a transaction writes and set the bits only
+# once it commits.
+
+def note_activity(session, user_id, moment=None):
+    """Set the user's bit for ``moment`` once ``session`` commits
+
+    ORM writes are picked up by the listeners below; bulk statements that
+    bypass the unit of work call this directly.
+    """
+    moment = moment or datetime.utcnow()
+    day = local_day(moment, current_app.config.get('STUDY_TIMEZONE_OFFSET', 8))
+    session.info.setdefault('active_days', set()).add((user_id, day))
+
+
+def _note_activity(target, moment):
+    session = object_session(target)
+    if session is not None and target.user_id is not None:
+        note_activity(session, target.user_id, moment)
+
+
+@event.listens_for(StudySession, 'after_insert')
+def _study_session_written(mapper, connection, target):
+    _note_activity(target, target.session_date)
+
+
+@event.listens_for(Progress, 'after_insert')
+@event.listens_for(Progress, 'after_update')
+def _progress_written(mapper, connection, target):
+    _note_activity(target, target.last_accessed)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _set_activity_bits(session):
+    user_days = session.info.pop('active_days', None)
+    if not user_days:
+        return
+    try:
+        mark_active(user_days)
+    except redis.RedisError as e:
+        current_app.logger.warning('Could not record activity for %d user-day(s): %s', len(user_days), e)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_activity(session):
+    session.info.pop('active_days', None)
@@ -0,0 +1,398 @@
+"""Adaptive MCQ assessments on a two-parameter logistic (2PL) IRT model.
+
+A nightly job fits every objective question's difficulty ``b`` and
+discrimination ``a`` from the latest answer each student gave, one subject
+at a time, archived attempts included. The fit alternates vectorized Newton steps over all abilities and
+all items (``np.bincount`` does the per-person and per-item sums), with
+normal priors keeping sparse items and perfect scores finite.
+
+Web processes load an assessment's items into an ``ItemBank`` of numpy
+arrays once and keep it for ``BANK_TTL`` seconds. Choosing the next item
+(maximum Fisher information at the current ability) and updating the
+ability (expected a posteriori on a fixed grid) are then array operations
+on at most a few hundred items, with no database round trip per answer.
+
+A running test is a Redis hash per user and assessment holding the
+questions answered so far, the choices made and the one question waiting
+for an answer. The state stays on the server because every answer reveals
+the correct option: replaying an older state with that option must not
+score. Answering takes the waiting question out of the hash in the same
+script that reads it, so each step can be answered once.
+"""
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import redis
+from flask import current_app
+from sqlalchemy import select, update
+
+from app.extensions import db, get_redis
+from app.models import (Answer, AnswerArchive, AssessmentAttempt, AssessmentAttemptArchive, Assessment, Question,
+                        QuestionType)
+from app.services.study_rollups import local_day
+
+OBJECTIVE_TYPES = (QuestionType.MULTIPLE_CHOICE, QuestionType.TRUE_FALSE)
+
+# Priors: abilities ~ N(0, 1), intercepts ~ N(0, 2), discriminations ~ N(1, 0.5)
+INTERCEPT_SD = 2.0
+DISCRIMINATION_SD = 0.5
+DISCRIMINATION_RANGE = (0.2, 4.0)
+FIT_ITERATIONS = 100
+FIT_TOLERANCE = 1e-4
+FIT_HOUR = 3  # local time of the nightly run, after the review queue sizes
+
+GRID = np.linspace(-4.0, 4.0, 81)
+LOG_PRIOR = -0.5 * GRID ** 2
+
+MIN_ITEMS = 5
+MAX_ITEMS = 20
+TARGET_SE = 0.3
+RANDOMESQUE = 3  # pick among the most informative few so every test does not open the same way
+BANK_TTL = 300
+
+TEST_PREFIX = 'cikgu:adaptive:'
+TEST_TTL = 3 * 3600
+
+# KEYS: test hash. Returns its fields and removes the waiting question, or
+# nothing when no question is waiting.
+_TAKE_STEP = """
+if redis.call('HEXISTS', KEYS[1], 'pending') == 0 then
+    return {}
+end
+local state = redis.call('HGETALL', KEYS[1])
+redis.call('HDEL', KEYS[1], 'pending')
+return state
+"""
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30.0, 30.0)))
+
+
+def fit_2pl(person, item, correct, n_persons, n_items, iterations=FIT_ITERATIONS):
+    """Fit abilities and 2PL item parameters from flat response arrays
+
+    ``person`` and ``item`` are integer index arrays and ``correct`` is 0/1,
+    one entry per response. Returns ``(theta, a, b)``.
+    """
+    correct = correct.astype(np.float64)
+    theta = np.zeros(n_persons)
+    a = np.ones(n_items)
+    # Items are fitted as slope/intercept, z = a * theta + c with c = -a * b,
+    # which keeps very easy or very hard items from sliding along the a*b ridge.
+    # Start intercepts from each item's proportion correct.
+    answered = np.bincount(item, minlength=n_items)
+    right = np.bincount(item, weights=correct, minlength=n_items)
+    p = (right + 0.5) / (answered + 1.0)
+    c = np.log(p / (1.0 - p))
+
+    for _ in range(iterations):
+        previous_a, previous_c = a.copy(), c.copy()
+
+        prob = _sigmoid(a[item] * theta[person] + c[item])
+        residual = correct - prob
+        weight = prob * (1.0 - prob)
+        gradient = np.bincount(person, weights=a[item] * residual, minlength=n_persons) - theta
+        curvature = np.bincount(person, weights=a[item] ** 2 * weight, minlength=n_persons) + 1.0
+        theta += np.clip(gradient / curvature, -1.0, 1.0)
+
+        # One Newton step on (a, c) for every item at once, solving each 2x2 system in closed form
+        ability = theta[person]
+        prob = _sigmoid(a[item] * ability + c[item])
+        residual = correct - prob
+        weight = prob * (1.0 - prob)
+        gradient_a = np.bincount(item, weights=ability * residual, minlength=n_items) \
+            - (a - 1.0) / DISCRIMINATION_SD ** 2
+        gradient_c = np.bincount(item, weights=residual, minlength=n_items) - c / INTERCEPT_SD ** 2
+        h_aa = np.bincount(item, weights=ability ** 2 * weight, minlength=n_items) + 1.0 / DISCRIMINATION_SD ** 2
+        h_ac = np.bincount(item, weights=ability * weight, minlength=n_items)
+        h_cc = np.bincount(item, weights=weight, minlength=n_items) + 1.0 / INTERCEPT_SD ** 2
+        determinant = h_aa * h_cc - h_ac ** 2
+        a = np.clip(a + np.clip((h_cc * gradient_a - h_ac * gradient_c) / determinant, -0.5, 0.5),
+                    *DISCRIMINATION_RANGE)
+        c = c + np.clip((h_aa * gradient_c - h_ac * gradient_a) / determinant, -1.0, 1.0)
+
+        # Pin the ability scale to mean 0, sd 1 so parameters stay comparable between fits
+        mean, sd = theta.mean(), theta.std() or 1.0
+        theta = (theta - mean) / sd
+        c = c + a * mean
+        a = np.clip(a * sd, *DISCRIMINATION_RANGE)
+
+        if max(np.abs(a - previous_a).max(initial=0), np.abs(c - previous_c).max(initial=0)) < FIT_TOLERANCE:
+            break
+
+    return theta, a, -c / a
+
+
+def _latest_responses(subject_id, batch_size):
+    """``(user_id, question_id, is_correct)`` arrays, latest answer per pair
+
+    Reads the archive tables as well as the live ones, so archiving old
+    attempts does not take their responses out of the calibration.
+    """
+    answer_ids, users, questions, correct = [], [], [], []
+    for answer, attempt in ((AnswerArchive, AssessmentAttemptArchive), (Answer, AssessmentAttempt)):
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                select(answer.id, attempt.user_id, answer.question_id, answer.is_correct)
+                .join(attempt, answer.attempt_id == attempt.id)
+                .join(Assessment, attempt.assessment_id == Assessment.id)
+                .where(Assessment.subject_id == subject_id,
+                       Assessment.question_type.in_(OBJECTIVE_TYPES),
+                       attempt.status == 'completed',
+                       answer.id > last_id)
+                .order_by(answer.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            for answer_id, user_id, question_id, is_correct in rows:
+                answer_ids.append(answer_id)
+                users.append(user_id)
+                questions.append(question_id)
+                correct.append(1 if is_correct else 0)
+
+    # Archived answers keep their ids, so id order is answer order across both tables
+    order = np.argsort(np.array(answer_ids, dtype=np.int64), kind='stable')
+    users = np.array(users, dtype=np.int64)[order]
+    questions = np.array(questions, dtype=np.int64)[order]
+    correct = np.array(correct, dtype=np.int8)[order]
+    if not len(users):
+        return users, questions, correct
+
+    # Keep the last answer for each (user, question)
+    pairs = np.stack([users, questions], axis=1)[::-1]
+    _, first = np.unique(pairs, axis=0, return_index=True)
+    keep = len(users) - 1 - first
+    return users[keep], questions[keep], correct[keep]
+
+
+def fit_subject(subject_id, batch_size=10000):
+    """Refit every objective question of a subject. Returns the number of items written."""
+    users, questions, correct = _latest_responses(subject_id, batch_size)
+    if not len(users):
+        return 0
+
+    user_ids, person = np.unique(users, return_inverse=True)
+    question_ids, item = np.unique(questions, return_inverse=True)
+    _, a, b = fit_2pl(person, item, correct, len(user_ids), len(question_ids))
+    counts = np.bincount(item, minlength=len(question_ids))
+
+    rows = [{'id': int(qid), 'irt_difficulty': float(b[i]), 'irt_discrimination': float(a[i]),
+             'irt_responses': int(counts[i])}
+            for i, qid in enumerate(question_ids)]
+    for start in range(0, len(rows), 1000):
+        db.session.execute(update(Question), rows[start:start + 1000])
+    db.session.commit()
+    return len(rows)
+
+
+def fit_all(batch_size=10000):
+    """Refit item parameters for every subject with objective answers"""
+    subject_ids = db.session.execute(
+        select(Assessment.subject_id).where(Assessment.question_type.in_(OBJECTIVE_TYPES)).distinct()
+    ).scalars().all()
+    return {subject_id: fit_subject(subject_id, batch_size) for subject_id in subject_ids}
+
+
+def next_fit_run(now=None):
+    """UTC time of the next nightly fit"""
+    now = now or datetime.utcnow()
+    offset_hours = current_app.config.get('STUDY_TIMEZONE_OFFSET', 8)
+    run = datetime.combine(local_day(now, offset_hours), datetime.min.time()) \
+        + timedelta(hours=FIT_HOUR - offset_hours)
+    while run <= now:
+        run += timedelta(days=1)
+    return run
+
+
+def parse_options(value):
+    """Stored MCQ options as ``[{'key': 'A', 'text': ...}, ...]``"""
+    if not value:
+        return []
+    options = json.loads(value) if isinstance(value, str) else value
+    parsed = []
+    for i, option in enumerate(options):
+        if isinstance(option, dict):
+            parsed.append({'key': str(option.get('key', chr(65 + i))), 'text': option.get('text', '')})
+        else:
+            parsed.append({'key': chr(65 + i), 'text': str(option)})
+    return parsed
+
+
+class ItemBank:
+    """An assessment's questions with their IRT parameters as parallel arrays"""
+
+    def __init__(self, assessment_id, questions):
+        self.assessment_id = assessment_id
+        self.question_ids = np.array([q.id for q in questions], dtype=np.int64)
+        self.index = {q.id: i for i, q in enumerate(questions)}
+        # Unfitted questions get the prior: average difficulty, unit discrimination
+        self.a = np.array([q.irt_discrimination or 1.0 for q in questions])
+        self.b = np.array([q.irt_difficulty if q.irt_difficulty is not None else 0.0 for q in questions])
+        self.answers = [(q.correct_answer or '').strip().upper() for q in questions]
+        self.marks = [q.marks or 0 for q in questions]
+        self.items = [{
+            'id': q.id,
+            'question': q.question_text,
+            'options': parse_options(q.options),
+            'explanation': q.explanation,
+        } for q in questions]
+
+    def question(self, index):
+        """An item as shown before it is answered, without its explanation"""
+        item = self.items[index]
+        return {'id': item['id'], 'question': item['question'], 'options': item['options']}
+
+    def __len__(self):
+        return len(self.items)
+
+    def estimate(self, asked, responses):
+        """Ability estimate and its standard error after the given responses"""
+        log_posterior = LOG_PRIOR.copy()
+        if asked:
+            index = np.array(asked)
+            prob = _sigmoid(self.a[index, None] * (GRID[None, :] - self.b[index, None]))
+            outcome = np.array(responses, dtype=bool)[:, None]
+            log_posterior += np.where(outcome, np.log(prob), np.log1p(-prob)).sum(axis=0)
+        weights = np.exp(log_posterior - log_posterior.max())
+        weights /= weights.sum()
+        theta = float(weights @ GRID)
+        return theta, float(np.sqrt(weights @ (GRID - theta) ** 2))
+
+    def next_item(self, theta, asked):
+        """Index of the most informative unasked item, or None when all are used"""
+        prob = _sigmoid(self.a * (theta - self.b))
+        information = self.a ** 2 * prob * (1.0 - prob)
+        if asked:
+            information[np.array(asked)] = -1.0
+        candidates = np.argsort(information)[::-1][:RANDOMESQUE]
+        candidates = [int(i) for i in candidates if information[i] >= 0]
+        return random.choice(candidates) if candidates else None
+
+    def is_correct(self, index, choice):
+        return choice is not None and str(choice).strip().upper() == self.answers[index]
+
+
+_banks = {}
+_banks_lock = threading.Lock()
+
+
+def item_bank(assessment_id):
+    """The cached ``ItemBank`` of an assessment, reloaded every ``BANK_TTL`` seconds"""
+    cached = _banks.get(assessment_id)
+    if cached is not None and time.monotonic() - cached[0] < BANK_TTL:
+        return cached[1]
+    with _banks_lock:
+        cached = _banks.get(assessment_id)
+        if cached is None or time.monotonic() - cached[0] >= BANK_TTL:
+            questions = (Question.query
+                         .filter_by(assessment_id=assessment_id)
+                         .order_by(Question.order, Question.id)
+                         .all())
+            cached = (time.monotonic(), ItemBank(assessment_id, questions))
+            _banks[assessment_id] = cached
+    return cached[1]
+
+
+def should_stop(bank, asked, standard_error):
+    if len(asked) >= min(MAX_ITEMS, len(bank)):
+        return True
+    return len(asked) >= MIN_ITEMS and standard_error < TARGET_SE
+
+
+def test_key(user_id, assessment_id):
+    return f'{TEST_PREFIX}{user_id}:{assessment_id}'
+
+
+def _write_step(connection, key, fields):
+    with connection.pipeline() as pipe:
+        pipe.hset(key, mapping=fields)
+        pipe.expire(key, TEST_TTL)
+        pipe.execute()
+
+
+def start_test(user_id, assessment_id, question_id, connection=None):
+    """Start a new test, replacing any running one, waiting on ``question_id``. Returns False without Redis."""
+    key = test_key(user_id, assessment_id)
+    try:
+        connection = connection or get_redis()
+        connection.delete(key)
+        _write_step(connection, key, {'started_at': time.time(), 'asked': '[]', 'choices': '[]',
+                                      'pending': question_id})
+    except redis.RedisError as e:
+        current_app.logger.warning('Could not start adaptive test for user %s: %s', user_id, e)
+        return False
+    return True
+
+
+def take_step(user_id, assessment_id, connection=None):
+    """The running test with its waiting question taken out, or None
+
+    Returns ``{'asked': [...], 'choices': [...], 'pending': question_id,
+    'started_at': ...}``. A second answer to the same question finds
+    nothing waiting.
+    """
+    try:
+        connection = connection or get_redis()
+        values = connection.register_script(_TAKE_STEP)(keys=[test_key(user_id, assessment_id)])
+    except redis.RedisError as e:
+        current_app.logger.warning('Adaptive test state unavailable for user %s: %s', user_id, e)
+        return None
+    if not values:
+        return None
+    values = [value.decode() if isinstance(value, bytes) else value for value in values]
+    state = dict(zip(values[::2], values[1::2]))
+    return {'asked': json.loads(state['asked']), 'choices': json.loads(state['choices']),
+            'pending': int(state['pending']), 'started_at': float(state['started_at'])}
+
+
+def continue_test(user_id, assessment_id, asked, choices, question_id, connection=None):
+    """Record the answers so far and wait on ``question_id``"""
+    try:
+        connection = connection or get_redis()
+        _write_step(connection, test_key(user_id, assessment_id),
+                    {'asked': json.dumps(asked), 'choices': json.dumps(choices), 'pending': question_id})
+    except redis.RedisError as e:
+        current_app.logger.warning('Could not save adaptive test for user %s: %s', user_id, e)
+        return False
+    return True
+
+
+def end_test(user_id, assessment_id, connection=None):
+    try:
+        (connection or get_redis()).delete(test_key(user_id, assessment_id))
+    except redis.RedisError as e:
+        current_app.logger.warning('Could not end adaptive test for user %s: %s', user_id, e)
+
+
+def save_attempt(bank, user_id, asked, choices, responses, theta, time_taken=0):
+    """Persist a finished adaptive test as an attempt with its answers"""
+    marks = [bank.marks[i] if correct else 0 for i, correct in zip(asked, responses)]
+    total = sum(bank.marks[i] for i in asked)
+    attempt = AssessmentAttempt(
+        user_id=user_id,
+        assessment_id=bank.assessment_id,
+        score=sum(marks),
+        total_marks=total,
+        percentage=round(sum(marks) / total * 100, 1) if total else 0,
+        ability=theta,
+        time_taken=time_taken,
+        status='completed',
+        completed_at=datetime.utcnow()
+    )
+    db.session.add(attempt)
+    db.session.flush()
+    db.session.add_all([
+        Answer(attempt_id=attempt.id, question_id=int(bank.question_ids[i]), answer_text=choice,
+               is_correct=bool(correct), marks_obtained=mark)
+        for i, choice, correct, mark in zip(asked, choices, responses, marks)
+    ])
+    db.session.flush()
+    return attempt
@@ -0,0 +1,113 @@
+"""Hot/cold split of assessment attempts and their answers.
+
+Attempts older than ``ARCHIVE_AFTER_DAYS`` move, with their answers, into
+``assessment_attempt_archive`` and ``answer_archive``. Those are compressed
+and indexed only for per-student lookups, so the live tables and their
+indexes stay sized to the current term. A batch is copied with
+``INSERT ... SELECT`` and deleted from the live tables in the same
+transaction, so an attempt is always in exactly one place.
+
+Attempts are walked in id order. Their ids follow ``started_at``, because
+``started_at`` defaults to the insert time, so the walk stops at the first
+attempt newer than the cutoff instead of scanning the live table. A
+subjective attempt whose answers are still waiting to be scored stays in
+the live table; answers to questions that cannot be scored do not hold it
+back.
+
+Archived answers stay part of the IRT calibration: ``adaptive.fit_subject``
+reads the archive tables as well as the live ones.
+
+``attempt_history`` reads the live table first and only goes to the
+archive for the part of a page the live table cannot fill. History pages
+therefore look the same whether or not an attempt was archived.
+"""
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, exists, insert, literal, select
+
+from app.extensions import db
+from app.models import Answer, AnswerArchive, Assessment, AssessmentAttempt, AssessmentAttemptArchive, Question
+from app.services.subjective_scoring import scorable
+
+HISTORY_PAGE_SIZE = 20
+
+ATTEMPT_COLUMNS = ('id', 'user_id', 'assessment_id', 'score', 'total_marks', 'percentage', 'time_taken',
+                   'ability', 'status', 'started_at', 'completed_at', 'created_at')
+ANSWER_COLUMNS = ('id', 'attempt_id', 'question_id', 'answer_text', 'is_correct', 'marks_obtained',
+                  'feedback', 'auto_scored_at', 'created_at', 'updated_at')
+
+
+def archive_cutoff(now=None, days=None):
+    days = days if days is not None else current_app.config.get('ARCHIVE_AFTER_DAYS', 180)
+    return (now or datetime.utcnow()) - timedelta(days=days)
+
+
+def _copy(source, target, columns, condition, now):
+    db.session.execute(
+        insert(target.__table__).from_select(
+            [*columns, 'archived_at'],
+            select(*[source.__table__.c[c] for c in columns], literal(now)).where(condition)
+        )
+    )
+
+
+def archive_attempts(cutoff=None, batch_size=500):
+    """Move attempts started before ``cutoff`` to the archive. Returns the number moved."""
+    cutoff = cutoff or archive_cutoff()
+    unscored = exists().where(Answer.attempt_id == AssessmentAttempt.id,
+                              Answer.auto_scored_at.is_(None),
+                              Answer.question_id == Question.id,
+                              scorable(),
+                              AssessmentAttempt.status == 'submitted')
+    moved = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(AssessmentAttempt.id, AssessmentAttempt.started_at, (~unscored).label('ready'))
+            .where(AssessmentAttempt.id > last_id)
+            .order_by(AssessmentAttempt.id)
+            .limit(batch_size)
+        ).all()
+        old = [row for row in rows if row.started_at is None or row.started_at < cutoff]
+        ids = [row.id for row in old if row.ready]
+        if ids:
+            now = datetime.utcnow()
+            _copy(AssessmentAttempt, AssessmentAttemptArchive, ATTEMPT_COLUMNS, AssessmentAttempt.id.in_(ids), now)
+            _copy(Answer, AnswerArchive, ANSWER_COLUMNS, Answer.attempt_id.in_(ids), now)
+            db.session.execute(delete(Answer).where(Answer.attempt_id.in_(ids)))
+            db.session.execute(delete(AssessmentAttempt).where(AssessmentAttempt.id.in_(ids)))
+            db.session.commit()
+            moved += len(ids)
+        else:
+            db.session.rollback()
+        if len(old) < len(rows) or len(rows) < batch_size:
+            break
+        last_id = rows[-1].id
+    return moved
+
+
+def _history_query(model, user_id, before, limit):
+    query = (select(model.id, model.assessment_id, model.score, model.total_marks, model.percentage,
+                    model.status, model.started_at, model.completed_at, Assessment.title,
+                    Assessment.question_type)
+             .join(Assessment, model.assessment_id == Assessment.id)
+             .where(model.user_id == user_id))
+    if before is not None:
+        query = query.where(model.id < before)
+    return db.session.execute(query.order_by(model.id.desc()).limit(limit)).all()
+
+
+def attempt_history(user_id, before=None, limit=HISTORY_PAGE_SIZE):
+    """One page of the user's attempts, newest first, from the live table then the archive
+
+    ``before`` is the id of the last attempt on the previous page.
+    """
+    rows = _history_query(AssessmentAttempt, user_id, before, limit)
+    if len(rows) < limit:
+        # Usually the archived attempts simply follow, but an old attempt held
+        # back for scoring can sit between them, so merge by id
+        rows += _history_query(AssessmentAttemptArchive, user_id, before, limit)
+        rows = sorted(rows, key=lambda row: row.id, reverse=True)[:limit]
+    return rows
+
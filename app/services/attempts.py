@@ -0,0 +1,312 @@
+"""Timed assessment attempts, kept in Redis until they end.
+
+Opening an assessment with a time limit starts, or resumes, an attempt: a
+hash at ``cikgu:attempt:<user_id>:<assessment_id>`` holding the start time,
+the deadline and one ``answer:<question_id>`` field per answer saved so far.
+The hash is also a member of the ``cikgu:attempt-deadlines`` sorted set,
+scored by its deadline. The deadline is set on the server when the attempt
+starts, so reloading the page or changing the device clock gives no extra
+time. Saving an answer is a single ``HSET``. Nothing is written to the
+database until the attempt ends, and the hash expires ``STATE_TTL`` after
+its deadline so abandoned attempts cannot pile up.
+
+An attempt ends exactly once. Whoever takes the hash first writes it to the
+database, either the student's submit or ``expire_attempts``, which runs
+every ``EXPIRY_INTERVAL`` seconds on the grading queue and submits overdue
+attempts in batches. The hash is read and deleted by one script, so the
+other side finds it gone. Answers are accepted until the deadline plus
+``SUBMIT_GRACE_SECONDS`` for requests still in flight, and the time taken is
+capped at the limit. The id of a finished attempt is kept for
+``RESULT_TTL`` together with whether the expiry job or the student ended
+it, so a submit arriving late, or sent twice, can still send the page to
+the result and tell the two apart.
+
+Without Redis, or without a time limit, a submit is recorded straight
+away with the time reported by the page, as before.
+"""
+import time
+from datetime import datetime
+
+import redis
+from flask import current_app
+from sqlalchemy.orm import selectinload
+
+from app.extensions import db, get_redis
+from app.models import Answer, Assessment, AssessmentAttempt
+from app.services import events
+from app.services.reviews import record_attempts
+from app.tasks.grading import score_subjective_assessment
+from app.tasks.queues import enqueue
+
+ATTEMPT_PREFIX = 'cikgu:attempt:'
+RESULT_PREFIX = 'cikgu:attempt-result:'
+DEADLINES_KEY = 'cikgu:attempt-deadlines'
+ANSWER_PREFIX = 'answer:'
+SUBMIT_GRACE_SECONDS = 10
+STATE_TTL = 24 * 3600
+RESULT_TTL = 3600
+EXPIRY_INTERVAL = 30
+KINDS = ('mcq', 'subjective')
+
+# KEYS: attempt hash, deadline set. ARGV: now, deadline, ttl, then field/value pairs.
+# Creates the attempt unless one is running. Returns {started_at, deadline}.
+_START = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('HSET', KEYS[1], 'started_at', ARGV[1], 'deadline', ARGV[2], unpack(ARGV, 4))
+    redis.call('EXPIREAT', KEYS[1], math.ceil(tonumber(ARGV[2]) + tonumber(ARGV[3])))
+    redis.call('ZADD', KEYS[2], ARGV[2], KEYS[1])
+end
+return redis.call('HMGET', KEYS[1], 'started_at', 'deadline')
+"""
+
+# KEYS: attempt hash. ARGV: now, grace, then field/value pairs.
+# Stores the answers if the attempt is still running. Returns 1 if it did.
+_SAVE = """
+local deadline = tonumber(redis.call('HGET', KEYS[1], 'deadline'))
+if not deadline or tonumber(ARGV[1]) > deadline + tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+return 1
+"""
+
+# KEYS: attempt hash, deadline set. Removes the attempt and returns its fields.
+_TAKE = """
+local state = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+redis.call('ZREM', KEYS[2], KEYS[1])
+return state
+"""
+
+
+def attempt_key(user_id, assessment_id):
+    return f'{ATTEMPT_PREFIX}{user_id}:{assessment_id}'
+
+
+def _decode(values):
+    values = [value.decode() if isinstance(value, bytes) else value for value in values]
+    return dict(zip(values[::2], values[1::2]))
+
+
+def _answer_fields(answers):
+    fields = []
+    for question_id, value in answers.items():
+        if value is not None:
+            fields.extend((f'{ANSWER_PREFIX}{question_id}', str(value)))
+    return fields
+
+
+def start_attempt(user_id, assessment, kind, now=None, connection=None):
+    """Start or resume the user's attempt. Returns the seconds left, or None if untimed."""
+    if kind not in KINDS:
+        raise ValueError(f'Unknown attempt kind {kind!r}')
+    if not assessment.time_limit:
+        return None
+    now = now or time.time()
+    deadline = now + assessment.time_limit * 60
+    try:
+        connection = connection or get_redis()
+        started_at, deadline = connection.register_script(_START)(
+            keys=[attempt_key(user_id, assessment.id), DEADLINES_KEY],
+            args=[now, deadline, STATE_TTL, 'user_id', user_id, 'assessment_id', assessment.id, 'kind', kind])
+    except redis.RedisError as e:
+        current_app.logger.warning('Could not start timed attempt for user %s: %s', user_id, e)
+        return None
+    return max(0, int(float(deadline) - now))
+
+
+def save_answers(user_id, assessment_id, answers, now=None, connection=None):
+    """Store answers ``{question_id: value}`` in the running attempt
+
+    Returns False when there is no running attempt or its time is up.
+    """
+    fields = _answer_fields(answers)
+    if not fields:
+        return True
+    try:
+        connection = connection or get_redis()
+        saved = connection.register_script(_SAVE)(
+            keys=[attempt_key(user_id, assessment_id)],
+            args=[now or time.time(), SUBMIT_GRACE_SECONDS, *fields])
+    except redis.RedisError as e:
+        current_app.logger.warning('Could not save answers for user %s: %s', user_id, e)
+        return False
+    return bool(saved)
+
+
+def _take(connection, key):
+    return _decode(connection.register_script(_TAKE)(keys=[key, DEADLINES_KEY]))
+
+
+def _put_back(connection, key, state):
+    # The database write failed; let the next submit or expiry run try again
+    try:
+        with connection.pipeline() as pipe:
+            pipe.hset(key, mapping=state)
+            pipe.expireat(key, int(float(state['deadline']) + STATE_TTL))
+            pipe.zadd(DEADLINES_KEY, {key: float(state['deadline'])})
+            pipe.execute()
+    except redis.RedisError as e:
+        current_app.logger.error('Lost timed attempt %s after a failed write: %s', key, e)
+
+
+def _stored_answers(state):
+    return {int(field[len(ANSWER_PREFIX):]): value for field, value in state.items()
+            if field.startswith(ANSWER_PREFIX)}
+
+
+def _add_answers(attempt, kind, questions, answers):
+    if kind == 'subjective':
+        for question_id, text in answers.items():
+            if question_id in questions:
+                db.session.add(Answer(attempt_id=attempt.id, question_id=question_id, answer_text=text))
+        return
+
+    score = 0
+    for question_id, choice in answers.items():
+        question = questions.get(question_id)
+        if question is None:
+            continue
+        is_correct = choice is not None and str(choice).strip().upper() == (question.correct_answer or '').strip().upper()
+        marks = (question.marks or 0) if is_correct else 0
+        score += marks
+        db.session.add(Answer(attempt_id=attempt.id, question_id=question.id, answer_text=choice,
+                              is_correct=is_correct, marks_obtained=marks))
+    attempt.score = score
+    attempt.percentage = round(score / attempt.total_marks * 100, 1) if attempt.total_marks else 0
+
+
+def _record(submissions, completed_at):
+    """Write ``(user_id, assessment, kind, answers, time_taken)`` tuples in one transaction
+
+    Returns the new attempts in the same order.
+    """
+    attempts = []
+    for user_id, assessment, kind, answers, time_taken in submissions:
+        questions = {q.id: q for q in assessment.questions}
+        attempt = AssessmentAttempt(
+            user_id=user_id,
+            assessment_id=assessment.id,
+            total_marks=sum(q.marks or 0 for q in questions.values()),
+            time_taken=time_taken,
+            status='submitted' if kind == 'subjective' else 'completed',
+            completed_at=completed_at
+        )
+        db.session.add(attempt)
+        attempts.append((attempt, kind, questions, answers))
+    db.session.flush()
+
+    for attempt, kind, questions, answers in attempts:
+        _add_answers(attempt, kind, questions, answers)
+    db.session.flush()
+
+    record_attempts([attempt.id for attempt, kind, _, _ in attempts if kind == 'mcq'])
+    db.session.commit()
+
+    # Scored in bulk per assessment; submissions arriving while a scoring job
+    # is queued are picked up by that same job
+    for assessment_id in sorted({attempt.assessment_id for attempt, kind, _, _ in attempts if kind == 'subjective'}):
+        try:
+            enqueue('grading', score_subjective_assessment, assessment_id,
+                    dedup_key=f'score-subjective:{assessment_id}')
+        except redis.RedisError as e:
+            current_app.logger.warning('Could not queue scoring for assessment %s: %s', assessment_id, e)
+    return [attempt for attempt, _, _, _ in attempts]
+
+
+def _time_taken(state, now):
+    started_at, deadline = float(state['started_at']), float(state['deadline'])
+    return max(0, int(min(now, deadline) - started_at))
+
+
+def submit_attempt(user_id, assessment, kind, answers, time_spent=0, now=None, connection=None):
+    """End the user's attempt with the page's final ``answers``
+
+    Returns ``(attempt_id, auto_submitted)``; ``auto_submitted`` is True when
+    the time ran out before the submit arrived and the attempt was already
+    recorded with the answers saved until then. A repeated submit returns the
+    attempt it ended the first time, with ``auto_submitted`` False.
+    """
+    now = now or time.time()
+    key = attempt_key(user_id, assessment.id)
+    try:
+        connection = connection or get_redis()
+        state = _take(connection, key)
+        if not state:
+            finished = connection.get(RESULT_PREFIX + key)
+            if finished is not None:
+                finished = finished.decode() if isinstance(finished, bytes) else finished
+                attempt_id, _, auto_submitted = finished.partition(':')
+                return int(attempt_id), auto_submitted != '0'
+    except redis.RedisError as e:
+        current_app.logger.warning('Timed attempt state unavailable for user %s, recording as sent: %s', user_id, e)
+        connection, state = None, {}
+
+    if not state:
+        # Untimed, or started while Redis was away
+        attempt, = _record([(user_id, assessment, kind, answers, int(time_spent or 0))], datetime.utcnow())
+        return attempt.id, False
+
+    final = _stored_answers(state)
+    if now <= float(state['deadline']) + SUBMIT_GRACE_SECONDS:
+        final.update({question_id: value for question_id, value in answers.items() if value is not None})
+    try:
+        attempt, = _record([(user_id, assessment, kind, final, _time_taken(state, now))], datetime.utcnow())
+    except Exception:
+        db.session.rollback()
+        _put_back(connection, key, state)
+        raise
+    _remember_result(connection, {key: attempt.id}, auto_submitted=False)
+    return attempt.id, False
+
+
+def _remember_result(connection, attempt_ids, auto_submitted):
+    # Stored as "<attempt id>:<1 if the expiry job ended it, else 0>"
+    try:
+        with connection.pipeline(transaction=False) as pipe:
+            for key, attempt_id in attempt_ids.items():
+                pipe.set(RESULT_PREFIX + key, f'{attempt_id}:{int(auto_submitted)}', ex=RESULT_TTL)
+            pipe.execute()
+    except redis.RedisError as e:
+        current_app.logger.warning('Could not remember finished attempts: %s', e)
+
+
+def expire_attempts(batch_size=200, now=None, connection=None):
+    """Record every attempt whose time is up with the answers it has. Returns how many."""
+    connection = connection or get_redis()
+    now = now or time.time()
+    expired = 0
+    while True:
+        keys = connection.zrangebyscore(DEADLINES_KEY, '-inf', now - SUBMIT_GRACE_SECONDS, start=0, num=batch_size)
+        if not keys:
+            return expired
+        taken = {}
+        for key in keys:
+            key = key.decode() if isinstance(key, bytes) else key
+            state = _take(connection, key)
+            if state:
+                taken[key] = state
+
+        if taken:
+            assessment_ids = {int(state['assessment_id']) for state in taken.values()}
+            assessments = {a.id: a for a in Assessment.query.options(selectinload(Assessment.questions))
+                           .filter(Assessment.id.in_(assessment_ids))}
+            # An assessment deleted mid-attempt leaves nothing to record against
+            batch = {key: state for key, state in taken.items() if int(state['assessment_id']) in assessments}
+            try:
+                attempts = _record([(int(state['user_id']), assessments[int(state['assessment_id'])], state['kind'],
+                                     _stored_answers(state), _time_taken(state, now))
+                                    for state in batch.values()], datetime.utcnow())
+            except Exception:
+                db.session.rollback()
+                for key, state in taken.items():
+                    _put_back(connection, key, state)
+                raise
+            _remember_result(connection, {key: attempt.id for key, attempt in zip(batch, attempts)},
+                             auto_submitted=True)
+            for attempt in attempts:
+                events.publish(attempt.user_id, 'notification',
+                               f'Masa tamat: jawapan anda untuk "{attempt.assessment.title}" telah dihantar.')
+            expired += len(attempts)
+        if len(keys) < batch_size:
+            return expired
@@ -0,0 +1,68 @@
+from itertools import groupby
+
+from app.extensions import db
+
+
+def _dialect_insert(dialect_name):
+    if dialect_name in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert
+    elif dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        raise NotImplementedError(f'Upserts are not supported on {dialect_name}')
+    return insert
+
+
+def _upsert_statement(dialect_name, table, chunk, index_elements, update_columns, increment_columns):
+    insert = _dialect_insert(dialect_name)
+    stmt = insert(table).values(chunk)
+    incoming = stmt.inserted if dialect_name in ('mysql', 'mariadb') else stmt.excluded
+
+    updates = {c: incoming[c] for c in update_columns}
+    updates.update({c: table.c[c] + incoming[c] for c in increment_columns})
+
+    if dialect_name in ('mysql', 'mariadb'):
+        if not updates:
+            return stmt.prefix_with('IGNORE')
+        return stmt.on_duplicate_key_update(updates)
+
+    if not updates:
+        return stmt.on_conflict_do_nothing(index_elements=index_elements)
+    return stmt.on_conflict_do_update(index_elements=index_elements, set_=updates)
+
+
+def upsert(table, rows, index_elements, update_columns=None, increment_columns=(), batch_size=500, session=None):
+    """Insert rows in multi-row statements, updating them on unique key conflicts.
+
+    ``table`` is a model class or a Table. ``index_elements`` names the
+    columns of the unique key the rows are matched on. Only the columns a row
+    actually carries are written, so rows are grouped by their column set and
+    each group is sent as one ``INSERT ... VALUES (...), (...)`` per batch.
+    ``update_columns`` restricts what is overwritten on conflict; by default
+    it is every supplied column outside the key. ``increment_columns`` are
+    added to the stored value instead of replacing it. Returns the number of
+    rows sent.
+    """
+    table = getattr(table, '__table__', table)
+    session = session or db.session
+    dialect_name = session.get_bind().dialect.name
+    index_elements = list(index_elements)
+
+    sent = 0
+    keyed = sorted(rows, key=lambda row: tuple(sorted(row)))
+    for columns, group in groupby(keyed, key=lambda row: tuple(sorted(row))):
+        group = list(group)
+        if update_columns is None:
+            updates = [c for c in columns if c not in index_elements and c not in increment_columns]
+        else:
+            updates = [c for c in update_columns if c in columns]
+        increments = [c for c in increment_columns if c in columns]
+
+        for start in range(0, len(group), batch_size):
+            chunk = group[start:start + batch_size]
+            session.execute(_upsert_statement(dialect_name, table, chunk, index_elements, updates, increments))
+            sent += len(chunk)
+
+    return sent
@@ -0,0 +1,513 @@
+"""Bulk curriculum import.
+
+Bundles are JSON documents, JSON Lines files or per-entity CSV files (or a
+directory holding any of them). Every record is addressed by its natural
+key -- subject code, chapter order within the subject, section order within
+the chapter, assessment title within the subject and question order within
+the assessment -- so a bundle can be re-imported at any time.
+
+Import runs in two passes. The first streams every record through
+validation without touching the database (apart from resolving parents that
+the bundle references but does not contain). The second buffers records per
+entity, diffs each batch against the rows already stored and sends only the
+new and changed rows as multi-row upserts, committing once per batch so the
+load never holds long locks.
+"""
+import csv
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from sqlalchemy import select, tuple_
+
+from app.extensions import db
+from app.models import Subject, Chapter, Section, Assessment, Question, QuestionType
+from app.services.bulk import upsert
+
+# Parents always come before their children
+KIND_ORDER = ['subject', 'chapter', 'section', 'assessment', 'question']
+
+_KIND_ALIASES = {
+    'subjects': 'subject',
+    'chapters': 'chapter',
+    'sections': 'section',
+    'assessments': 'assessment',
+    'questions': 'question',
+}
+
+
+class ContentImportError(ValueError):
+    """Raised when a bundle record cannot be imported"""
+
+    def __init__(self, message, source=None, line=None):
+        self.source = source
+        self.line = line
+        location = f'{source}:{line}: ' if source else ''
+        super().__init__(f'{location}{message}')
+
+
+# Field parsers. Each takes the raw value (already known to be non-empty)
+# and returns the value to store, raising ValueError when it is unusable.
+
+def _string(max_length=None):
+    def parse(value):
+        value = str(value).strip()
+        if max_length and len(value) > max_length:
+            raise ValueError(f'longer than {max_length} characters')
+        return value
+    return parse
+
+
+def _integer(value):
+    if isinstance(value, bool):
+        raise ValueError('expected an integer')
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError('expected an integer')
+
+
+def _boolean(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('1', 'true', 'yes', 'y'):
+        return True
+    if text in ('0', 'false', 'no', 'n'):
+        return False
+    raise ValueError('expected a boolean')
+
+
+def _json_list(value):
+    # CSV cells carry JSON as text, JSON bundles carry it natively
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            raise ValueError('expected a JSON list')
+    if not isinstance(value, list):
+        raise ValueError('expected a list')
+    return value
+
+
+def _question_type(value):
+    try:
+        return QuestionType(str(value).strip().lower())
+    except ValueError:
+        choices = ', '.join(t.value for t in QuestionType)
+        raise ValueError(f'expected one of {choices}')
+
+
+@dataclass(frozen=True)
+class _Entity:
+    kind: str
+    model: type
+    # Record fields that address the parent row, and the ones that address
+    # this row within it. Together they form the natural key.
+    parent_keys: tuple
+    own_keys: tuple
+    fields: dict
+    required: tuple = ()
+    parent: str = None
+    parent_column: str = None
+
+    @property
+    def key_fields(self):
+        return self.parent_keys + self.own_keys
+
+    @property
+    def db_keys(self):
+        return ((self.parent_column,) if self.parent_column else ()) + self.own_keys
+
+
+ENTITIES = {
+    'subject': _Entity(
+        kind='subject', model=Subject,
+        parent_keys=(), own_keys=('code',),
+        fields={
+            'code': _string(10),
+            'name': _string(100),
+            'description': _string(),
+            'is_active': _boolean,
+        },
+        required=('name',),
+    ),
+    'chapter': _Entity(
+        kind='chapter', model=Chapter,
+        parent_keys=('subject_code',), own_keys=('order',),
+        fields={
+            'subject_code': _string(10),
+            'order': _integer,
+            'title': _string(200),
+            'description': _string(),
+            'content': _string(),
+            'estimated_time': _integer,
+            'is_active': _boolean,
+        },
+        required=('title',),
+        parent='subject', parent_column='subject_id',
+    ),
+    'section': _Entity(
+        kind='section', model=Section,
+        parent_keys=('subject_code', 'chapter_order'), own_keys=('order',),
+        fields={
+            'subject_code': _string(10),
+            'chapter_order': _integer,
+            'order': _integer,
+            'title': _string(200),
+            'content': _string(),
+            'key_points': _json_list,
+            'examples': _json_list,
+            'is_active': _boolean,
+        },
+        required=('title',),
+        parent='chapter', parent_column='chapter_id',
+    ),
+    'assessment': _Entity(
+        kind='assessment', model=Assessment,
+        parent_keys=('subject_code',), own_keys=('title',),
+        fields={
+            'subject_code': _string(10),
+            'title': _string(200),
+            'chapter_order': _integer,
+            'description': _string(),
+            'question_type': _question_type,
+            'time_limit': _integer,
+            'total_marks': _integer,
+            'is_active': _boolean,
+        },
+        required=('question_type',),
+        parent='subject', parent_column='subject_id',
+    ),
+    'question': _Entity(
+        kind='question', model=Question,
+        parent_keys=('subject_code', 'assessment_title'), own_keys=('order',),
+        fields={
+            'subject_code': _string(10),
+            'assessment_title': _string(200),
+            'order': _integer,
+            'question_text': _string(),
+            'options': _json_list,
+            'correct_answer': _string(),
+            'explanation': _string(),
+            'rubric_keywords': _json_list,
+            'min_words': _integer,
+            'max_words': _integer,
+            'marks': _integer,
+        },
+        required=('question_text',),
+        parent='assessment', parent_column='assessment_id',
+    ),
+}
+
+
+def normalize_kind(kind):
+    kind = str(kind or '').strip().lower()
+    kind = _KIND_ALIASES.get(kind, kind)
+    if kind not in ENTITIES:
+        raise ValueError(f'unknown record type {kind!r}')
+    return kind
+
+
+def validate_record(kind, record):
+    """Return the parsed fields of a raw record, raising ValueError if invalid"""
+    entity = ENTITIES[kind]
+    parsed = {}
+    for name, parse in entity.fields.items():
+        value = record.get(name)
+        if value is None or (isinstance(value, str) and not value.strip()):
+            continue
+        try:
+            parsed[name] = parse(value)
+        except ValueError as e:
+            raise ValueError(f'{kind} field {name!r}: {e}')
+
+    missing = [name for name in entity.key_fields + entity.required if name not in parsed]
+    if missing:
+        raise ValueError(f'{kind} is missing {", ".join(missing)}')
+
+    unknown = {name for name in record if name is not None} - set(entity.fields) - {'type'}
+    if unknown:
+        raise ValueError(f'{kind} has unknown fields {", ".join(sorted(unknown))}')
+
+    return parsed
+
+
+def _kind_from_filename(path):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return normalize_kind(stem)
+
+
+def _bundle_files(path):
+    if not os.path.isdir(path):
+        return [path]
+
+    def sort_key(name):
+        stem = os.path.splitext(name)[0].lower()
+        kind = _KIND_ALIASES.get(stem, stem)
+        return (KIND_ORDER.index(kind) if kind in KIND_ORDER else -1, name)
+
+    names = [n for n in os.listdir(path) if n.lower().endswith(('.json', '.jsonl', '.ndjson', '.csv'))]
+    return [os.path.join(path, n) for n in sorted(names, key=sort_key)]
+
+
+def iter_records(path):
+    """Yield ``(kind, source, line, record)`` for every raw record under ``path``
+
+    JSON Lines and CSV files are read one line at a time. A plain JSON file is
+    either a list of records carrying a ``type`` field or an object mapping
+    plural kinds (``subjects``, ``chapters``...) to lists of records.
+    """
+    for source in _bundle_files(path):
+        extension = os.path.splitext(source)[1].lower()
+
+        if extension == '.csv':
+            kind = _kind_from_filename(source)
+            with open(source, newline='', encoding='utf-8') as f:
+                reader = csv.DictReader(f)
+                for record in reader:
+                    yield kind, source, reader.line_num, record
+
+        elif extension in ('.jsonl', '.ndjson'):
+            with open(source, encoding='utf-8') as f:
+                for line, text in enumerate(f, start=1):
+                    if not text.strip():
+                        continue
+                    try:
+                        record = json.loads(text)
+                    except json.JSONDecodeError as e:
+                        raise ContentImportError(f'invalid JSON: {e.msg}', source, line)
+                    if not isinstance(record, dict):
+                        raise ContentImportError('expected an object', source, line)
+                    yield record.get('type'), source, line, record
+
+        elif extension == '.json':
+            with open(source, encoding='utf-8') as f:
+                try:
+                    document = json.load(f)
+                except json.JSONDecodeError as e:
+                    raise ContentImportError(f'invalid JSON: {e.msg}', source, e.lineno)
+            if isinstance(document, dict):
+                ordered = sorted(document.items(), key=lambda item: KIND_ORDER.index(normalize_kind(item[0])))
+                for kind, records in ordered:
+                    for index, record in enumerate(records or [], start=1):
+                        yield kind, source, f'{kind}[{index}]', record
+            else:
+                for index, record in enumerate(document, start=1):
+                    yield (record.get('type') if isinstance(record, dict) else None), source, f'[{index}]', record
+
+        else:
+            raise ContentImportError('unsupported bundle format', source)
+
+
+@dataclass
+class ImportReport:
+    inserted: dict = field(default_factory=lambda: dict.fromkeys(KIND_ORDER, 0))
+    updated: dict = field(default_factory=lambda: dict.fromkeys(KIND_ORDER, 0))
+    unchanged: dict = field(default_factory=lambda: dict.fromkeys(KIND_ORDER, 0))
+    # (action, kind, natural key) for every row that was or would be written
+    changes: list = field(default_factory=list)
+    errors: list = field(default_factory=list)
+
+    @property
+    def total_changed(self):
+        return sum(self.inserted.values()) + sum(self.updated.values())
+
+
+class ContentImporter:
+    """Validate and upsert curriculum bundles in batches"""
+
+    def __init__(self, batch_size=500, dry_run=False, session=None):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.session = session or db.session
+        self.report = ImportReport()
+        self._pending = {kind: {} for kind in KIND_ORDER}
+        # Natural key -> primary key for parent rows. In a dry run, parents
+        # that would be created map to None.
+        self._ids = {'subject': {}, 'chapter': {}, 'assessment': {}}
+
+    # -- pass 1 ---------------------------------------------------------
+
+    def validate(self, paths, max_errors=50):
+        """Stream every record through validation and check parent references"""
+        seen = {kind: set() for kind in self._ids}
+        referenced = {kind: {} for kind in self._ids}
+
+        for path in paths:
+            try:
+                for kind, source, line, record in iter_records(path):
+                    try:
+                        if not isinstance(record, dict):
+                            raise ValueError('expected an object')
+                        kind = normalize_kind(kind)
+                        parsed = validate_record(kind, record)
+                    except ValueError as e:
+                        self._error(str(e), source, line)
+                        if len(self.report.errors) >= max_errors:
+                            return False
+                        continue
+
+                    entity = ENTITIES[kind]
+                    if kind in seen:
+                        seen[kind].add(tuple(parsed[k] for k in entity.key_fields))
+                    if entity.parent:
+                        parent_key = tuple(parsed[k] for k in entity.parent_keys)
+                        referenced[entity.parent].setdefault(parent_key, (source, line))
+                    if kind == 'assessment' and 'chapter_order' in parsed:
+                        chapter_key = (parsed['subject_code'], parsed['chapter_order'])
+                        referenced['chapter'].setdefault(chapter_key, (source, line))
+            except ContentImportError as e:
+                self.report.errors.append(str(e))
+                return False
+
+        for kind in self._ids:
+            missing = [key for key in referenced[kind] if key not in seen[kind]]
+            found = self._lookup_ids(kind, missing)
+            for key in missing:
+                if key not in found:
+                    source, line = referenced[kind][key]
+                    self._error(f'unknown {kind} {"/".join(map(str, key))}', source, line)
+
+        return not self.report.errors
+
+    def _error(self, message, source, line):
+        self.report.errors.append(str(ContentImportError(message, source, line)))
+
+    # -- pass 2 ---------------------------------------------------------
+
+    def run(self, paths):
+        """Validate ``paths`` and, if they are clean, import them. Returns the report."""
+        if not self.validate(paths):
+            return self.report
+
+        for path in paths:
+            for kind, source, line, record in iter_records(path):
+                kind = normalize_kind(kind)
+                parsed = validate_record(kind, record)
+                key = tuple(parsed[k] for k in ENTITIES[kind].key_fields)
+                # Later records win over earlier ones with the same key
+                self._pending[kind][key] = parsed
+                if len(self._pending[kind]) >= self.batch_size:
+                    self._flush(kind)
+
+        for kind in KIND_ORDER:
+            self._flush(kind)
+
+        return self.report
+
+    def _flush(self, kind):
+        if not self._pending[kind]:
+            return
+
+        # Children can only be resolved once their parents are written
+        for earlier in KIND_ORDER[:KIND_ORDER.index(kind)]:
+            self._flush(earlier)
+
+        entity = ENTITIES[kind]
+        batch = self._pending[kind]
+        self._pending[kind] = {}
+
+        if entity.parent:
+            self._resolve(entity.parent, {tuple(p[k] for k in entity.parent_keys) for p in batch.values()})
+        if kind == 'assessment':
+            self._resolve('chapter', {(p['subject_code'], p['chapter_order'])
+                                      for p in batch.values() if 'chapter_order' in p})
+
+        rows = {}
+        for key, parsed in batch.items():
+            rows[key] = self._to_row(entity, parsed)
+
+        existing = self._existing_rows(entity, [row for row in rows.values() if self._has_parent(entity, row)])
+
+        now = datetime.utcnow()
+        to_write = []
+        for key, row in rows.items():
+            current = existing.get(tuple(row[c] for c in entity.db_keys)) if self._has_parent(entity, row) else None
+            if current is None:
+                action = 'insert'
+                row.setdefault('created_at', now)
+            elif any(current[column] != value for column, value in row.items()):
+                action = 'update'
+            else:
+                self.report.unchanged[kind] += 1
+                if kind in self._ids:
+                    self._ids[kind][key] = current['id']
+                continue
+
+            row['updated_at'] = now
+            getattr(self.report, 'inserted' if action == 'insert' else 'updated')[kind] += 1
+            self.report.changes.append((action, kind, key))
+            if current is not None and kind in self._ids:
+                self._ids[kind][key] = current['id']
+            to_write.append((key, row, action))
+
+        if not to_write or self.dry_run:
+            if kind in self._ids:
+                for key, row, action in to_write:
+                    self._ids[kind].setdefault(key, None)
+            return
+
+        upsert(entity.model, [row for _, row, _ in to_write], entity.db_keys,
+               batch_size=self.batch_size, session=self.session)
+        self.session.commit()
+
+        if kind in self._ids:
+            inserted = [key for key, _, action in to_write if action == 'insert']
+            self._ids[kind].update(self._lookup_ids(kind, inserted))
+
+    def _to_row(self, entity, parsed):
+        row = {name: value for name, value in parsed.items() if name not in entity.parent_keys}
+        if entity.parent:
+            parent_key = tuple(parsed[k] for k in entity.parent_keys)
+            row[entity.parent_column] = self._ids[entity.parent][parent_key]
+        if entity.kind == 'assessment' and 'chapter_order' in row:
+            row['chapter_id'] = self._ids['chapter'][(parsed['subject_code'], row.pop('chapter_order'))]
+        return row
+
+    @staticmethod
+    def _has_parent(entity, row):
+        # A parent that only exists in this dry run has no id yet, so nothing
+        # underneath it can exist either
+        return not entity.parent_column or row[entity.parent_column] is not None
+
+    def _existing_rows(self, entity, rows):
+        if not rows:
+            return {}
+        table = entity.model.__table__
+        key_columns = [table.c[c] for c in entity.db_keys]
+        keys = {tuple(row[c] for c in entity.db_keys) for row in rows}
+        if len(key_columns) == 1:
+            condition = key_columns[0].in_([k[0] for k in keys])
+        else:
+            condition = tuple_(*key_columns).in_(list(keys))
+        result = self.session.execute(select(table).where(condition)).mappings()
+        return {tuple(row[c] for c in entity.db_keys): row for row in result}
+
+    def _resolve(self, kind, keys):
+        missing = [key for key in keys if key not in self._ids[kind]]
+        self._ids[kind].update(self._lookup_ids(kind, missing))
+        for key in missing:
+            if key not in self._ids[kind]:
+                raise ContentImportError(f'unknown {kind} {"/".join(map(str, key))}')
+
+    def _lookup_ids(self, kind, keys):
+        """Map natural keys of parent rows to their primary keys"""
+        keys = list(keys)
+        found = {}
+        for start in range(0, len(keys), self.batch_size):
+            chunk = keys[start:start + self.batch_size]
+            if kind == 'subject':
+                query = select(Subject.id, Subject.code).where(Subject.code.in_([k[0] for k in chunk]))
+            elif kind == 'chapter':
+                query = (select(Chapter.id, Subject.code, Chapter.order)
+                         .join(Subject, Chapter.subject_id == Subject.id)
+                         .where(tuple_(Subject.code, Chapter.order).in_(chunk)))
+            else:
+                query = (select(Assessment.id, Subject.code, Assessment.title)
+                         .join(Subject, Assessment.subject_id == Subject.id)
+                         .where(tuple_(Subject.code, Assessment.title).in_(chunk)))
+            for row in self.session.execute(query):
+                found[tuple(row[1:])] = row[0]
+        return found
@@ -0,0 +1,37 @@
+from sqlalchemy import func, or_
+
+from app.models import Subject, Chapter, Assessment, Question
+from app.models.types import json_array_has_key
+
+
+def find_subject(slug):
+    """Find the active subject addressed by a URL slug such as ``bahasa-melayu``"""
+    slug = slug.lower()
+    return Subject.query.filter(
+        Subject.is_active.is_(True),
+        or_(func.lower(Subject.code) == slug,
+            func.lower(func.replace(Subject.name, ' ', '-')) == slug)
+    ).first()
+
+
+def find_assessment(subject_slug, chapter_order, question_types):
+    """First active assessment of one of ``question_types`` for a subject chapter"""
+    subject = find_subject(subject_slug)
+    if subject is None:
+        return None
+    return (Assessment.query
+            .join(Chapter, Assessment.chapter_id == Chapter.id)
+            .filter(Assessment.subject_id == subject.id,
+                    Chapter.order == chapter_order,
+                    Assessment.is_active.is_(True),
+                    Assessment.question_type.in_(question_types))
+            .order_by(Assessment.id)
+            .first())
+
+
+def questions_with_option(key, assessment_id=None):
+    """Questions with an option object carrying ``key``, such as ``image``, filtered in SQL"""
+    query = Question.query.filter(json_array_has_key(Question.options, key))
+    if assessment_id is not None:
+        query = query.filter(Question.assessment_id == assessment_id)
+    return query.order_by(Question.assessment_id, Question.order, Question.id)
@@ -0,0 +1,135 @@
+"""Per-user live events over Redis pub/sub.
+
+Anything that wants to tell a signed-in student something (a notification,
+graded answers, saved progress) calls ``publish``. The event is rendered to
+an HTML fragment once, kept in a short Redis list so a freshly opened page
+can show recent ones, and published on the user's channel. ``/api/events``
+relays the channel to the browser as server-sent events, which the HTMX
+SSE extension swaps straight into the page, so no page has to poll.
+Streams are served by gevent workers (see ``Dockerfile.web``), where an
+idle stream is a parked greenlet rather than a blocked worker.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+
+import redis
+from flask import current_app, render_template
+
+from app.extensions import get_redis
+
+CHANNEL_PREFIX = 'cikgu:events:'
+RECENT_PREFIX = 'cikgu:notifications:'
+RECENT_LIMIT = 20
+RECENT_TTL = 7 * 24 * 3600
+HEARTBEAT_SECONDS = 15
+QUEUE_SIZE = 100
+
+log = logging.getLogger(__name__)
+
+EVENT_TYPES = ('notification', 'grading', 'progress')
+
+
+def channel(user_id):
+    return f'{CHANNEL_PREFIX}{user_id}'
+
+
+def publish(user_id, event, message, url=None, connection=None):
+    """Push an event to every open page of the user. Never raises for Redis errors."""
+    if event not in EVENT_TYPES:
+        raise ValueError(f'Unknown event type {event!r}')
+    html = render_template('notification_item.html', event=event, message=message, url=url)
+    payload = json.dumps({'event': event, 'html': html})
+    try:
+        connection = connection or get_redis()
+        with connection.pipeline(transaction=False) as pipe:
+            pipe.lpush(RECENT_PREFIX + str(user_id), html)
+            pipe.ltrim(RECENT_PREFIX + str(user_id), 0, RECENT_LIMIT - 1)
+            pipe.expire(RECENT_PREFIX + str(user_id), RECENT_TTL)
+            pipe.publish(channel(user_id), payload)
+            pipe.execute()
+    except redis.RedisError as e:
+        current_app.logger.warning('Could not publish %s event for user %s: %s', event, user_id, e)
+
+
+def recent(user_id, connection=None):
+    """HTML fragments of the user's latest events, newest first"""
+    connection = connection or get_redis()
+    return [item.decode() for item in connection.lrange(RECENT_PREFIX + str(user_id), 0, RECENT_LIMIT - 1)]
+
+
+class EventBroker:
+    """One pattern subscription per process, fanned out to local queues
+
+    Every open ``/api/events`` stream registers a queue here instead of
+    holding its own Redis connection, so a worker serving thousands of idle
+    streams keeps a single subscriber connection. Under gevent the listener
+    thread and the queues are cooperative.
+    """
+
+    def __init__(self):
+        self._queues = defaultdict(set)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, user_id, connection):
+        events = queue.Queue(maxsize=QUEUE_SIZE)
+        with self._lock:
+            self._queues[str(user_id)].add(events)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._listen, args=(connection,), daemon=True)
+                self._thread.start()
+        return events
+
+    def unsubscribe(self, user_id, events):
+        with self._lock:
+            listeners = self._queues.get(str(user_id))
+            if listeners is not None:
+                listeners.discard(events)
+                if not listeners:
+                    del self._queues[str(user_id)]
+
+    def _listen(self, connection):
+        while True:
+            try:
+                pubsub = connection.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(CHANNEL_PREFIX + '*')
+                for message in pubsub.listen():
+                    user_id = message['channel'].decode()[len(CHANNEL_PREFIX):]
+                    with self._lock:
+                        listeners = list(self._queues.get(user_id, ()))
+                    for events in listeners:
+                        try:
+                            events.put_nowait(message['data'])
+                        except queue.Full:
+                            pass  # a stalled client loses events rather than memory
+            except redis.RedisError as e:
+                log.warning('Event subscriber lost Redis, reconnecting: %s', e)
+                time.sleep(1)
+
+
+broker = EventBroker()
+
+
+def stream(user_id, connection=None):
+    """Yield the user's events in ``text/event-stream`` format until the client goes away
+
+    A comment line is sent every ``HEARTBEAT_SECONDS`` so proxies keep the
+    connection open and a closed socket is noticed.
+    """
+    events = broker.subscribe(user_id, connection or get_redis())
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            try:
+                event = json.loads(events.get(timeout=HEARTBEAT_SECONDS))
+            except queue.Empty:
+                yield ': keep-alive\n\n'
+                continue
+            data = '\n'.join(f'data: {line}' for line in event['html'].splitlines() or [''])
+            yield f'event: {event["event"]}\n{data}\n\n'
+    finally:
+        broker.unsubscribe(user_id, events)
@@ -0,0 +1,261 @@
+"""Batched deletion of a student's data and of whole subjects.
+
+Every foreign key cascades on delete (migration ``010_cascade_deletes``) and
+the relationships use ``passive_deletes``, so deleting a ``User`` or a
+``Subject`` row removes everything under it without loading it into the
+session. For an active student or a whole subject that single statement
+still removes hundreds of thousands of answers in one transaction, holding
+their locks until it commits and reaching the replicas as one large
+event. ``purge_user`` (PDPA deletion requests) and ``purge_subject``
+(course removal) delete the children first instead, leaves before
+parents, ``batch_size`` rows per committed transaction. Only then is the
+parent deleted, when the cascade has nothing left to do. A purge that
+stops half way can simply be run again.
+
+The archive tables have no foreign keys, so they are purged explicitly.
+So are the student's uploaded files and their keys in Redis.
+
+``benchmark`` compares the three ways of deleting a student with many
+answers on a scratch database (``flask purge benchmark``).
+"""
+import os
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import redis
+import sqlalchemy as sa
+from flask import current_app
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from app.extensions import db, enable_sqlite_foreign_keys, get_redis
+from app.models import (Answer, AnswerArchive, Assessment, AssessmentAttempt, AssessmentAttemptArchive, Chapter,
+                        Progress, PushSubscription, Question, QuestionType, ReviewItem, Section, StudyRollupDaily,
+                        StudyRollupWeekly, StudySession, Subject, SubjectiveDraft, SyncReceipt, Upload, User)
+from app.services.activity import activity_key
+from app.services.adaptive import TEST_PREFIX
+from app.services.attempts import ATTEMPT_PREFIX, DEADLINES_KEY, RESULT_PREFIX
+from app.services.events import RECENT_PREFIX
+from app.services.reviews import QUEUE_SIZES_KEY
+from app.services.storage import get_storage
+
+PURGE_BATCH_SIZE = 1000
+
+# Deleted in this order, each by the user_id column
+USER_TABLES = (ReviewItem, Progress, SubjectiveDraft, SyncReceipt, StudySession, StudyRollupDaily,
+               StudyRollupWeekly, PushSubscription)
+
+
+def _delete_in_batches(session, model, condition, batch_size):
+    deleted = 0
+    while True:
+        ids = session.scalars(select(model.id).where(condition).limit(batch_size)).all()
+        if not ids:
+            return deleted
+        session.execute(delete(model).where(model.id.in_(ids)))
+        session.commit()
+        deleted += len(ids)
+
+
+def _delete_uploads(session, user_id, batch_size):
+    deleted = 0
+    storage = None
+    while True:
+        rows = session.execute(select(Upload.id, Upload.filename).where(Upload.user_id == user_id)
+                               .limit(batch_size)).all()
+        if not rows:
+            return deleted
+        storage = storage or get_storage()
+        # Files first: a row without a file is harmless, a file without a row is never found again
+        for row in rows:
+            storage.delete(row.filename)
+        session.execute(delete(Upload).where(Upload.id.in_([row.id for row in rows])))
+        session.commit()
+        deleted += len(rows)
+
+
+def _forget_in_redis(user_id, connection=None):
+    try:
+        connection = connection or get_redis()
+        attempt_keys = list(connection.scan_iter(match=f'{ATTEMPT_PREFIX}{user_id}:*'))
+        result_keys = list(connection.scan_iter(match=f'{RESULT_PREFIX}{ATTEMPT_PREFIX}{user_id}:*'))
+        test_keys = list(connection.scan_iter(match=f'{TEST_PREFIX}{user_id}:*'))
+        with connection.pipeline(transaction=False) as pipe:
+            pipe.delete(activity_key(user_id), RECENT_PREFIX + str(user_id), *attempt_keys, *result_keys, *test_keys)
+            if attempt_keys:
+                pipe.zrem(DEADLINES_KEY, *attempt_keys)
+            pipe.hdel(QUEUE_SIZES_KEY, user_id)
+            pipe.execute()
+    except redis.RedisError as e:
+        current_app.logger.warning('Could not remove Redis data of purged user %s: %s', user_id, e)
+
+
+def purge_user(user_id, batch_size=PURGE_BATCH_SIZE, session=None, connection=None):
+    """Delete a user and everything stored about them. Returns rows deleted per table."""
+    session = session or db.session
+    counts = {'upload': _delete_uploads(session, user_id, batch_size)}
+
+    attempts = select(AssessmentAttempt.id).where(AssessmentAttempt.user_id == user_id)
+    counts['answer'] = _delete_in_batches(session, Answer, Answer.attempt_id.in_(attempts), batch_size)
+    counts['assessment_attempt'] = _delete_in_batches(session, AssessmentAttempt,
+                                                      AssessmentAttempt.user_id == user_id, batch_size)
+    for model in USER_TABLES:
+        counts[model.__tablename__] = _delete_in_batches(session, model, model.user_id == user_id, batch_size)
+
+    archived = select(AssessmentAttemptArchive.id).where(AssessmentAttemptArchive.user_id == user_id)
+    counts['answer_archive'] = _delete_in_batches(session, AnswerArchive, AnswerArchive.attempt_id.in_(archived),
+                                                  batch_size)
+    counts['assessment_attempt_archive'] = _delete_in_batches(
+        session, AssessmentAttemptArchive, AssessmentAttemptArchive.user_id == user_id, batch_size)
+
+    counts['user'] = session.execute(delete(User).where(User.id == user_id)).rowcount
+    session.commit()
+    if session is db.session:
+        _forget_in_redis(user_id, connection)
+    current_app.logger.info('Purged user %s: %s', user_id, counts)
+    return counts
+
+
+def purge_subject(subject_id, batch_size=PURGE_BATCH_SIZE, session=None):
+    """Delete a subject with its chapters, assessments and every attempt at them. Returns rows deleted per table."""
+    session = session or db.session
+    assessments = select(Assessment.id).where(Assessment.subject_id == subject_id)
+    questions = select(Question.id).where(Question.assessment_id.in_(assessments))
+    archived = select(AssessmentAttemptArchive.id).where(AssessmentAttemptArchive.assessment_id.in_(assessments))
+    chapters = select(Chapter.id).where(Chapter.subject_id == subject_id)
+
+    counts = {}
+    for model, condition in (
+        (Answer, Answer.question_id.in_(questions)),
+        (ReviewItem, ReviewItem.question_id.in_(questions)),
+        (AssessmentAttempt, AssessmentAttempt.assessment_id.in_(assessments)),
+        (AnswerArchive, AnswerArchive.attempt_id.in_(archived)),
+        (AssessmentAttemptArchive, AssessmentAttemptArchive.assessment_id.in_(assessments)),
+        (Question, Question.assessment_id.in_(assessments)),
+        (Assessment, Assessment.subject_id == subject_id),
+        (Section, Section.chapter_id.in_(chapters)),
+        (Chapter, Chapter.subject_id == subject_id),
+    ):
+        counts[model.__tablename__] = _delete_in_batches(session, model, condition, batch_size)
+
+    counts['subject'] = session.execute(delete(Subject).where(Subject.id == subject_id)).rowcount
+    session.commit()
+    current_app.logger.info('Purged subject %s: %s', subject_id, counts)
+    return counts
+
+
+def _seed(engine, answers, questions=50):
+    """A student with ``answers`` answers over attempts of ``questions`` questions each. Returns the user id."""
+    now = datetime.utcnow()
+    stamp = f'{time.time_ns() % 10 ** 9:09d}'
+    with engine.begin() as conn:
+        user_id = conn.execute(sa.insert(User.__table__).values(
+            email=f'purge-benchmark-{stamp}@example.com', name='Purge Benchmark',
+            google_id=f'purge-benchmark-{stamp}', created_at=now)).inserted_primary_key[0]
+        subject_id = conn.execute(sa.insert(Subject.__table__).values(
+            name=f'Purge Benchmark {stamp}', code=f'B{stamp}', created_at=now)).inserted_primary_key[0]
+        assessment_id = conn.execute(sa.insert(Assessment.__table__).values(
+            subject_id=subject_id, title='Benchmark', question_type=QuestionType.MULTIPLE_CHOICE,
+            time_limit=30, total_marks=questions, is_active=True, created_at=now)).inserted_primary_key[0]
+        question_ids = [conn.execute(sa.insert(Question.__table__).values(
+            assessment_id=assessment_id, question_text=f'Q{n}', correct_answer='A', marks=1, order=n,
+            created_at=now)).inserted_primary_key[0] for n in range(1, questions + 1)]
+        conn.execute(sa.insert(ReviewItem.__table__), [
+            {'user_id': user_id, 'question_id': question_id, 'due_at': now} for question_id in question_ids])
+
+        for _ in range(-(-answers // questions)):
+            attempt_id = conn.execute(sa.insert(AssessmentAttempt.__table__).values(
+                user_id=user_id, assessment_id=assessment_id, total_marks=questions, status='completed',
+                started_at=now, created_at=now)).inserted_primary_key[0]
+            conn.execute(sa.insert(Answer.__table__), [
+                {'attempt_id': attempt_id, 'question_id': question_id, 'answer_text': 'A', 'is_correct': True,
+                 'marks_obtained': 1, 'created_at': now} for question_id in question_ids])
+    return user_id
+
+
+def _orm_delete(session, user_id, batch_size):
+    # What the relationship cascades did before passive_deletes: load every
+    # child into the session, then delete each by primary key, in one transaction
+    user = session.get(User, user_id)
+    attempts = list(user.assessment_attempts)
+    levels = [
+        [answer for attempt in attempts for answer in attempt.answers],
+        attempts + user.progress + user.uploads + user.study_sessions + user.push_subscriptions,
+    ]
+    for rows in levels:
+        by_table = defaultdict(list)
+        for row in rows:
+            by_table[row.__table__].append({'row_id': row.id})
+        for table, params in by_table.items():
+            session.execute(delete(table).where(table.c.id == sa.bindparam('row_id')), params)
+    session.execute(delete(User.__table__).where(User.__table__.c.id == user_id))
+    session.commit()
+
+
+def _cascade_delete(session, user_id, batch_size):
+    session.execute(delete(User).where(User.id == user_id))
+    session.commit()
+
+
+def _batched_delete(session, user_id, batch_size):
+    purge_user(user_id, batch_size, session=session)
+
+
+def _index_foreign_keys(engine):
+    # InnoDB indexes every foreign key column and SQLite does not, which
+    # would make each cascaded delete scan the child table
+    if engine.dialect.name != 'sqlite':
+        return
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for key in table.foreign_keys:
+                column = key.parent.name
+                conn.execute(sa.text(f'CREATE INDEX IF NOT EXISTS ix_fk_{table.name}_{column} '
+                                     f'ON "{table.name}" ({column})'))
+
+
+BENCHMARK_METHODS = {'orm': _orm_delete, 'cascade': _cascade_delete, 'batched': _batched_delete}
+
+
+def benchmark(answers=100_000, batch_size=PURGE_BATCH_SIZE, database_url=None):
+    """Seconds to delete a student with ``answers`` answers, per method
+
+    Returns ``{method: {'seconds': ..., 'longest_transaction': ...}}``.
+    ``orm`` loads every row and deletes them one by one, as the relationship
+    cascades used to; ``cascade`` deletes the user row and lets the foreign
+    keys do the rest in one transaction; ``batched`` is ``purge_user``. Runs
+    on ``database_url``, which must not hold real data, or a temporary SQLite
+    file.
+    """
+    path = None
+    if database_url is None:
+        handle, path = tempfile.mkstemp(suffix='.db', prefix='purge-benchmark-')
+        os.close(handle)
+        database_url = f'sqlite:///{path}'
+    engine = sa.create_engine(database_url)
+    enable_sqlite_foreign_keys(engine)
+
+    transactions = []
+    sa.event.listen(engine, 'begin', lambda conn: transactions.append([time.perf_counter(), None]))
+    sa.event.listen(engine, 'commit', lambda conn: transactions[-1].__setitem__(1, time.perf_counter()))
+
+    results = {}
+    try:
+        db.metadata.create_all(engine)
+        _index_foreign_keys(engine)
+        for method, run in BENCHMARK_METHODS.items():
+            user_id = _seed(engine, answers)
+            transactions.clear()
+            with Session(engine) as session:
+                start = time.perf_counter()
+                run(session, user_id, batch_size)
+                seconds = time.perf_counter() - start
+            longest = max((end - begin for begin, end in transactions if end is not None), default=0)
+            results[method] = {'seconds': seconds, 'longest_transaction': longest}
+    finally:
+        engine.dispose()
+        if path is not None:
+            os.remove(path)
+    return results
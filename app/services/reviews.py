@@ -0,0 +1,192 @@
+"""Spaced-repetition review queue (SM-2).
+
+Every question a student answers gets a ``ReviewItem`` holding its SM-2
+state. After an attempt the affected items are read with one SELECT,
+rescheduled in Python and written back with one multi-row upsert. The "due
+now" list is a range read on the ``(user_id, due_at)`` index, paged by
+``(due_at, id)`` keyset so deep pages cost the same as the first one.
+
+Push reminders need each active user's queue size. The nightly job counts
+only the due rows of active users, again through the index, and stores the
+counts in a Redis hash rather than scanning every item.
+"""
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, select, tuple_
+
+from app.extensions import db, get_redis
+from app.models import Answer, AssessmentAttempt, Question, ReviewItem, User
+from app.services.bulk import upsert
+from app.services.study_rollups import local_day
+
+MIN_EASE = 1.3
+DEFAULT_EASE = 2.5
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+QUEUE_SIZES_KEY = 'cikgu:review-queue-sizes'
+ACTIVE_DAYS = 30
+QUEUE_SIZE_HOUR = 2  # local time of the nightly run
+
+
+def answer_quality(marks_obtained, marks, is_correct=None):
+    """SM-2 response quality from 0 (blackout) to 5 (perfect)"""
+    if marks:
+        return max(0, min(5, round(5 * (marks_obtained or 0) / marks)))
+    return 5 if is_correct else 1
+
+
+def next_review(ease, interval, repetitions, quality):
+    """Apply one SM-2 step. Returns ``(ease, interval_days, repetitions)``."""
+    ease = max(MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    if quality < 3:
+        # Forgotten: start over tomorrow but keep the lowered ease
+        return ease, 1, 0
+    if repetitions == 0:
+        interval = 1
+    elif repetitions == 1:
+        interval = 6
+    else:
+        interval = round(interval * ease)
+    return ease, interval, repetitions + 1
+
+
+def record_reviews(outcomes, now=None):
+    """Reschedule review items from ``(user_id, question_id, quality)`` outcomes
+
+    A question answered twice in the same batch keeps only its last outcome.
+    The caller commits. Returns the number of items written.
+    """
+    now = now or datetime.utcnow()
+    latest = {(user_id, question_id): quality for user_id, question_id, quality in outcomes}
+    if not latest:
+        return 0
+
+    current = {}
+    keys = list(latest)
+    for start in range(0, len(keys), 500):
+        chunk = keys[start:start + 500]
+        rows = db.session.execute(
+            select(ReviewItem.user_id, ReviewItem.question_id, ReviewItem.ease,
+                   ReviewItem.interval, ReviewItem.repetitions)
+            .where(tuple_(ReviewItem.user_id, ReviewItem.question_id).in_(chunk))
+        ).all()
+        current.update({(r.user_id, r.question_id): (r.ease, r.interval, r.repetitions) for r in rows})
+
+    rows = []
+    for (user_id, question_id), quality in latest.items():
+        ease, interval, repetitions = current.get((user_id, question_id), (DEFAULT_EASE, 0, 0))
+        ease, interval, repetitions = next_review(ease, interval, repetitions, quality)
+        rows.append({
+            'user_id': user_id,
+            'question_id': question_id,
+            'due_at': now + timedelta(days=interval),
+            'ease': ease,
+            'interval': interval,
+            'repetitions': repetitions,
+            'last_reviewed_at': now,
+        })
+    return upsert(ReviewItem, rows, ['user_id', 'question_id'])
+
+
+def record_attempts(attempt_ids, now=None):
+    """Reschedule every question answered in the given marked attempts"""
+    rows = db.session.execute(
+        select(AssessmentAttempt.user_id, Answer.question_id, Answer.marks_obtained,
+               Answer.is_correct, Question.marks)
+        .join(Answer, Answer.attempt_id == AssessmentAttempt.id)
+        .join(Question, Answer.question_id == Question.id)
+        .where(AssessmentAttempt.id.in_(list(attempt_ids)))
+        .order_by(AssessmentAttempt.id, Answer.id)
+    ).all()
+    return record_reviews(
+        [(r.user_id, r.question_id, answer_quality(r.marks_obtained, r.marks, r.is_correct)) for r in rows],
+        now=now)
+
+
+def due_reviews(user_id, limit=PAGE_SIZE, after=None, now=None):
+    """One page of the user's due items, oldest first
+
+    ``after`` is the ``(due_at, id)`` of the last item of the previous page.
+    """
+    now = now or datetime.utcnow()
+    query = (select(ReviewItem, Question)
+             .join(Question, ReviewItem.question_id == Question.id)
+             .where(ReviewItem.user_id == user_id, ReviewItem.due_at <= now))
+    if after is not None:
+        query = query.where(tuple_(ReviewItem.due_at, ReviewItem.id) > tuple_(*after))
+    query = query.order_by(ReviewItem.due_at, ReviewItem.id).limit(min(limit, MAX_PAGE_SIZE))
+    return db.session.execute(query).all()
+
+
+def due_count(user_id, now=None):
+    now = now or datetime.utcnow()
+    return db.session.execute(
+        select(func.count()).select_from(ReviewItem)
+        .where(ReviewItem.user_id == user_id, ReviewItem.due_at <= now)
+    ).scalar()
+
+
+def precompute_queue_sizes(batch_size=1000, connection=None, now=None):
+    """Count the day's due items for every active user into a Redis hash
+
+    Items due before the end of the current local day are counted, so a
+    morning reminder matches what the student sees. Users are walked by id in
+    batches; each batch is one grouped count served by the
+    ``(user_id, due_at)`` index. Returns the number of users with a queue.
+    """
+    connection = connection or get_redis()
+    now = now or datetime.utcnow()
+    offset_hours = current_app.config.get('STUDY_TIMEZONE_OFFSET', 8)
+    tomorrow = local_day(now, offset_hours) + timedelta(days=1)
+    cutoff = datetime.combine(tomorrow, datetime.min.time()) - timedelta(hours=offset_hours)
+    active_since = now - timedelta(days=ACTIVE_DAYS)
+
+    staging = f'{QUEUE_SIZES_KEY}:building'
+    connection.delete(staging)
+    users = 0
+    last_id = 0
+    while True:
+        user_ids = db.session.execute(
+            select(User.id)
+            .where(User.id > last_id, User.is_active.is_(True), User.last_login >= active_since)
+            .order_by(User.id)
+            .limit(batch_size)
+        ).scalars().all()
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+
+        counts = dict(db.session.execute(
+            select(ReviewItem.user_id, func.count())
+            .where(ReviewItem.user_id.in_(user_ids), ReviewItem.due_at < cutoff)
+            .group_by(ReviewItem.user_id)
+        ).all())
+        if counts:
+            connection.hset(staging, mapping=counts)
+            users += len(counts)
+
+    # Readers never see a half-built hash
+    if users:
+        connection.rename(staging, QUEUE_SIZES_KEY)
+    else:
+        connection.delete(QUEUE_SIZES_KEY)
+    return users
+
+
+def queue_size(user_id, connection=None):
+    """Queue size from the last nightly run, or None if it is unknown"""
+    value = (connection or get_redis()).hget(QUEUE_SIZES_KEY, user_id)
+    return int(value) if value is not None else None
+
+
+def next_queue_size_run(now=None):
+    """UTC time of the next nightly run"""
+    now = now or datetime.utcnow()
+    offset_hours = current_app.config.get('STUDY_TIMEZONE_OFFSET', 8)
+    run = datetime.combine(local_day(now, offset_hours), datetime.min.time()) \
+        + timedelta(hours=QUEUE_SIZE_HOUR - offset_hours)
+    while run <= now:
+        run += timedelta(days=1)
+    return run
@@ -0,0 +1,266 @@
+"""Where uploaded files live, and how they are handed to the client.
+
+Views talk to a ``Storage`` (``get_storage()``) instead of the filesystem.
+``LocalStorage`` keeps files under a directory; a remote backend, such as an
+S3-compatible bucket, implements the same methods and returns a signed
+``url()`` so downloads go straight to the bucket. ``SignedLocalStorage``
+stands in for such a backend on one host: its ``url()`` is a signed,
+expiring link to ``main.signed_download``, which serves the file from the
+local directory. ``STORAGE_BACKEND`` picks one from ``BACKENDS``.
+
+``send_stored`` answers a download without the file passing through Python:
+
+* ``DOWNLOAD_ACCEL = 'x-accel'``: nginx serves the file from an internal
+  location (``location /_protected/uploads/ { internal; alias /app/uploads/; }``)
+  named by ``X-Accel-Redirect``, and handles ranges itself.
+* ``DOWNLOAD_ACCEL = 'x-sendfile'``: Apache's mod_xsendfile does the same
+  with ``X-Sendfile``.
+* Otherwise the open file is returned as ``wsgi.file_wrapper``, which
+  gunicorn sends with ``os.sendfile`` from the current offset. A byte range
+  is served by seeking to its start and wrapping the file in a ``_RangeFile``
+  that stops reading at the end of the range but keeps ``fileno()``, so
+  gunicorn still uses ``sendfile`` and servers that iterate the wrapper
+  instead send only the range too. Werkzeug's own range support wraps the
+  file in a Python iterator, so it is not used.
+
+``If-None-Match`` and ``If-Modified-Since`` are answered with 304 before any
+file is opened, and ``If-Range`` falls back to the whole file when it has
+changed.
+"""
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from flask import Response, current_app, redirect, request, url_for
+from itsdangerous import BadSignature, URLSafeSerializer
+from werkzeug.exceptions import NotFound
+from werkzeug.wsgi import wrap_file
+
+COPY_BUFFER = 1024 * 1024
+
+
+@dataclass
+class StoredFile:
+    key: str
+    size: int
+    modified: datetime
+    etag: str
+
+
+class Storage:
+    """Interface every storage backend implements"""
+
+    def save(self, key, stream):
+        """Store the binary ``stream`` under ``key``. Returns the size in bytes."""
+        raise NotImplementedError
+
+    def stat(self, key):
+        """``StoredFile`` for ``key``; raises ``FileNotFoundError`` if there is none"""
+        raise NotImplementedError
+
+    def open(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def local_path(self, key):
+        """Filesystem path of the file, or None if it is not on this host"""
+        return None
+
+    def url(self, key, filename, expires=300):
+        """A short-lived URL the client can download from directly, or None"""
+        return None
+
+
+class LocalStorage(Storage):
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root, key))
+        if path == self.root or os.path.commonpath([path, self.root]) != self.root:
+            raise FileNotFoundError(key)
+        return path
+
+    def save(self, key, stream):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write under a temporary name so a reader never sees half a file
+        partial = f'{path}.partial'
+        with open(partial, 'wb') as f:
+            shutil.copyfileobj(stream, f, COPY_BUFFER)
+        os.replace(partial, path)
+        return os.path.getsize(path)
+
+    def stat(self, key):
+        info = os.stat(self._path(key))
+        return StoredFile(key=key, size=info.st_size,
+                          modified=datetime.fromtimestamp(int(info.st_mtime), timezone.utc),
+                          etag=f'{info.st_size:x}-{info.st_mtime_ns:x}')
+
+    def open(self, key):
+        return open(self._path(key), 'rb')
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key):
+        return self._path(key)
+
+
+class SignedLocalStorage(LocalStorage):
+    """``LocalStorage`` that redirects downloads to signed URLs, like a bucket"""
+
+    salt = 'stored-file'
+
+    def _serializer(self):
+        return URLSafeSerializer(current_app.secret_key, salt=self.salt)
+
+    def url(self, key, filename, expires=300):
+        token = self._serializer().dumps({'key': key, 'filename': filename, 'expires': int(time.time()) + expires})
+        return url_for('main.signed_download', token=token)
+
+    def verify(self, token):
+        """``(key, filename)`` signed into ``token``, or None if it is forged or expired"""
+        try:
+            signed = self._serializer().loads(token)
+        except BadSignature:
+            return None
+        if signed['expires'] < time.time():
+            return None
+        return signed['key'], signed['filename']
+
+
+BACKENDS = {
+    'local': lambda config: LocalStorage(config['STORAGE_LOCAL_ROOT']),
+    'local-signed': lambda config: SignedLocalStorage(config['STORAGE_LOCAL_ROOT']),
+}
+
+
+def get_storage():
+    """The configured storage backend, created once per app"""
+    app = current_app._get_current_object()
+    storage = app.extensions.get('storage')
+    if storage is None:
+        backend = app.config.get('STORAGE_BACKEND', 'local')
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown storage backend {backend!r}')
+        storage = app.extensions['storage'] = BACKENDS[backend](app.config)
+    return storage
+
+
+def _not_modified(stored):
+    if request.if_none_match:
+        return request.if_none_match.contains(stored.etag)
+    return request.if_modified_since is not None and stored.modified <= request.if_modified_since
+
+
+def _byte_range(stored):
+    """``(start, stop)`` to serve, None for the whole file, or False if unsatisfiable"""
+    requested = request.range
+    if requested is None or requested.units != 'bytes' or len(requested.ranges) != 1:
+        return None
+    if_range = request.if_range
+    if if_range.etag is not None and if_range.etag != stored.etag:
+        return None
+    if if_range.date is not None and stored.modified > if_range.date:
+        return None
+    return requested.range_for_length(stored.size) or False
+
+
+def _read_range(f, length):
+    with f:
+        while length > 0:
+            chunk = f.read(min(COPY_BUFFER, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+class _RangeFile:
+    """The ``length`` bytes of ``f`` from its current offset"""
+
+    def __init__(self, f, length):
+        self._f = f
+        self._end = f.tell() + length
+
+    def read(self, size=-1):
+        left = max(self._end - self._f.tell(), 0)
+        return self._f.read(left if size is None or size < 0 else min(size, left))
+
+    def fileno(self):
+        return self._f.fileno()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._f.seek(offset, whence)
+
+    def tell(self):
+        return self._f.tell()
+
+    def close(self):
+        self._f.close()
+
+
+def send_stored(key, filename, mimetype=None, storage=None, use_url=True):
+    """Response that delivers a stored file as an attachment named ``filename``
+
+    With ``use_url`` False the file is served here even if the backend has a
+    ``url()``, which is how the signed URL itself is answered.
+    """
+    storage = storage or get_storage()
+    try:
+        stored = storage.stat(key)
+    except FileNotFoundError:
+        raise NotFound()
+
+    url = storage.url(key, filename) if use_url else None
+    if url is not None:
+        return redirect(url)
+
+    response = Response(mimetype=mimetype or 'application/octet-stream')
+    response.set_etag(stored.etag)
+    response.last_modified = stored.modified
+    response.headers['Accept-Ranges'] = 'bytes'
+    # Only the owner may download, so shared caches must not keep a copy
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.headers.set('Content-Disposition', 'attachment', filename=filename)
+
+    if _not_modified(stored):
+        response.status_code = 304
+        return response
+
+    accel = current_app.config.get('DOWNLOAD_ACCEL')
+    if accel == 'x-accel':
+        response.headers['X-Accel-Redirect'] = current_app.config['DOWNLOAD_ACCEL_PREFIX'] + key
+        return response
+    if accel == 'x-sendfile' and storage.local_path(key):
+        response.headers['X-Sendfile'] = storage.local_path(key)
+        return response
+
+    byte_range = _byte_range(stored)
+    if byte_range is False:
+        response.status_code = 416
+        response.headers['Content-Range'] = f'bytes */{stored.size}'
+        return response
+    start, stop = byte_range or (0, stored.size)
+
+    f = storage.open(key)
+    f.seek(start)
+    if 'wsgi.file_wrapper' in request.environ:
+        response.response = wrap_file(request.environ, _RangeFile(f, stop - start) if byte_range else f)
+    else:
+        response.response = _read_range(f, stop - start)
+    response.direct_passthrough = True
+    response.content_length = stop - start
+    if byte_range:
+        response.status_code = 206
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{stored.size}'
+    return response
@@ -0,0 +1,189 @@
+"""Daily and weekly study-time rollups.
+
+``StudySession`` is an append-only log. A worker job folds every session
+with an id above the ``study_sessions`` watermark into per (user, subject,
+bucket) counters and advances the watermark in the same transaction, so each
+session is counted exactly once. Charts then read one row per bucket instead
+of aggregating a user's whole history on every page view.
+
+Ids are handed out at insert time, not at commit, so a session can become
+visible after a higher id has already been folded in. Sessions therefore
+settle for ``SETTLE_SECONDS`` after they were inserted. A refresh stops at
+the first unsettled session, and the worker job books another run for
+when it will have settled. This assumes no transaction that inserts study
+sessions stays open longer than that.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import redis
+from flask import current_app
+from sqlalchemy import delete, event, func, select
+from sqlalchemy.orm import object_session
+
+from app.db_routing import RoutingSession
+from app.extensions import db
+from app.models import StudySession, StudyRollupDaily, StudyRollupWeekly, RollupWatermark
+from app.services.bulk import upsert
+from app.tasks.queues import enqueue
+
+WATERMARK = 'study_sessions'
+SETTLE_SECONDS = 60
+
+
+def local_day(moment, offset_hours):
+    """Calendar day of a naive UTC datetime in the school's timezone"""
+    return (moment + timedelta(hours=offset_hours)).date()
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def _watermark():
+    mark = db.session.execute(
+        select(RollupWatermark).where(RollupWatermark.name == WATERMARK).with_for_update()
+    ).scalar_one_or_none()
+    if mark is None:
+        mark = RollupWatermark(name=WATERMARK, last_id=0)
+        db.session.add(mark)
+        db.session.flush()
+    return mark
+
+
+def refresh_rollups(batch_size=5000, now=None):
+    """Fold settled sessions newer than the watermark into the rollups. Returns the number processed."""
+    offset = current_app.config.get('STUDY_TIMEZONE_OFFSET', 8)
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=SETTLE_SECONDS)
+    processed = 0
+
+    while True:
+        # Locking the watermark row keeps two refreshes from double counting
+        mark = _watermark()
+        fetched = db.session.execute(
+            select(StudySession.id, StudySession.user_id, StudySession.subject,
+                   StudySession.duration, StudySession.session_date, StudySession.created_at)
+            .where(StudySession.id > mark.last_id)
+            .order_by(StudySession.id)
+            .limit(batch_size)
+        ).all()
+        # Stop at the first session still settling; a lower id may not be committed yet
+        sessions = []
+        for session in fetched:
+            if session.created_at is not None and session.created_at >= cutoff:
+                break
+            sessions.append(session)
+        if not sessions:
+            db.session.commit()
+            break
+
+        daily = defaultdict(lambda: [0, 0])
+        weekly = defaultdict(lambda: [0, 0])
+        for session in sessions:
+            if session.session_date is None:
+                continue
+            day = local_day(session.session_date, offset)
+            for totals, bucket in ((daily, day), (weekly, week_start(day))):
+                counters = totals[(session.user_id, session.subject, bucket)]
+                counters[0] += session.duration or 0
+                counters[1] += 1
+
+        for model, totals in ((StudyRollupDaily, daily), (StudyRollupWeekly, weekly)):
+            rows = [{'user_id': user_id, 'subject': subject, 'bucket': bucket,
+                     'minutes': minutes, 'sessions': count}
+                    for (user_id, subject, bucket), (minutes, count) in totals.items()]
+            upsert(model, rows, ['user_id', 'subject', 'bucket'], increment_columns=['minutes', 'sessions'])
+
+        mark.last_id = sessions[-1].id
+        db.session.commit()
+        processed += len(sessions)
+
+        if len(fetched) < batch_size or len(sessions) < len(fetched):
+            break
+
+    return processed
+
+
+def sessions_waiting():
+    """Whether any session is past the watermark, such as one still settling"""
+    last_id = db.session.execute(
+        select(RollupWatermark.last_id).where(RollupWatermark.name == WATERMARK)
+    ).scalar() or 0
+    return db.session.execute(select(StudySession.id).where(StudySession.id > last_id).limit(1)).first() is not None
+
+
+def rebuild_rollups(batch_size=5000):
+    """Throw the rollups away and recompute them from the full session history"""
+    mark = _watermark()
+    db.session.execute(delete(StudyRollupDaily))
+    db.session.execute(delete(StudyRollupWeekly))
+    mark.last_id = 0
+    db.session.commit()
+    return refresh_rollups(batch_size)
+
+
+def total_minutes(user_id):
+    return db.session.query(func.sum(StudyRollupWeekly.minutes)).filter_by(user_id=user_id).scalar() or 0
+
+
+def weekly_minutes(user_id, weeks=12, today=None):
+    """Minutes per subject for each of the last ``weeks`` weeks, oldest first
+
+    Returns ``[(week_start, {subject: minutes}, total), ...]`` with empty weeks
+    included so charts keep a steady x axis.
+    """
+    if today is None:
+        today = local_day(datetime.utcnow(), current_app.config.get('STUDY_TIMEZONE_OFFSET', 8))
+    first = week_start(today) - timedelta(weeks=weeks - 1)
+
+    rows = (db.session.query(StudyRollupWeekly.bucket, StudyRollupWeekly.subject, StudyRollupWeekly.minutes)
+            .filter(StudyRollupWeekly.user_id == user_id, StudyRollupWeekly.bucket >= first)
+            .all())
+    by_week = defaultdict(dict)
+    for bucket, subject, minutes in rows:
+        by_week[bucket][subject] = minutes
+
+    chart = []
+    for i in range(weeks):
+        bucket = first + timedelta(weeks=i)
+        subjects = by_week.get(bucket, {})
+        chart.append((bucket, subjects, sum(subjects.values())))
+    return chart
+
+
+def daily_minutes(user_id, days=7, today=None):
+    """Total minutes for each of the last ``days`` days, oldest first"""
+    if today is None:
+        today = local_day(datetime.utcnow(), current_app.config.get('STUDY_TIMEZONE_OFFSET', 8))
+    first = today - timedelta(days=days - 1)
+
+    totals = dict(db.session.query(StudyRollupDaily.bucket, func.sum(StudyRollupDaily.minutes))
+                  .filter(StudyRollupDaily.user_id == user_id, StudyRollupDaily.bucket >= first)
+                  .group_by(StudyRollupDaily.bucket)
+                  .all())
+    return [(first + timedelta(days=i), totals.get(first + timedelta(days=i), 0) or 0) for i in range(days)]
+
+
+# Queue a refresh whenever a transaction adds study sessions. The job is
+# deduplicated, so a burst of commits still costs one refresh.
+
+@event.listens_for(StudySession, 'after_insert')
+def _note_new_session(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['study_sessions_added'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _queue_refresh(session):
+    if not session.info.pop('study_sessions_added', False):
+        return
+    try:
+        enqueue('analytics', 'app.tasks.rollups.refresh_study_rollups', dedup_key='study-rollups')
+    except redis.RedisError as e:
+        current_app.logger.warning('Could not queue study rollup refresh: %s', e)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_new_sessions(session):
+    session.info.pop('study_sessions_added', None)
@@ -0,0 +1,257 @@
+"""Suggested marks for subjective answers.
+
+Every pending answer of an assessment is scored in one pass. Answers, model
+answers (``Question.correct_answer``) and rubric keywords share a TF-IDF
+vocabulary, so the similarity of each answer to its own model answer and the
+rubric keywords it covers fall out of a few sparse matrix products instead of
+a Python loop over every answer/reference pair. Results are written back as
+suggestions (``Answer.auto_scored_at`` is set) in one bulk UPDATE per batch,
+for a teacher to review, and feed the student's review schedule. Answers to
+a question with neither a model answer nor rubric keywords are stamped
+without marks, so every pending answer leaves the queue.
+"""
+import json
+import re
+from datetime import datetime
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import Text, cast, func, or_, select, update
+
+from app.extensions import db
+from app.models import Answer, AssessmentAttempt, Question
+from app.services.reviews import answer_quality, record_reviews
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+STOPWORDS = frozenset('''
+    ada adalah akan atau bagi bahawa boleh dalam dan dari daripada dengan di
+    ia ialah ini itu juga kepada ke lagi maka oleh pada para sebagai serta
+    tersebut untuk yang a an and are as by for in is it of on or that the to
+'''.split())
+
+# Cosine similarity at which an answer is treated as matching the model
+# answer completely. Real answers rarely reuse the exact wording.
+FULL_SIMILARITY = 0.6
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall((text or '').lower()) if token not in STOPWORDS]
+
+
+def word_count(text):
+    # Same rule as the word counter in subjective_assessment.html
+    return len((text or '').split())
+
+
+def _term_matrix(documents, vocabulary):
+    """Sparse term-count matrix for tokenized documents, growing ``vocabulary``"""
+    rows, cols = [], []
+    for row, tokens in enumerate(documents):
+        for token in tokens:
+            rows.append(row)
+            cols.append(vocabulary.setdefault(token, len(vocabulary)))
+    data = np.ones(len(rows), dtype=np.float64)
+    return rows, cols, data
+
+
+def _to_csr(triplet, shape):
+    rows, cols, data = triplet
+    matrix = sparse.csr_matrix((data, (rows, cols)), shape=shape)
+    matrix.sum_duplicates()
+    return matrix
+
+
+def _l2_normalize(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1.0 / norms) @ matrix
+
+
+def _tfidf(counts, idf):
+    tf = counts.copy()
+    tf.data = 1.0 + np.log(tf.data)
+    return _l2_normalize(tf @ sparse.diags(idf))
+
+
+def _load_keywords(value):
+    if not value:
+        return []
+    keywords = json.loads(value) if isinstance(value, str) else value
+    return [str(k) for k in keywords if str(k).strip()]
+
+
+def scorable():
+    """SQL condition for the questions ``score_answers`` can mark: a model answer or rubric keywords"""
+    return or_(func.trim(func.coalesce(Question.correct_answer, '')) != '',
+               cast(Question.rubric_keywords, Text) != '[]')
+
+
+def score_answers(questions, answers):
+    """Compute suggested marks and feedback
+
+    ``questions`` maps question id to an object with ``marks``,
+    ``correct_answer``, ``rubric_keywords``, ``min_words`` and ``max_words``.
+    ``answers`` is a list of ``(answer_id, question_id, answer_text)``.
+    Returns a list of dicts ready for a bulk ``UPDATE`` of ``Answer``.
+    """
+    question_ids = [qid for qid, q in questions.items()
+                    if (q.correct_answer or '').strip() or _load_keywords(q.rubric_keywords)]
+    if not question_ids:
+        return []
+    question_index = {qid: i for i, qid in enumerate(question_ids)}
+    answers = [a for a in answers if a[1] in question_index]
+    if not answers:
+        return []
+
+    # Text beyond max_words is not marked
+    texts, counts, truncated = [], [], []
+    for _, question_id, text in answers:
+        words = (text or '').split()
+        limit = questions[question_id].max_words
+        truncated.append(bool(limit) and len(words) > limit)
+        counts.append(len(words))
+        texts.append(' '.join(words[:limit]) if limit else ' '.join(words))
+
+    vocabulary = {}
+    answer_terms = _term_matrix([tokenize(t) for t in texts], vocabulary)
+    model_terms = _term_matrix([tokenize(questions[qid].correct_answer) for qid in question_ids], vocabulary)
+
+    keywords, keyword_question = [], []
+    for qid in question_ids:
+        for keyword in _load_keywords(questions[qid].rubric_keywords):
+            if tokenize(keyword):
+                keywords.append(keyword)
+                keyword_question.append(question_index[qid])
+    keyword_terms = _term_matrix([tokenize(k) for k in keywords], vocabulary)
+
+    n_terms = max(len(vocabulary), 1)
+    answer_counts = _to_csr(answer_terms, (len(answers), n_terms))
+    model_counts = _to_csr(model_terms, (len(question_ids), n_terms))
+
+    # IDF over everything written for this assessment
+    document_frequency = np.bincount(answer_counts.indices, minlength=n_terms) \
+        + np.bincount(model_counts.indices, minlength=n_terms)
+    n_documents = answer_counts.shape[0] + model_counts.shape[0]
+    idf = np.log((1.0 + n_documents) / (1.0 + document_frequency)) + 1.0
+
+    answer_question = np.array([question_index[a[1]] for a in answers])
+
+    # Cosine similarity of each answer with its own question's model answer
+    answer_vectors = _tfidf(answer_counts, idf)
+    model_vectors = _tfidf(model_counts, idf)
+    similarity = np.asarray(answer_vectors.multiply(model_vectors[answer_question]).sum(axis=1)).ravel()
+
+    # A keyword is covered when all of its tokens appear in the answer
+    n_keywords = len(keywords)
+    if n_keywords:
+        keyword_matrix = _to_csr(keyword_terms, (n_keywords, n_terms))
+        keyword_matrix.data[:] = 1.0
+        keyword_lengths = np.asarray(keyword_matrix.sum(axis=1)).ravel()
+        present = answer_counts.copy()
+        present.data[:] = 1.0
+        matched = (present @ keyword_matrix.T).tocsr()
+        matched.data = (matched.data >= keyword_lengths[matched.indices]).astype(np.float64)
+        membership = sparse.csr_matrix(
+            (np.ones(n_keywords), (keyword_question, np.arange(n_keywords))),
+            shape=(len(question_ids), n_keywords))
+        hits = matched.multiply(membership[answer_question]).tocsr()
+        hits.eliminate_zeros()
+        keyword_totals = np.asarray(membership.sum(axis=1)).ravel()[answer_question]
+    else:
+        hits = sparse.csr_matrix((len(answers), 0))
+        keyword_totals = np.zeros(len(answers))
+        membership = sparse.csr_matrix((len(question_ids), 0))
+
+    coverage = np.divide(np.asarray(hits.sum(axis=1)).ravel(), keyword_totals,
+                         out=np.zeros(len(answers)), where=keyword_totals > 0)
+    has_model = np.array([bool((questions[qid].correct_answer or '').strip()) for qid in question_ids])[answer_question]
+    has_keywords = keyword_totals > 0
+
+    closeness = np.minimum(similarity / FULL_SIMILARITY, 1.0)
+    fraction = np.where(has_model & has_keywords, 0.5 * closeness + 0.5 * coverage,
+                        np.where(has_model, closeness, coverage))
+
+    scored_at = datetime.utcnow()
+    results = []
+    for i, (answer_id, question_id, _) in enumerate(answers):
+        question = questions[question_id]
+        feedback = []
+        share = fraction[i]
+
+        if question.min_words and counts[i] < question.min_words:
+            share *= counts[i] / question.min_words
+            feedback.append(f'Jawapan terlalu pendek: {counts[i]} perkataan (minimum {question.min_words}).')
+        if truncated[i]:
+            feedback.append(f'Jawapan melebihi had {question.max_words} perkataan; '
+                            f'hanya {question.max_words} perkataan pertama dinilai.')
+
+        if has_keywords[i]:
+            found = set(hits.indices[hits.indptr[i]:hits.indptr[i + 1]])
+            row = membership[answer_question[i]]
+            expected = row.indices
+            covered = [keywords[k] for k in expected if k in found]
+            missing = [keywords[k] for k in expected if k not in found]
+            if covered:
+                feedback.append(f'Kata kunci ditemui: {", ".join(covered)}.')
+            if missing:
+                feedback.append(f'Kata kunci yang tiada: {", ".join(missing)}.')
+        if has_model[i]:
+            feedback.append(f'Persamaan dengan skema jawapan: {similarity[i]:.0%}.')
+
+        marks = question.marks or 0
+        results.append({
+            'id': answer_id,
+            'marks_obtained': min(round(share * marks * 2) / 2, marks),
+            'feedback': ' '.join(feedback),
+            'auto_scored_at': scored_at,
+        })
+
+    return results
+
+
+def score_assessment(assessment_id, batch_size=5000):
+    """Write suggested marks for every unscored answer of a submitted attempt"""
+    questions = {q.id: q for q in db.session.execute(
+        select(Question.id, Question.marks, Question.correct_answer, Question.rubric_keywords,
+               Question.min_words, Question.max_words)
+        .where(Question.assessment_id == assessment_id)
+    )}
+
+    scored = 0
+    attempt_ids = set()
+    last_id = 0
+    while True:
+        batch = db.session.execute(
+            select(Answer.id, Answer.question_id, Answer.answer_text, Answer.attempt_id, AssessmentAttempt.user_id)
+            .join(AssessmentAttempt, Answer.attempt_id == AssessmentAttempt.id)
+            .where(AssessmentAttempt.assessment_id == assessment_id,
+                   AssessmentAttempt.status == 'submitted',
+                   Answer.auto_scored_at.is_(None),
+                   Answer.id > last_id)
+            .order_by(Answer.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+
+        results = score_answers(questions, [(row.id, row.question_id, row.answer_text) for row in batch])
+        scored_ids = {r['id'] for r in results}
+        # A question with neither a model answer nor keywords cannot be scored;
+        # stamp its answers without marks so later runs do not fetch them again
+        unscorable = [{'id': row.id, 'auto_scored_at': datetime.utcnow()} for row in batch if row.id not in scored_ids]
+        if results:
+            db.session.execute(update(Answer), results)
+            answered = {row.id: (row.user_id, row.question_id) for row in batch}
+            record_reviews([
+                (*answered[r['id']], answer_quality(r['marks_obtained'], questions[answered[r['id']][1]].marks))
+                for r in results
+            ])
+        if unscorable:
+            db.session.execute(update(Answer), unscorable)
+        db.session.commit()
+        scored += len(results)
+        attempt_ids.update(row.attempt_id for row in batch if row.id in scored_ids)
+
+    return {'assessment_id': assessment_id, 'scored': scored, 'attempt_ids': sorted(attempt_ids)}
@@ -0,0 +1,186 @@
+"""Batched replay of events queued by an offline client.
+
+A client that was offline sends its whole queue to ``/api/sync`` as an
+ordered list of ``{key, type, payload, occurred_at}`` events. The batch is
+applied in one transaction: receipts already stored for the user's keys
+are looked up with one SELECT, every new event becomes a row for its
+table, and each table gets one multi-row upsert. Within a batch a later
+event for the same progress topic or draft wins, matching the order the
+client produced them. Each key gets a ``SyncReceipt`` row, so a retried
+batch reports the events as duplicates and does not apply them again.
+"""
+import json
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db
+from app.models import Progress, SubjectiveDraft, SyncReceipt
+from app.services.activity import note_activity
+from app.services.bulk import upsert
+
+MAX_EVENTS = 200
+RECEIPT_RETENTION_DAYS = 30
+
+
+class SyncConflict(Exception):
+    """Another request stored one of the batch's keys while it was being applied"""
+
+
+class InvalidEvent(ValueError):
+    pass
+
+
+def _text(payload, field, max_length):
+    value = payload.get(field)
+    if not isinstance(value, str) or not value.strip():
+        raise InvalidEvent(f'{field} is required')
+    return value.strip()[:max_length]
+
+
+def _integer(payload, field, default=None):
+    value = payload.get(field, default)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise InvalidEvent(f'{field} must be an integer')
+
+
+def _progress(user_id, payload, occurred_at):
+    subject = _text(payload, 'subject', 100)
+    section = _text(payload, 'section', 150)
+    topic = (f'Bab {_integer(payload, "chapter")}: {section}' if 'chapter' in payload else section)[:200]
+    row = {'user_id': user_id, 'subject': subject, 'topic': topic,
+           'completed': True, 'last_accessed': occurred_at}
+    return (subject, topic), row
+
+
+def _subjective_draft(user_id, payload, occurred_at):
+    subject = _text(payload, 'subject', 100)
+    chapter = _integer(payload, 'chapter')
+    answers = payload.get('answers')
+    if not isinstance(answers, dict):
+        raise InvalidEvent('answers must be an object')
+    row = {'user_id': user_id, 'subject': subject, 'chapter': chapter,
+           'answers': json.dumps(answers), 'time_spent': _integer(payload, 'time_spent', 0),
+           'saved_at': occurred_at}
+    return (subject, chapter), row
+
+
+# Event type -> (model, unique key columns, row builder)
+HANDLERS = {
+    'progress': (Progress, ['user_id', 'subject', 'topic'], _progress),
+    'subjective_draft': (SubjectiveDraft, ['user_id', 'subject', 'chapter'], _subjective_draft),
+}
+
+
+def _occurred_at(value, now):
+    if not value:
+        return now
+    try:
+        moment = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise InvalidEvent('occurred_at must be an ISO 8601 timestamp')
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    # Client clocks run fast too
+    return min(moment, now)
+
+
+def _write(user_id, rows_by_type):
+    for event_type, rows in rows_by_type.items():
+        model, index_elements, _ = HANDLERS[event_type]
+        upsert(model, list(rows.values()), index_elements)
+        if event_type == 'progress':
+            for row in rows.values():
+                note_activity(db.session, user_id, row['last_accessed'])
+
+
+def apply_event(user_id, event_type, payload):
+    """Apply a single live event without an idempotency receipt. The caller commits."""
+    now = datetime.utcnow()
+    _, _, build = HANDLERS[event_type]
+    key, row = build(user_id, payload or {}, now)
+    _write(user_id, {event_type: {key: row}})
+
+
+def apply_events(user_id, events):
+    """Apply an ordered batch of events and commit
+
+    Returns one ``{'key', 'status'[, 'error']}`` per event, in order, with
+    status ``applied``, ``duplicate`` or ``invalid``. Raises
+    ``SyncConflict`` if a concurrent request stored one of the keys first;
+    nothing is applied and the client should retry.
+    """
+    now = datetime.utcnow()
+    keys = [str(e.get('key') or '')[:64] if isinstance(e, dict) else '' for e in events]
+    stored = set()
+    wanted = [k for k in keys if k]
+    for start in range(0, len(wanted), 500):
+        stored.update(db.session.execute(
+            select(SyncReceipt.idempotency_key)
+            .where(SyncReceipt.user_id == user_id,
+                   SyncReceipt.idempotency_key.in_(wanted[start:start + 500]))
+        ).scalars())
+
+    results, receipts, seen = [], [], set()
+    rows_by_type = {}
+    for key, event in zip(keys, events):
+        if not key:
+            results.append({'key': None, 'status': 'invalid', 'error': 'key is required'})
+            continue
+        if key in stored or key in seen:
+            results.append({'key': key, 'status': 'duplicate'})
+            continue
+        seen.add(key)
+
+        event_type = event.get('type')
+        try:
+            if event_type not in HANDLERS:
+                raise InvalidEvent(f'Unknown event type {event_type!r}')
+            payload = event.get('payload')
+            if not isinstance(payload, dict):
+                raise InvalidEvent('payload must be an object')
+            _, _, build = HANDLERS[event_type]
+            natural_key, row = build(user_id, payload, _occurred_at(event.get('occurred_at'), now))
+        except InvalidEvent as e:
+            results.append({'key': key, 'status': 'invalid', 'error': str(e)})
+            receipts.append({'user_id': user_id, 'idempotency_key': key,
+                             'event_type': str(event_type)[:50], 'status': 'invalid', 'created_at': now})
+            continue
+
+        # Later events for the same row replace earlier ones
+        rows = rows_by_type.setdefault(event_type, {})
+        rows.pop(natural_key, None)
+        rows[natural_key] = row
+        results.append({'key': key, 'status': 'applied'})
+        receipts.append({'user_id': user_id, 'idempotency_key': key,
+                         'event_type': event_type, 'status': 'applied', 'created_at': now})
+
+    try:
+        _write(user_id, rows_by_type)
+        if receipts:
+            # A plain INSERT: a key stored concurrently must fail the batch, not be skipped
+            db.session.execute(insert(SyncReceipt), receipts)
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        raise SyncConflict(str(e.orig)) from e
+    return results
+
+
+def purge_receipts(days=RECEIPT_RETENTION_DAYS, batch_size=10000):
+    """Delete receipts older than ``days``; clients do not retry that late"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    deleted = 0
+    while True:
+        ids = db.session.execute(
+            select(SyncReceipt.id).where(SyncReceipt.created_at < cutoff).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+        db.session.execute(delete(SyncReceipt).where(SyncReceipt.id.in_(ids)))
+        db.session.commit()
+        deleted += len(ids)
+    return deleted
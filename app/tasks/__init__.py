@@ -1,3 +1,4 @@
-from .worker import *
+from .queues import QUEUES, enqueue, get_queue, queue_stats
+from .worker import AppWorker, Supervisor
 
-__all__ = ['listen', 'conn']
\ No newline at end of file
+__all__ = ['QUEUES', 'enqueue', 'get_queue', 'queue_stats', 'AppWorker', 'Supervisor']
@@ -0,0 +1,17 @@
+from app.services.adaptive import fit_all, next_fit_run
+from app.tasks.queues import get_queue
+
+
+def fit_item_parameters(reschedule=True):
+    """Refit IRT item parameters for every subject, then book the next night's run"""
+    results = fit_all()
+    if reschedule:
+        schedule_item_fits()
+    return results
+
+
+def schedule_item_fits():
+    run_at = next_fit_run()
+    # One job id per night, so scheduling twice books a single run
+    return get_queue('analytics').enqueue_at(
+        run_at, fit_item_parameters, job_id=f'fit-item-parameters-{run_at:%Y%m%d}')
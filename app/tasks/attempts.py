@@ -0,0 +1,22 @@
+from datetime import datetime, timedelta, timezone
+
+from app.services.attempts import EXPIRY_INTERVAL, expire_attempts
+from app.tasks.queues import get_queue
+
+
+def expire_timed_attempts(batch_size=200, reschedule=True):
+    """Submit every timed attempt that ran out, then book the next check"""
+    try:
+        expired = expire_attempts(batch_size)
+    finally:
+        if reschedule:
+            schedule_attempt_expiry()
+    return {'expired': expired}
+
+
+def schedule_attempt_expiry():
+    now = datetime.now(timezone.utc)
+    run_at = now + timedelta(seconds=EXPIRY_INTERVAL - now.timestamp() % EXPIRY_INTERVAL)
+    # One job id per slot, so scheduling twice books a single run
+    return get_queue('grading').enqueue_at(
+        run_at, expire_timed_attempts, job_id=f'expire-attempts-{int(run_at.timestamp())}')
@@ -0,0 +1,29 @@
+from sqlalchemy import func, select
+
+from app.extensions import db
+from app.models import Answer, Assessment, AssessmentAttempt
+from app.services.events import publish
+from app.services.subjective_scoring import score_assessment
+
+
+def score_subjective_assessment(assessment_id):
+    """Suggest marks for every submitted, unscored answer of an assessment"""
+    result = score_assessment(assessment_id)
+    if result['attempt_ids']:
+        notify_scored_attempts(result['attempt_ids'])
+    return result
+
+
+def notify_scored_attempts(attempt_ids):
+    """Tell each student their suggested marks are in"""
+    rows = db.session.execute(
+        select(AssessmentAttempt.user_id, AssessmentAttempt.total_marks, Assessment.title,
+               func.sum(Answer.marks_obtained))
+        .join(Assessment, AssessmentAttempt.assessment_id == Assessment.id)
+        .join(Answer, Answer.attempt_id == AssessmentAttempt.id)
+        .where(AssessmentAttempt.id.in_(attempt_ids))
+        .group_by(AssessmentAttempt.id, AssessmentAttempt.user_id, AssessmentAttempt.total_marks, Assessment.title)
+    ).all()
+    for user_id, total_marks, title, marks in rows:
+        publish(user_id, 'grading',
+                f'Jawapan anda untuk "{title}" telah dinilai: {marks or 0:g}/{total_marks or 0} markah (cadangan).')
@@ -0,0 +1,142 @@
+"""Named RQ queues, deduplicated enqueueing and queue latency metrics"""
+import uuid
+from datetime import datetime, timezone
+
+from rq import Queue
+from rq.job import Job, JobStatus
+from rq.exceptions import NoSuchJobError
+
+from app.extensions import get_redis
+
+# Highest priority first. A worker dedicated to one queue also drains every
+# queue above it, never the ones below, so a long export can only ever hold
+# up exports and analytics.
+QUEUES = ['grading', 'notifications', 'exports', 'analytics']
+
+DEDUP_PREFIX = 'cikgu:dedup:'
+LATENCY_PREFIX = 'cikgu:queue-latency:'
+LATENCY_SAMPLES = 1000
+
+# Delete the dedup key only if it still belongs to the job being started
+_RELEASE_DEDUP = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Hand the dedup key to a new job only if it still holds ARGV[1], the
+# finished holder that was checked ('' when the key had gone)
+_TAKE_OVER_DEDUP = """
+if (redis.call('GET', KEYS[1]) or '') == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+def queues_for(name):
+    """Queue names a worker dedicated to ``name`` listens on, in priority order"""
+    return QUEUES[:QUEUES.index(name) + 1]
+
+
+def get_queue(name, connection=None):
+    if name not in QUEUES:
+        raise ValueError(f'Unknown queue {name!r}')
+    return Queue(name, connection=connection or get_redis())
+
+
+def enqueue(queue_name, func, *args, dedup_key=None, dedup_ttl=3600, connection=None, **kwargs):
+    """Enqueue ``func`` on a named queue
+
+    With ``dedup_key`` (e.g. ``f'user-stats:{user_id}'``) the call is a no-op
+    while an earlier job with the same key is still waiting; that job is
+    returned instead. The key is released as soon as the job starts, so work
+    enqueued mid-run is not lost.
+    """
+    connection = connection or get_redis()
+    queue = get_queue(queue_name, connection)
+
+    if dedup_key is None:
+        return queue.enqueue(func, *args, **kwargs)
+
+    key = DEDUP_PREFIX + dedup_key
+    job_id = str(uuid.uuid4())
+    while not connection.set(key, job_id, nx=True, ex=dedup_ttl):
+        existing_id = (connection.get(key) or b'').decode()
+        if existing_id:
+            try:
+                existing = Job.fetch(existing_id, connection=connection)
+                if existing.get_status() in (JobStatus.QUEUED, JobStatus.SCHEDULED, JobStatus.DEFERRED):
+                    return existing
+            except NoSuchJobError:
+                pass
+        # The holder finished or vanished without releasing the key. If
+        # another caller took it over first, look at their job instead.
+        if connection.eval(_TAKE_OVER_DEDUP, 1, key, existing_id, job_id, dedup_ttl):
+            break
+
+    return queue.enqueue(func, *args, job_id=job_id, meta={'dedup_key': key}, **kwargs)
+
+
+def release_dedup_key(job, connection):
+    key = job.meta.get('dedup_key')
+    if key:
+        connection.eval(_RELEASE_DEDUP, 1, key, job.id)
+
+
+def record_latency(job, connection):
+    """Record how long ``job`` waited between being enqueued and starting"""
+    if job.enqueued_at is None:
+        return
+    enqueued_at = job.enqueued_at
+    if enqueued_at.tzinfo is None:
+        enqueued_at = enqueued_at.replace(tzinfo=timezone.utc)
+    wait = max((datetime.now(timezone.utc) - enqueued_at).total_seconds(), 0.0)
+
+    key = LATENCY_PREFIX + job.origin
+    with connection.pipeline() as pipe:
+        pipe.hincrby(key, 'count', 1)
+        pipe.hincrbyfloat(key, 'wait_seconds_total', wait)
+        pipe.lpush(key + ':samples', wait)
+        pipe.ltrim(key + ':samples', 0, LATENCY_SAMPLES - 1)
+        pipe.execute()
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def queue_stats(connection=None):
+    """Depth, oldest waiting job and wait-time percentiles for every queue"""
+    connection = connection or get_redis()
+    stats = {}
+    for name in QUEUES:
+        queue = Queue(name, connection=connection)
+        key = LATENCY_PREFIX + name
+        totals = connection.hgetall(key)
+        samples = [float(v) for v in connection.lrange(key + ':samples', 0, -1)]
+
+        oldest_wait = None
+        head = queue.get_job_ids(0, 1)
+        if head:
+            job = queue.fetch_job(head[0])
+            if job is not None and job.enqueued_at is not None:
+                enqueued_at = job.enqueued_at
+                if enqueued_at.tzinfo is None:
+                    enqueued_at = enqueued_at.replace(tzinfo=timezone.utc)
+                oldest_wait = (datetime.now(timezone.utc) - enqueued_at).total_seconds()
+
+        stats[name] = {
+            'depth': queue.count,
+            'oldest_wait_seconds': oldest_wait,
+            'started_total': int(totals.get(b'count', 0)),
+            'wait_seconds_total': float(totals.get(b'wait_seconds_total', 0)),
+            'wait_p50_seconds': _percentile(samples, 0.50),
+            'wait_p95_seconds': _percentile(samples, 0.95),
+        }
+    return stats
@@ -0,0 +1,17 @@
+from app.services.reviews import next_queue_size_run, precompute_queue_sizes
+from app.tasks.queues import get_queue
+
+
+def precompute_review_queues(reschedule=True):
+    """Store every active user's review queue size, then book the next night's run"""
+    users = precompute_queue_sizes()
+    if reschedule:
+        schedule_review_queues()
+    return {'users': users}
+
+
+def schedule_review_queues():
+    run_at = next_queue_size_run()
+    # One job id per night, so scheduling twice books a single run
+    return get_queue('analytics').enqueue_at(
+        run_at, precompute_review_queues, job_id=f'review-queue-sizes-{run_at:%Y%m%d}')
@@ -0,0 +1,22 @@
+from datetime import datetime, timedelta, timezone
+
+from app.services.study_rollups import SETTLE_SECONDS, refresh_rollups, sessions_waiting
+from app.tasks.queues import get_queue
+
+
+def refresh_study_rollups():
+    """Fold new study sessions into the daily and weekly rollups"""
+    processed = refresh_rollups()
+    if sessions_waiting():
+        # Sessions still settling are picked up by a later run
+        schedule_rollup_refresh()
+    return processed
+
+
+def schedule_rollup_refresh():
+    now = datetime.now(timezone.utc)
+    # The first slot boundary after everything inserted so far has settled.
+    # One job id per slot, so scheduling twice books a single run
+    run_at = now + timedelta(seconds=2 * SETTLE_SECONDS - now.timestamp() % SETTLE_SECONDS)
+    return get_queue('analytics').enqueue_at(
+        run_at, refresh_study_rollups, job_id=f'study-rollups-{int(run_at.timestamp())}')
@@ -1,12 +1,152 @@
+"""Prefork RQ worker supervisor.
+
+The supervisor builds the Flask app once and forks the configured number of
+workers per queue from it, so imports, config and model metadata are shared
+copy-on-write instead of being rebuilt by every worker. RQ then forks a
+work horse per job from those workers, which is equally cheap.
+"""
+import logging
+import os
+import signal
+import time
+
 import redis
-from rq import Worker, Queue, Connection
+from rq import Worker
+
+from app.extensions import db
+from app.tasks.queues import QUEUES, queues_for, release_dedup_key, record_latency
+
+log = logging.getLogger(__name__)
+
+
+class AppWorker(Worker):
+    """RQ worker that runs every job inside an app context"""
+
+    def __init__(self, *args, app=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.app = app
+
+    def prepare_job_execution(self, job, remove_from_intermediate_queue=False):
+        super().prepare_job_execution(job, remove_from_intermediate_queue)
+        release_dedup_key(job, self.connection)
+        record_latency(job, self.connection)
+
+    def perform_job(self, job, queue):
+        with self.app.app_context():
+            try:
+                return super().perform_job(job, queue)
+            finally:
+                db.session.remove()
+
+
+def parse_processes(spec):
+    """Parse ``"grading=2,exports=1"`` into ``{'grading': 2, 'exports': 1}``"""
+    processes = {}
+    for part in spec.split(','):
+        if not part.strip():
+            continue
+        name, _, count = part.partition('=')
+        name = name.strip()
+        if name not in QUEUES:
+            raise ValueError(f'Unknown queue {name!r} in worker process spec')
+        processes[name] = int(count or 1)
+    return processes
+
+
+class Supervisor:
+    """Fork, watch and restart the worker processes"""
+
+    restart_delay = 1
+
+    def __init__(self, app, processes):
+        self.app = app
+        self.processes = processes
+        self.children = {}  # pid -> (queue name, slot)
+        self.stopping = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        self._book_schedules()
+
+        for name, count in self.processes.items():
+            for slot in range(count):
+                self._spawn(name, slot)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+
+            name, slot = self.children.pop(pid, (None, None))
+            if name is None or self.stopping:
+                continue
+            log.warning('Worker %s/%d (pid %d) exited with status %d, restarting', name, slot, pid, status)
+            time.sleep(self.restart_delay)
+            self._spawn(name, slot)
+
+    def _book_schedules(self):
+        # Each of these self-rescheduling jobs books one job id per slot, so
+        # calling them on every start keeps the chains alive without doubling
+        # them up. Imported here: the services import app.tasks themselves
+        from app.tasks.adaptive import schedule_item_fits
+        from app.tasks.attempts import schedule_attempt_expiry
+        from app.tasks.reviews import schedule_review_queues
+
+        with self.app.app_context():
+            for schedule in (schedule_attempt_expiry, schedule_review_queues, schedule_item_fits):
+                try:
+                    schedule()
+                except redis.RedisError:
+                    log.warning('Could not book %s', schedule.__name__, exc_info=True)
+
+    def _stop(self, signum, frame):
+        # RQ workers treat the first SIGTERM as a warm shutdown: finish the
+        # current job, then exit
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _spawn(self, name, slot):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = (name, slot)
+            return
+
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            self._work(name)
+        except Exception:
+            log.exception('Worker %s/%d crashed', name, slot)
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _work(self, name):
+        with self.app.app_context():
+            # Pooled connections inherited from the parent must not be reused
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+        connection = redis.from_url(self.app.config['REDIS_URL'])
+        worker = AppWorker(queues_for(name), connection=connection, app=self.app)
+        worker.work(with_scheduler=True)
+
 
-listen = ['default']
+def run(app):
+    processes = parse_processes(app.config['WORKER_PROCESSES'])
+    Supervisor(app, processes).run()
 
-redis_url = 'redis://redis:6379/0'
-conn = redis.from_url(redis_url)
 
 if __name__ == '__main__':
-    with Connection(conn):
-        worker = Worker(list(map(Queue, listen)))
-        worker.work()
\ No newline at end of file
+    from app import app
+    logging.basicConfig(level=logging.INFO)
+    run(app)
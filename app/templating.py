@@ -0,0 +1,196 @@
+"""Template compile and fragment caching.
+
+Compiled templates go to a ``FileSystemBytecodeCache`` directory shared by
+every worker on the host, so a fresh worker loads bytecode instead of
+parsing and compiling each template again.
+
+``{% cache 'name' %}...{% endcache %}`` stores the rendered HTML of a
+block. The key is the name and any extra expressions given after it, plus
+the viewer's role, the locale and ``TEMPLATE_CACHE_VERSION``, so nothing
+that depends on the individual user may go inside a cache block. Fragments
+are kept in a per-process LRU and in Redis, which lets a new worker reuse
+what the others already rendered. Redis errors only cost a re-render.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from flask import current_app, g
+from flask_login import current_user
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from app.extensions import get_redis
+
+FRAGMENT_PREFIX = 'cikgu:fragment:'
+FRAGMENT_TTL = 24 * 3600
+LRU_SIZE = 512
+REDIS_RETRY_SECONDS = 30
+
+log = logging.getLogger(__name__)
+
+
+def template_version(folder):
+    """Fingerprint of the template files, so a deploy with changed templates gets fresh keys"""
+    digest = hashlib.sha1()
+    for root, _, files in sorted(os.walk(folder)):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            digest.update(f'{os.path.relpath(path, folder)}:{stat.st_size}:{int(stat.st_mtime)}'.encode())
+    return digest.hexdigest()[:12]
+
+
+class FragmentCache:
+    """A small thread-safe LRU in front of Redis"""
+
+    def __init__(self, size=LRU_SIZE):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis_down_until = 0.0
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def _remember(self, key, html):
+        with self._lock:
+            self._items[key] = html
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def _redis(self):
+        if time.monotonic() < self._redis_down_until:
+            return None
+        return get_redis()
+
+    def _redis_failed(self, e):
+        # Don't pay a connection attempt on every fragment while Redis is away
+        self._redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+        log.warning('Fragment cache is skipping Redis for %ss: %s', REDIS_RETRY_SECONDS, e)
+
+    def get_or_render(self, key, render):
+        with self._lock:
+            html = self._items.get(key)
+            if html is not None:
+                self._items.move_to_end(key)
+                return html
+
+        redis_key = FRAGMENT_PREFIX + hashlib.sha1(repr(key).encode()).hexdigest()
+        connection = self._redis()
+        if connection is not None:
+            try:
+                cached = connection.get(redis_key)
+            except redis.RedisError as e:
+                self._redis_failed(e)
+                connection, cached = None, None
+            if cached is not None:
+                html = cached.decode()
+                self._remember(key, html)
+                return html
+
+        html = str(render())
+        self._remember(key, html)
+        if connection is not None:
+            try:
+                connection.set(redis_key, html, ex=FRAGMENT_TTL)
+            except redis.RedisError as e:
+                self._redis_failed(e)
+        return html
+
+
+fragments = FragmentCache()
+
+
+def viewer_role():
+    if not current_user or not current_user.is_authenticated:
+        return 'guest'
+    return current_user.role or 'student'
+
+
+class FragmentCacheExtension(Extension):
+    """``{% cache 'name'[, extra, ...] %}...{% endcache %}``"""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [nodes.Const(parser.name), parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.List(parts)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, parts, caller):
+        config = current_app.config
+        if not config.get('TEMPLATE_FRAGMENT_CACHE', True):
+            return caller()
+        key = (*parts, viewer_role(), getattr(g, 'locale', None) or config['TEMPLATE_LOCALE'],
+               config['TEMPLATE_CACHE_VERSION'])
+        return Markup(fragments.get_or_render(key, caller))
+
+
+def init_templating(app):
+    """Install the bytecode cache and the ``{% cache %}`` tag. Call before the first render."""
+    if not app.config.get('TEMPLATE_CACHE_VERSION'):
+        app.config['TEMPLATE_CACHE_VERSION'] = template_version(os.path.join(app.root_path, app.template_folder))
+    options = dict(app.jinja_options)
+    options['extensions'] = [*options.get('extensions', ()), FragmentCacheExtension]
+    directory = app.config.get('TEMPLATE_BYTECODE_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        options['bytecode_cache'] = FileSystemBytecodeCache(directory)
+    app.jinja_options = options
+
+
+def _timed(render, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        render()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def benchmark(app, template_names, iterations=200, cold_iterations=20):
+    """Milliseconds per render of each template, without and with each cache
+
+    Returns ``{name: {'cold': (without, with), 'warm': (without, with)}}``.
+    Cold renders build a fresh Jinja environment each time, as a new worker
+    would, and compare compiling from source with loading bytecode. Warm
+    renders reuse the compiled template and compare fragment caching off
+    and on. Runs as an anonymous visitor.
+    """
+    bytecode_cache = app.jinja_options.get('bytecode_cache')
+    fragment_setting = app.config.get('TEMPLATE_FRAGMENT_CACHE', True)
+    results = {}
+    with app.test_request_context('/'):
+        context = {}
+        app.update_template_context(context)
+        try:
+            for name in template_names:
+                cold = []
+                for cache in (None, bytecode_cache):
+                    def render_cold():
+                        environment = app.create_jinja_environment()
+                        environment.bytecode_cache = cache
+                        environment.get_template(name).render(context)
+                    render_cold()  # fills the bytecode cache
+                    cold.append(_timed(render_cold, cold_iterations))
+
+                warm = []
+                template = app.jinja_env.get_template(name)
+                for enabled in (False, True):
+                    app.config['TEMPLATE_FRAGMENT_CACHE'] = enabled
+                    fragments.clear()
+                    template.render(context)
+                    warm.append(_timed(lambda: template.render(context), iterations))
+                results[name] = {'cold': tuple(cold), 'warm': tuple(warm)}
+        finally:
+            app.config['TEMPLATE_FRAGMENT_CACHE'] = fragment_setting
+    return results
@@ -401,28 +401,104 @@ self.addEventListener('sync', function(event) {
 
 async function doBackgroundSync() {
     try {
-        // Sync data with server when online
+        // Send the whole offline queue to the server in one request
         const cache = await caches.open('cikgu-cache');
         const pendingRequests = await cache.match('/pending-requests');
 
-        if (pendingRequests) {
-            const requests = await pendingRequests.json();
-            for (const request of requests) {
-                try {
-                    await fetch(request.url, request.options);
-                } catch (error) {
-                    console.error('Failed to sync request:', error);
-                }
+        let events = pendingRequests ? await pendingRequests.json() : [];
+        while (events.length) {
+            const batch = events.slice(0, 200);
+            const response = await fetch('/api/sync', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ events: batch })
+            });
+            if (!response.ok) {
+                throw new Error('Sync rejected with status ' + response.status);
             }
 
-            await cache.delete('/pending-requests');
+            // Applied, duplicate and invalid events are all settled; keep anything queued meanwhile
+            const data = await response.json();
+            const settled = new Set(data.results.map(result => result.key));
+            const latest = await cache.match('/pending-requests');
+            events = latest ? (await latest.json()).filter(event => !settled.has(event.key)) : [];
+            if (events.length) {
+                await cache.put('/pending-requests', new Response(JSON.stringify(events), {
+                    headers: { 'Content-Type': 'application/json' }
+                }));
+            } else {
+                await cache.delete('/pending-requests');
+            }
         }
     } catch (error) {
         console.error('Background sync failed:', error);
+        throw error;
     }
 }
 `;
 
+// Offline queue: events are kept in the cache under /pending-requests and
+// replayed in one /api/sync request by the service worker, or by the page
+// when background sync is not available
+// Events sharing a collapseKey (e.g. autosaved drafts of one assessment)
+// replace each other, so a long offline stretch queues only the latest.
+async function queueEvent(type, payload, collapseKey = null) {
+    const cache = await caches.open('cikgu-cache');
+    const existing = await cache.match('/pending-requests');
+    let events = existing ? await existing.json() : [];
+    if (collapseKey) {
+        events = events.filter(event => event.collapse !== collapseKey);
+    }
+    events.push({
+        key: crypto.randomUUID(),
+        type: type,
+        payload: payload,
+        collapse: collapseKey,
+        occurred_at: new Date().toISOString()
+    });
+    await cache.put('/pending-requests', new Response(JSON.stringify(events), {
+        headers: { 'Content-Type': 'application/json' }
+    }));
+
+    if ('serviceWorker' in navigator && 'SyncManager' in window) {
+        const registration = await navigator.serviceWorker.ready;
+        await registration.sync.register('background-sync');
+    }
+}
+
+async function syncPendingEvents() {
+    const cache = await caches.open('cikgu-cache');
+    const pending = await cache.match('/pending-requests');
+    let events = pending ? await pending.json() : [];
+
+    while (events.length) {
+        const response = await fetch('/api/sync', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ events: events.slice(0, 200) })
+        });
+        if (!response.ok) {
+            return;
+        }
+
+        const data = await response.json();
+        const settled = new Set(data.results.map(result => result.key));
+        const latest = await cache.match('/pending-requests');
+        events = latest ? (await latest.json()).filter(event => !settled.has(event.key)) : [];
+        if (events.length) {
+            await cache.put('/pending-requests', new Response(JSON.stringify(events), {
+                headers: { 'Content-Type': 'application/json' }
+            }));
+        } else {
+            await cache.delete('/pending-requests');
+        }
+    }
+}
+
+window.addEventListener('online', () => {
+    syncPendingEvents().catch(error => console.error('Failed to sync offline events:', error));
+});
+
 // Create and register service worker
 function createServiceWorker() {
     const blob = new Blob([serviceWorkerCode], { type: 'application/javascript' });
@@ -501,5 +577,7 @@ window.cikgu = {
     showNotification,
     formatDate,
     updateProgress,
+    queueEvent,
+    syncPendingEvents,
     pushManager: new PushNotificationManager()
 };
\ No newline at end of file